@@ -35,6 +35,14 @@ def register_extensions(app):
     extensions.ma.init_app(app)
     extensions.cas.init_app(app)
     extensions.swagger.init_app(app)
+    # after_request handlers run in reverse order: timing and metrics must see the body as compressed
+    extensions.timing.init_app(app)
+    extensions.metrics.init_app(app)
+    extensions.compress.init_app(app)
+    extensions.cache.init_app(app)
+    extensions.push_queue.init_app(app)
+    extensions.live_feed.init_app(app)
+    extensions.latest.init_app(app)
 
 
 def register_blueprints(app):
@@ -45,5 +53,9 @@ def register_blueprints(app):
 def register_commands(app):
     """Register Click commands for the Flask CLI"""
     app.cli.add_command(commands.create_db_tables)
+    app.cli.add_command(commands.ingest)
+    app.cli.add_command(commands.backfill_building_ids)
+    app.cli.add_command(commands.rollup_refresh)
+    app.cli.add_command(commands.partitions)
     app.cli.add_command(commands.test)
     app.cli.add_command(commands.list_routes)
@@ -0,0 +1,178 @@
+"""
+Read-through cache of readings query results.
+
+Results are kept in an in-process LRU, and optionally in a shared Redis (or Redis-compatible) server so that
+every gunicorn worker benefits from a query run by any of them. Empty results are not cached.
+
+Writes of readings, by `flask ingest` or the push endpoint, bump the version of the months they wrote to (see
+api/ingest.py), and a result is cached under the versions of every month up to the end of its window, so a write
+invalidates the results of the windows reaching its month. Each worker reads the versions again at most every
+CACHE_VERSIONS_INTERVAL seconds. Windows ending more than CACHE_SETTLE_SECONDS before the newest stored reading - the
+ingest watermark, capped at the server clock - are considered settled: their results are kept for CACHE_SETTLED_TTL seconds and their responses
+marked immutable. Other windows expire after CACHE_RECENT_TTL seconds.
+
+Configure with CACHE_* settings, see api/config.py
+"""
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache(object):
+    """
+    Thread-safe, size-bounded least recently used cache with optional per-entry expiry
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (value, time.time() + ttl if ttl is not None else None)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class ReadingsCache(object):
+    """
+    Flask extension caching readings query results in a local LRU and an optional shared Redis tier
+    """
+
+    def __init__(self, app=None):
+        self.local = None
+        self.shared = None
+        # month -> version, the newest reading timestamp, and when both were read
+        self.versions = None
+        self.watermark = None
+        self.versions_read = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_ENABLED', True)
+        app.config.setdefault('CACHE_MAX_ENTRIES', 256)
+        app.config.setdefault('CACHE_MAX_ROWS', 20000)
+        app.config.setdefault('CACHE_RECENT_TTL', 60)
+        app.config.setdefault('CACHE_SETTLE_SECONDS', 60 * 60)
+        app.config.setdefault('CACHE_SETTLED_TTL', 24 * 60 * 60)
+        app.config.setdefault('CACHE_VERSIONS_INTERVAL', 5.0)
+        app.config.setdefault('CACHE_REDIS_URL', None)
+        app.config.setdefault('CACHE_KEY_PREFIX', 'gtpower:readings:')
+
+        self.local = LRUCache(app.config['CACHE_MAX_ENTRIES'])
+        if app.config['CACHE_REDIS_URL']:
+            try:
+                import redis
+            except ImportError:
+                logger.warning("CACHE_REDIS_URL is set but the 'redis' package is not installed, using the local cache only")
+            else:
+                self.shared = redis.StrictRedis.from_url(app.config['CACHE_REDIS_URL'])
+
+    def read_versions(self):
+        """
+        Read the month versions and the ingest watermark, at most every CACHE_VERSIONS_INTERVAL seconds
+        """
+        if self.versions_read is not None and \
+                time.time() - self.versions_read < current_app.config['CACHE_VERSIONS_INTERVAL']:
+            return
+        # imported here, api.models depends on the extensions this is one of
+        from api.extensions import db
+        from api.models import Power, ReadingsVersion
+
+        self.versions = dict(db.session.query(ReadingsVersion.month, ReadingsVersion.version))
+        self.watermark = db.session.query(func.max(Power.timestamp)).scalar()
+        self.versions_read = time.time()
+
+    def ttl(self, stop):
+        """
+        Seconds a response for a window ending at `stop` may be cached, or None if it never changes
+        """
+        config = current_app.config
+        self.read_versions()
+        # capped at the clock, a reading dated in the future must not settle the windows still receiving readings
+        if self.watermark is not None and \
+                stop < min(self.watermark, datetime.now()) - timedelta(seconds=config['CACHE_SETTLE_SECONDS']):
+            return None
+        return config['CACHE_RECENT_TTL']
+
+    def versioned_key(self, key, stop):
+        """
+        `key` suffixed with the sum of the versions of the months up to `stop`, which grows with every write to them
+        """
+        self.read_versions()
+        return '{0}|v{1}'.format(key, sum(version for month, version in self.versions.items() if month <= stop))
+
+    def get(self, key, stop):
+        if not current_app.config['CACHE_ENABLED']:
+            return None
+        key = self.versioned_key(key, stop)
+        rows = self.local.get(key)
+        if rows is None and self.shared is not None:
+            try:
+                value = self.shared.get(current_app.config['CACHE_KEY_PREFIX'] + key)
+                if value is not None:
+                    rows = pickle.loads(value)
+                    ttl = self.shared.ttl(current_app.config['CACHE_KEY_PREFIX'] + key)
+                    self.local.set(key, rows, ttl if ttl is not None and ttl >= 0 else None)
+            except Exception:
+                logger.exception("Shared readings cache unavailable")
+        return rows
+
+    def set(self, key, rows, stop):
+        """
+        Cache the rows of a query over a window ending at `stop`, unless there are none or too many to keep in memory
+
+        Empty results are left out, the readings of their window may just not have been ingested yet.
+        """
+        config = current_app.config
+        if not config['CACHE_ENABLED'] or not rows or len(rows) > config['CACHE_MAX_ROWS']:
+            return
+        key = self.versioned_key(key, stop)
+        ttl = self.ttl(stop)
+        if ttl is None:
+            # superseded versions of a settled entry are never read again, they still have to expire
+            ttl = config['CACHE_SETTLED_TTL']
+        self.local.set(key, rows, ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(config['CACHE_KEY_PREFIX'] + key, pickle.dumps(rows, pickle.HIGHEST_PROTOCOL), ex=ttl)
+            except Exception:
+                logger.exception("Shared readings cache unavailable")
+
+    def clear(self):
+        self.local.clear()
+        self.versions_read = None
+
+
+def cache_key(*parts):
+    """
+    Build a cache key from the parts identifying a query, e.g. query function, IDs, normalized range and parameters
+    """
+    return '|'.join('' if part is None else str(part) for part in parts)
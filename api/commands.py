@@ -4,12 +4,24 @@ Custom 'Click' commands for the Flask CLI.
 Execute with 'flask <command> <options>'
 """
 from collections import defaultdict
+from datetime import datetime
 
 import click
 from flask import current_app
 from flask.cli import with_appcontext
 
+from sqlalchemy import func, inspect
+
 from api.extensions import db
+from api.helpers import building_id_mapper, parse_timestamp
+from api.ingest import INGEST_BATCH_SIZE, IngestStats, export_format, ingest_readings, open_export, read_records
+from api.models import Power
+from api.partitions import add_months, add_partitions_statement, month_start, partition_table_statement, \
+    partitioning_supported, partitions_for, retirable_partitions, retire_statements, table_partitions
+from api.rollups import ROLLUPS, refresh_rollup
+
+# indexes of the power table replaced by ones with other columns, dropped by backfill_building_ids
+SUPERSEDED_POWER_INDEXES = ('ix_power_building_type_timestamp',)
 
 
 @click.command()
@@ -26,6 +38,199 @@ def create_db_tables():
         click.echo('Canceled.')
 
 
+@click.command()
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default=None,
+              help='Format of the files, by default guessed from their extension (.csv, .jsonl, optionally .gz).')
+@click.option('--batch-size', default=INGEST_BATCH_SIZE, help='Rows inserted per statement.')
+@with_appcontext
+def ingest(paths, fmt, batch_size):
+    """
+    Bulk load meter readings from CSV or JSON lines exports.
+
+    Files need timestamp ('YYYY-MM-DD HH:MM:SS'), type, value_read and source_name fields. Readings already in the
+    database are skipped, so interrupted loads can simply be re-run.
+    """
+
+    def progress(stats):
+        # rewrite the same line after every batch
+        click.echo('\r{0} rows read, {1} inserted ({2:.0f} rows/s)'.format(
+            stats.read, stats.inserted, stats.rows_per_second), nl=False)
+
+    stats = IngestStats()
+    for path in paths:
+        try:
+            path_format = fmt or export_format(path)
+        except ValueError as error:
+            raise click.BadParameter(str(error) + ', use --format')
+        errors = []
+
+        def on_error(line_num, error):
+            errors.append(line_num)
+            if len(errors) <= 10:
+                click.echo('\n{0} line {1}: {2}'.format(path, line_num, error), err=True)
+
+        click.echo('Loading {0}...'.format(path))
+        with open_export(path) as lines:
+            ingest_readings(read_records(lines, path_format), batch_size, stats, on_batch=progress, on_error=on_error)
+        click.echo('')
+        if len(errors) > 10:
+            click.echo('{0}: {1} malformed lines skipped in total'.format(path, len(errors)), err=True)
+
+    click.echo('{0} duplicates and {1} malformed rows skipped.'.format(stats.duplicates, stats.malformed))
+    click.echo("Run 'flask rollup-refresh' to update the rollups ('--full' if readings older than the last refresh were loaded).")
+
+
+@click.command()
+@with_appcontext
+def backfill_building_ids():
+    """
+    Add and populate power.building_id on tables created before the column existed, and bring its indexes up to date.
+    """
+
+    inspector = inspect(db.engine)
+    columns = [column['name'] for column in inspector.get_columns(Power.__tablename__)]
+    if 'building_id' not in columns:
+        click.echo('Adding power.building_id...')
+        db.engine.execute('ALTER TABLE power ADD COLUMN building_id VARCHAR(3)')
+
+    indexes = [index['name'] for index in inspector.get_indexes(Power.__tablename__)]
+    for name in SUPERSEDED_POWER_INDEXES:
+        if name in indexes:
+            click.echo('Dropping superseded index {0}...'.format(name))
+            on_table = ' ON ' + Power.__tablename__ if db.engine.dialect.name == 'mysql' else ''
+            db.engine.execute('DROP INDEX {0}{1}'.format(name, on_table))
+    for index in Power.__table__.indexes:
+        if index.name not in indexes:
+            click.echo('Creating index {0}...'.format(index.name))
+            index.create(db.engine)
+
+    # one UPDATE per sensor rather than per row - there are only a few hundred distinct source names
+    sources = db.session.query(Power.source_name).filter(Power.building_id.is_(None)).distinct().all()
+    for (source_name,) in sources:
+        db.session.query(Power).filter(Power.source_name == source_name, Power.building_id.is_(None)) \
+            .update({Power.building_id: building_id_mapper(source_name)}, synchronize_session=False)
+    db.session.commit()
+    click.echo('Updated building IDs for {0} sensors.'.format(len(sources)))
+
+
+@click.command()
+@click.option('--full', is_flag=True,
+              help='Rebuild the rollups from the oldest reading in the power table instead of from the last watermark.')
+@with_appcontext
+def rollup_refresh(full):
+    """
+    Refresh the hourly and daily power rollup tables.
+
+    Buckets older than the oldest reading in the power table, e.g. of retired months, are kept even with --full.
+    """
+
+    for model in ROLLUPS:
+        written = refresh_rollup(model, full=full)
+        click.echo('{0}: {1} buckets written.'.format(model.__tablename__, written))
+
+
+@click.group()
+def partitions():
+    """
+    Manage the monthly partitions of the power table (MySQL only).
+    """
+
+
+def partitioned_table():
+    """
+    Partitions of the power table, failing the command on databases without partitioning
+    """
+    if not partitioning_supported():
+        raise click.ClickException('Partitioning requires MySQL, this database is ' + db.engine.dialect.name)
+    return table_partitions()
+
+
+@partitions.command('list')
+@click.option('--start', default=None, help="With --stop, mark the partitions a query of this range reads.")
+@click.option('--stop', default=None, help="End of the range, formatted 'YYYY-MM-DD HH:MM:SS'.")
+@with_appcontext
+def list_partitions(start, stop):
+    """
+    List the partitions of the power table.
+    """
+
+    existing = partitioned_table()
+    if not existing:
+        click.echo("The power table is not partitioned, run 'flask partitions create'.")
+        return
+    read = existing
+    if start is not None and stop is not None:
+        try:
+            read = partitions_for(existing, parse_timestamp(start), parse_timestamp(stop))
+        except ValueError:
+            raise click.BadParameter("start and stop must be formatted 'YYYY-MM-DD HH:MM:SS'")
+    for partition in existing:
+        click.echo('{0} {1:<8} {2:<20} {3:<20} ~{4} rows'.format(
+            '*' if partition in read else ' ', partition.name, str(partition.lower or ''), str(partition.upper or ''),
+            partition.rows))
+
+
+@partitions.command('create')
+@click.option('--ahead', default=3, help='Number of months after the current one to create partitions for.')
+@click.option('--yes', is_flag=True, help='Do not ask before partitioning an unpartitioned table.')
+@with_appcontext
+def create_partitions(ahead, yes):
+    """
+    Partition the power table by month, or add the coming months to it. Run monthly, e.g. from cron.
+    """
+
+    existing = partitioned_table()
+    last = add_months(month_start(datetime.now()), ahead)
+    if not existing:
+        oldest = db.session.query(func.min(Power.timestamp)).scalar()
+        statement = partition_table_statement(month_start(oldest or datetime.now()), last)
+        if not yes and not click.confirm('Partitioning rebuilds the power table, which takes a while. Continue?'):
+            click.echo('Canceled.')
+            return
+    else:
+        statement = add_partitions_statement(existing, last)
+        if statement is None:
+            click.echo('Partitions already exist up to {0:%Y-%m}.'.format(last))
+            return
+    db.engine.execute(statement)
+    click.echo('Partitions exist up to {0:%Y-%m}.'.format(last))
+
+
+@partitions.command('retire')
+@click.option('--before', required=True, help="First month to keep, formatted 'YYYY-MM'.")
+@click.option('--archive/--drop', default=True,
+              help='Move the rows of each month to a power_archive_YYYYMM table (default), or delete them.')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+@with_appcontext
+def retire_partitions(before, archive, yes):
+    """
+    Remove the months before --before from the power table.
+
+    The rollups keep their hourly and daily readings of these months, 'flask rollup-refresh --full' included. Run
+    'flask rollup-refresh' first if they may be behind.
+    """
+
+    try:
+        before = datetime.strptime(before, '%Y-%m')
+    except ValueError:
+        raise click.BadParameter("before must be formatted 'YYYY-MM'")
+    if before > month_start(datetime.now()):
+        raise click.BadParameter('the current month cannot be retired')
+    retired = retirable_partitions(partitioned_table(), before)
+    if not retired:
+        click.echo('No partitions before {0:%Y-%m}.'.format(before))
+        return
+    names = ', '.join(partition.name for partition in retired)
+    if not yes and not click.confirm('{0} partitions {1}?'.format('Archive' if archive else 'Drop', names)):
+        click.echo('Canceled.')
+        return
+    for partition in retired:
+        for statement in retire_statements(partition, archive):
+            db.engine.execute(statement)
+        click.echo('Retired {0} (~{1} rows).'.format(partition.name, partition.rows))
+
+
 @click.command()
 def test():
     """Run the tests."""
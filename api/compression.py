@@ -0,0 +1,112 @@
+"""
+Response compression negotiated from the client's Accept-Encoding header.
+
+Supports gzip, and brotli ('br') and zstd when the optional 'brotli' and 'zstandard' packages are installed.
+Streamed responses are compressed chunk by chunk, flushing after each chunk so clients still receive data
+as it is produced.
+
+Configure with COMPRESS_* settings, see api/config.py
+"""
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# each factory returns (compress, flush, finish) functions for one response body
+
+def gzip_compressor(level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def brotli_compressor(level):
+    compressor = brotli.Compressor(quality=level)
+    return compressor.process, compressor.flush, compressor.finish
+
+
+def zstd_compressor(level):
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    return compressor.compress, lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK), compressor.flush
+
+
+# content coding -> (factory of (compress, flush, finish) functions, config key of its level), in order of preference
+COMPRESSORS = [('gzip', gzip_compressor, 'COMPRESS_GZIP_LEVEL')]
+if brotli is not None:
+    COMPRESSORS.insert(0, ('br', brotli_compressor, 'COMPRESS_BR_LEVEL'))
+if zstandard is not None:
+    COMPRESSORS.insert(0, ('zstd', zstd_compressor, 'COMPRESS_ZSTD_LEVEL'))
+
+
+class Compress(object):
+    """
+    Flask extension compressing responses according to the Accept-Encoding request header
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_MIMETYPES', ['application/json', 'text/csv', 'text/html'])
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_GZIP_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BR_LEVEL', 4)
+        app.config.setdefault('COMPRESS_ZSTD_LEVEL', 3)
+        app.after_request(self.after_request)
+
+    def after_request(self, response):
+        config = current_app.config
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in config['COMPRESS_MIMETYPES']):
+            return response
+        response.vary.add('Accept-Encoding')
+
+        encoding = request.accept_encodings.best_match([name for name, _, _ in COMPRESSORS])
+        if encoding is None:
+            return response
+        factory, level_key = next((factory, level_key) for name, factory, level_key in COMPRESSORS if name == encoding)
+        compress, flush, finish = factory(config[level_key])
+
+        if response.is_streamed:
+            response.response = compress_stream(response.response, compress, flush, finish)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < config['COMPRESS_MIN_SIZE']:
+                return response
+            response.set_data(compress(data) + finish())
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            # a strong ETag identifies the exact bytes sent, which differ per content coding
+            response.set_etag('{0}-{1}'.format(etag, encoding))
+        return response
+
+
+def compress_stream(chunks, compress, flush, finish):
+    """
+    Compress a streamed response body, flushing the compressor after every chunk
+    """
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compress(chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
@@ -21,6 +21,74 @@ class BaseConfig(object):
 
     SQLALCHEMY_ECHO = True
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # test pooled connections before use, so connections dropped by the server (MySQL wait_timeout) are replaced
+    # transparently instead of failing a request, see api/pool.py
+    SQLALCHEMY_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true")
+    # seconds, longer waits for a pooled connection are logged
+    SQLALCHEMY_POOL_WAIT_WARNING = float(os.environ.get("DB_POOL_WAIT_WARNING", 0.1))
+
+    # upper bound for the 'limit' parameter of the paged readings endpoints
+    READINGS_MAX_PAGE_SIZE = int(os.environ.get("READINGS_MAX_PAGE_SIZE", 10000))
+    # upper bound for the number of building or sensor IDs in one request to the batch readings endpoints
+    BATCH_MAX_IDS = int(os.environ.get("BATCH_MAX_IDS", 500))
+    # consumption mode: longest gap, in seconds, between two energy readings whose difference is still reported
+    CONSUMPTION_MAX_GAP = int(os.environ.get("CONSUMPTION_MAX_GAP", 6 * 60 * 60))
+
+    # push ingestion at POST /facilities/readings, see api/push.py. Meters authenticate with one of these
+    # comma-separated bearer tokens; the endpoint is disabled when none are set
+    INGEST_TOKENS = [token for token in os.environ.get("INGEST_TOKENS", "").split(",") if token]
+    INGEST_MAX_READINGS = int(os.environ.get("INGEST_MAX_READINGS", 10000))  # per request
+    INGEST_QUEUE_MAX_ROWS = int(os.environ.get("INGEST_QUEUE_MAX_ROWS", 100000))  # per worker, pushes get 429 beyond
+    INGEST_FLUSH_ROWS = int(os.environ.get("INGEST_FLUSH_ROWS", 5000))  # rows per transaction
+    INGEST_FLUSH_INTERVAL = float(os.environ.get("INGEST_FLUSH_INTERVAL", 1.0))  # seconds a reading may wait
+    # seconds a reading may be dated ahead of the server clock, later ones are rejected as malformed
+    INGEST_MAX_FUTURE = int(os.environ.get("INGEST_MAX_FUTURE", 5 * 60))
+
+    # live readings streamed at the /live endpoints, see api/live.py. One poller per worker queries for new readings
+    LIVE_POLL_INTERVAL = float(os.environ.get("LIVE_POLL_INTERVAL", 5.0))  # seconds
+    LIVE_LATE_READINGS = int(os.environ.get("LIVE_LATE_READINGS", 15 * 60))  # seconds a reading may be stored late
+    LIVE_MAX_DURATION = int(os.environ.get("LIVE_MAX_DURATION", 5 * 60))  # seconds, then clients reconnect
+    LIVE_HEARTBEAT = float(os.environ.get("LIVE_HEARTBEAT", 15.0))  # seconds between keepalive comments
+    LIVE_CLIENT_BUFFER = int(os.environ.get("LIVE_CLIENT_BUFFER", 100))  # polls a client may fall behind
+    LIVE_MAX_STREAMS = int(os.environ.get("LIVE_MAX_STREAMS", 100))  # per worker
+    # accept streams outside of gevent workers, each then blocks a thread for up to LIVE_MAX_DURATION seconds
+    LIVE_ALLOW_BLOCKING_STREAMS = os.environ.get("LIVE_ALLOW_BLOCKING_STREAMS", "false").lower() in ("1", "true")
+
+    # latest reading of every sensor, held in memory by each worker for the /latest endpoints, see api/latest.py
+    LATEST_MAX_AGE = int(os.environ.get("LATEST_MAX_AGE", 24 * 60 * 60))  # seconds, older sensors are left out
+    LATEST_LATE_READINGS = int(os.environ.get("LATEST_LATE_READINGS", 15 * 60))  # seconds looked back per refresh
+    LATEST_REFRESH_INTERVAL = float(os.environ.get("LATEST_REFRESH_INTERVAL", 5.0))  # seconds
+    LATEST_RELOAD_INTERVAL = int(os.environ.get("LATEST_RELOAD_INTERVAL", 60 * 60))  # seconds between full reloads
+
+    # response compression, see api/compression.py. brotli and zstd are used when their packages are installed
+    COMPRESS_MIMETYPES = ['application/json', 'text/csv', 'text/html', 'application/vnd.apache.arrow.stream']
+    COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 500))  # bytes, smaller bodies are sent as-is
+    COMPRESS_GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+    COMPRESS_BR_LEVEL = int(os.environ.get("COMPRESS_BR_LEVEL", 4))
+    COMPRESS_ZSTD_LEVEL = int(os.environ.get("COMPRESS_ZSTD_LEVEL", 3))
+
+    # readings query result cache, see api/cache.py
+    CACHE_ENABLED = True
+    CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 256))  # per worker
+    CACHE_MAX_ROWS = int(os.environ.get("CACHE_MAX_ROWS", 20000))  # larger results are not cached
+    CACHE_RECENT_TTL = int(os.environ.get("CACHE_RECENT_TTL", 60))  # seconds, for windows touching the present
+    # a window ending this many seconds before the newest stored reading never changes
+    CACHE_SETTLE_SECONDS = int(os.environ.get("CACHE_SETTLE_SECONDS", 60 * 60))
+    CACHE_SETTLED_TTL = int(os.environ.get("CACHE_SETTLED_TTL", 24 * 60 * 60))  # seconds, for settled windows
+    # seconds between reads of the month versions invalidating the results of windows written to
+    CACHE_VERSIONS_INTERVAL = float(os.environ.get("CACHE_VERSIONS_INTERVAL", 5.0))
+    # optional shared tier for all gunicorn workers, e.g. redis://localhost:6379/0 (requires the 'redis' package)
+    CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL", None)
+
+    # Server-Timing header with the db/serialize/total time of each request, see api/timing.py
+    SERVER_TIMING_ENABLED = os.environ.get("SERVER_TIMING_ENABLED", "true").lower() in ("1", "true")
+    # seconds, slower statements are logged with their parameters and query plan (EXPLAIN), unset to disable
+    SLOW_QUERY_THRESHOLD = float(os.environ["SLOW_QUERY_THRESHOLD"]) if os.environ.get("SLOW_QUERY_THRESHOLD") else 0.5
+    SLOW_QUERY_EXPLAIN = os.environ.get("SLOW_QUERY_EXPLAIN", "true").lower() in ("1", "true")
+
+    # Prometheus metrics at /metrics, see api/metrics.py (requires the 'prometheus_client' package). Under gunicorn,
+    # also set PROMETHEUS_MULTIPROC_DIR to an empty directory shared by the workers
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true")
 
     # Swagger config defaults to lazy loading values from the Flask request
     SWAGGER_HOST = os.environ.get("SWAGGER_HOST", "localhost:5000")
@@ -52,6 +120,8 @@ class BaseConfig(object):
 
 class DevelopmentConfig(BaseConfig):
     DEBUG = True
+    # the threaded development server
+    LIVE_ALLOW_BLOCKING_STREAMS = True
 
     # Using local SQLite DB in project root dir for development
     SQLALCHEMY_DATABASE_NAME = os.environ.get("DB_NAME",'dev.db')
@@ -69,6 +139,18 @@ class ProductionConfig(BaseConfig):
     SQLALCHEMY_DATABASE_URI = os.environ.get("DB_URL", None)
     SQLALCHEMY_ECHO = False
 
+    # connection pool of each gunicorn worker process. A sync worker serves GUNICORN_THREADS requests at once, each
+    # needing at most one connection; a gevent worker serves many more, which queue for a connection past the pool
+    # size plus overflow. The database must accept GUNICORN_PROCESSES * (pool size + overflow) connections.
+    _GEVENT_WORKERS = os.environ.get("GUNICORN_WORKER_CLASS", "sync") == "gevent"
+    SQLALCHEMY_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10 if _GEVENT_WORKERS else os.environ.get("GUNICORN_THREADS", 1)))
+    # connections opened past the pool size during bursts, closed again when returned
+    SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10 if _GEVENT_WORKERS else 2))
+    # seconds to wait for a connection before answering 503, rather than queueing behind a burst indefinitely
+    SQLALCHEMY_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 5))
+    # seconds after which connections are replaced, well below MySQL's default wait_timeout of 8 hours
+    SQLALCHEMY_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 30 * 60))
+
     DEBUG = False
 
 
@@ -77,14 +159,40 @@ class TestConfig(BaseConfig):
     TESTING = True
     DEBUG = False
     SQLALCHEMY_ECHO = False
+    CACHE_ENABLED = False
+    # see the readings written by a test right away
+    CACHE_VERSIONS_INTERVAL = 0
+    INGEST_TOKENS = ['test-token']
+    # no writer thread, pushed readings are written when INGEST_FLUSH_ROWS are queued or by tests
+    INGEST_FLUSH_INTERVAL = None
+    # no poller thread, tests poll for live readings themselves
+    LIVE_POLL_INTERVAL = None
+    LIVE_ALLOW_BLOCKING_STREAMS = True
+    # no refresher thread, tests refresh the latest readings themselves
+    LATEST_REFRESH_INTERVAL = None
 
     # Use in-memory SQLite database for testing
     SQLALCHEMY_DATABASE_URI = 'sqlite://'
 
 
+class BenchmarkConfig(BaseConfig):
+    DEBUG = False
+    SQLALCHEMY_ECHO = False
+
+    # SQLite database seeded from sample.db by 'python benchmark.py seed', see benchmark.py
+    SQLALCHEMY_DATABASE_NAME = os.environ.get("BENCHMARK_DB", 'benchmark.db')
+    SQLALCHEMY_DATABASE_PATH = os.path.join(BaseConfig.PROJECT_ROOT, SQLALCHEMY_DATABASE_NAME)
+    SQLALCHEMY_DATABASE_URI = "sqlite:///{0}".format(SQLALCHEMY_DATABASE_PATH)
+
+    # measure the queries, not the cache or the logging
+    CACHE_ENABLED = False
+    SLOW_QUERY_THRESHOLD = None
+
+
 # Map configuration name (supplied by the ENV environment variable) to configuration class
 CONFIG_NAME_MAP = {
     'development': DevelopmentConfig,
     'production': ProductionConfig,
-    'test': TestConfig
+    'test': TestConfig,
+    'benchmark': BenchmarkConfig
 }
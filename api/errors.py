@@ -11,6 +11,7 @@ Register handlers with `register_error_handlers(app)`
 from http import HTTPStatus
 
 from flask.json import jsonify
+from sqlalchemy.exc import TimeoutError
 from werkzeug.exceptions import default_exceptions
 
 
@@ -50,6 +51,25 @@ class NotFoundException(ApiException):
     message = 'Resource not found'
 
 
+class NotAcceptableException(ApiException):
+    status = HTTPStatus.NOT_ACCEPTABLE
+    message = 'Not acceptable'
+
+
+class TooManyRequestsException(ApiException):
+    status = HTTPStatus.TOO_MANY_REQUESTS
+    message = 'Too many requests'
+
+    def __init__(self, message=None, retry_after=1):
+        ApiException.__init__(self, message)
+        self.retry_after = retry_after
+
+
+class ServiceUnavailableException(ApiException):
+    status = HTTPStatus.SERVICE_UNAVAILABLE
+    message = 'Service unavailable'
+
+
 def handle_api_exception(api_exception):
     """Flask error handler for ApiException.  Register with app.register_error_handler()"""
     return jsonify(api_exception.to_dict()), api_exception.status
@@ -60,9 +80,25 @@ def handle_http_error(error):
     return jsonify({'message': str(error), 'status': error.code}), error.code
 
 
+def handle_too_many_requests(api_exception):
+    """Flask error handler for TooManyRequestsException, telling the client when to retry"""
+    response, status = handle_api_exception(api_exception)
+    response.headers['Retry-After'] = str(api_exception.retry_after)
+    return response, status
+
+
+def handle_pool_timeout(error):
+    """Answer 503 when no database connection became available within SQLALCHEMY_POOL_TIMEOUT"""
+    response, status = handle_api_exception(ServiceUnavailableException(message="The server is busy, retry shortly"))
+    response.headers['Retry-After'] = '1'
+    return response, status
+
+
 def register_error_handlers(app):
     """Register Flask error handler functions"""
     app.register_error_handler(ApiException, handle_api_exception)
+    app.register_error_handler(TooManyRequestsException, handle_too_many_requests)
+    app.register_error_handler(TimeoutError, handle_pool_timeout)
 
     # due to a flask bug in 0.12, we can't handle the default HTTPException.
     # this work-around registers handlers for each status code
@@ -0,0 +1,145 @@
+"""
+Bulk export of readings as CSV, Apache Arrow IPC streams and Parquet files.
+
+Output is built straight from the query rows, without going through res_to_json, and written to the client
+one batch at a time. Arrow and Parquet require the optional 'pyarrow' package.
+"""
+import csv
+import io
+import zlib
+from itertools import chain
+
+from api.errors import NotAcceptableException
+from api.helpers import TIMESTAMP_FORMAT, UNITS, source_mapper
+from api.streaming import STREAM_BATCH_SIZE
+
+ARROW_STREAM_MIMETYPE = 'application/vnd.apache.arrow.stream'
+PARQUET_MIMETYPE = 'application/vnd.apache.parquet'
+
+CSV_COLUMNS = ('source_name', 'source_type', 'timestamp', 'units', 'value_read')
+CSV_COMPRESSION_LEVEL = 6
+
+
+def import_pyarrow():
+    """
+    Import pyarrow, answering 406 Not Acceptable if this deployment does not have it installed
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise NotAcceptableException(message="Arrow and Parquet output are not available on this server")
+    return pyarrow
+
+
+def arrow_schema(pa, b_id=None):
+    """
+    Arrow schema of the exported readings, mirroring the fields of PowerOrAndEnergySchema
+    """
+    fields = [
+        pa.field('timestamp', pa.timestamp('s')),
+        pa.field('source_name', pa.dictionary(pa.int32(), pa.string())),
+        pa.field('source_type', pa.dictionary(pa.int32(), pa.string())),
+        pa.field('units', pa.dictionary(pa.int32(), pa.string())),
+        pa.field('value_read', pa.float64())
+    ]
+    if b_id is not None:
+        fields.append(pa.field('b_id', pa.string()))
+    return pa.schema(fields)
+
+
+def record_batches(pa, schema, rows, b_id=None, batch_size=STREAM_BATCH_SIZE):
+    """
+    Generate Arrow record batches of `batch_size` (timestamp, type, value_read, source_name) rows
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield record_batch(pa, schema, batch, b_id)
+            batch = []
+    if batch:
+        yield record_batch(pa, schema, batch, b_id)
+
+
+def record_batch(pa, schema, rows, b_id=None):
+    """
+    Build one Arrow record batch from a list of rows, dictionary-encoding the repeated sensor metadata
+    """
+    sources = [source_mapper(row[3]) for row in rows]
+    columns = [
+        pa.array([row[0] for row in rows], pa.timestamp('s')),
+        pa.array([source[0] for source in sources], pa.string()).dictionary_encode(),
+        pa.array([source[1] for source in sources], pa.string()).dictionary_encode(),
+        pa.array([UNITS.get(row[1], "") for row in rows], pa.string()).dictionary_encode(),
+        pa.array([float(row[2]) for row in rows], pa.float64())
+    ]
+    if b_id is not None:
+        columns.append(pa.array([b_id] * len(rows), pa.string()))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def drain(sink):
+    """
+    Return and clear everything written to a BytesIO or StringIO sink so far
+    """
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
+
+
+def stream_arrow(pa, first, rows, b_id=None):
+    """
+    Generate an Arrow IPC stream of the readings, one record batch at a time
+
+    :param first: the first row, already read from `rows` by the caller to check the result is not empty
+    """
+    schema = arrow_schema(pa, b_id)
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+    for batch in record_batches(pa, schema, chain([first], rows), b_id):
+        writer.write_batch(batch)
+        yield drain(sink)
+    writer.close()
+    yield drain(sink)
+
+
+def stream_parquet(pa, first, rows, b_id=None):
+    """
+    Generate a Parquet file of the readings, one row group per record batch
+
+    :param first: the first row, already read from `rows` by the caller to check the result is not empty
+    """
+    schema = arrow_schema(pa, b_id)
+    sink = io.BytesIO()
+    writer = pa.parquet.ParquetWriter(sink, schema)
+    for batch in record_batches(pa, schema, chain([first], rows), b_id):
+        writer.write_table(pa.Table.from_batches([batch], schema=schema))
+        yield drain(sink)
+    writer.close()
+    yield drain(sink)
+
+
+
+def stream_csv(first, rows, b_id=None, compress=False, batch_size=STREAM_BATCH_SIZE):
+    """
+    Generate a CSV file of the readings, optionally gzip-compressed on the fly, one batch of rows at a time
+
+    :param first: the first row, already read from `rows` by the caller to check the result is not empty
+    """
+    compressor = zlib.compressobj(CSV_COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    sink = io.StringIO()
+    writer = csv.writer(sink)
+    writer.writerow((('b_id',) if b_id is not None else ()) + CSV_COLUMNS)
+
+    for count, row in enumerate(chain([first], rows), 1):
+        source_name, source_type = source_mapper(row[3])
+        values = (source_name, source_type, row[0].strftime(TIMESTAMP_FORMAT), UNITS.get(row[1], ""), row[2])
+        writer.writerow(((b_id,) if b_id is not None else ()) + values)
+        if count % batch_size == 0:
+            data = drain(sink).encode('utf-8')
+            yield compressor.compress(data) if compressor is not None else data
+
+    data = drain(sink).encode('utf-8')
+    yield compressor.compress(data) + compressor.flush() if compressor is not None else data
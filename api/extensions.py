@@ -6,9 +6,24 @@ Each extension is initialized in the app factory, located in __init__.py.
 from flasgger import Swagger
 from flask_cas import CAS
 from flask_marshmallow import Marshmallow
-from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from api.cache import ReadingsCache
+from api.compression import Compress
+from api.latest import LatestReadings
+from api.live import LiveFeed
+from api.metrics import Metrics
+from api.pool import PooledSQLAlchemy
+from api.push import PushQueue
+from api.timing import Timing
+
+db = PooledSQLAlchemy()
 ma = Marshmallow()
 swagger = Swagger()
 cas = CAS()
+compress = Compress()
+cache = ReadingsCache()
+metrics = Metrics()
+timing = Timing()
+push_queue = PushQueue()
+live_feed = LiveFeed()
+latest = LatestReadings()
@@ -1,43 +1,147 @@
+import base64
+import calendar
+import json
+import re
+from datetime import datetime
+from functools import lru_cache
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+CURSOR_TIMESTAMP_FORMAT = TIMESTAMP_FORMAT + '.%f'
+
+
+# Add more units here as more unique 'type's in the database are added
+UNITS = {"Active Energy Delivered": "kWh",
+         "Active Power": "kW"}
+
+SENSOR_TYPES = {
+    "EMS": "Electrical mains transformer (4160V - 480V)",
+    "EMH": "Electrical mains meter, high voltage (480V)",
+    "EML": "Electrical mains meter, low voltage (208V)",
+    "EUH": "Electrical sub-meter, high voltage (480V)",
+    "EUL": "Electrical sub-meter, low voltage (208V)"
+}
+
+# 'GTECH.B026E_MH1' -> building '026', meter suffix 'E_MH1'
+SOURCE_PATTERN = re.compile(r'B(\d\d\d)(.*)')
+NON_ALPHA_PATTERN = re.compile(r'[^A-Za-z]')
+
+
 def units_mapper(meas_type):
     """
     Maps units to each kind of meter
     """
-    # Add more units here as more unique 'type's in the database are added
-    units = {"Active Energy Delivered": "kWh",
-             "Active Power": "kW"}
-    try:
-        return (units[meas_type])
-    except KeyError:
-        return ""
+    return UNITS.get(meas_type, "")
+
+
+@lru_cache(maxsize=4096)
+def source_mapper(source):
+    """
+    Maps a source_name from the database to its (clean sensor name, sensor type description)
+
+    Called for every row of a response but there are only a few hundred distinct sensors, so results are memoized.
+    """
+    source_name = source.rstrip('\r')  # remove the trailing \r that seems to be in the database
+    return source_name, SENSOR_TYPES.get(sensortype_code_mapper(source_name), "unknown")
+
+
+def sensortype_code_mapper(source):
+    """
+    Maps a sensor name to the 3-letter code of its meter type, e.g. 'GTECH.B026E_MS2' -> 'EMS', or None if it has none
+    """
+    match = SOURCE_PATTERN.search(source)
+    if match is None:
+        return None
+    # keep only the characters of the Bxxx suffix, drop all numbers - this gives a unique 3 letter code (for now) for
+    # all different meters
+    return NON_ALPHA_PATTERN.sub('', match.group(2))
+
 
 def sensortype_mapper(source):
     """
     Maps the unique 3-letter code to different types of meters. Should be migrated to a database in a future version.
     """
-    stype = re.search('B\d\d\d(.*)',source).group(1)[:-1] # removing the Bxxx part, and the trailing \r that seems to be in the database
-    stype = ''.join(filter(str.isalpha, stype)) # keep only the characters, drop all numbers - this gives a unique 3 letter code (for now) for all different meters
-    sensortypes = {
-        "EMS": "Electrical mains transformer (4160V - 480V)",
-        "EMH": "Electrical mains meter, high voltage (480V)",
-        "EML": "Electrical mains meter, low voltage (208V)",
-        "EUH": "Electrical sub-meter, high voltage (480V)",
-        "EUL": "Electrical sub-meter, low voltage (208V)"
-    }
+    return source_mapper(source)[1]
+
+
+def building_id_mapper(source):
+    """
+    Extracts the zero-padded building ID from a sensor name, e.g. 'GTECH.B026E_MH1' -> '026'
+    """
+    match = SOURCE_PATTERN.search(source)
+    if match is None:
+        return None
+    return match.group(1)
+
+
+def parse_timestamp(value):
+    """
+    Parses a 'YYYY-MM-DD HH:MM:SS' query parameter into a datetime. Raises ValueError if malformed.
+    """
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def encode_cursor(timestamp, meas_type, source_name):
+    """
+    Encodes the key of the last reading on a page into the opaque 'cursor' query parameter of the next page
+    """
+    key = json.dumps([timestamp.strftime(CURSOR_TIMESTAMP_FORMAT), meas_type, source_name])
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a 'cursor' query parameter back into a (timestamp, type, source_name) key. Raises ValueError if malformed.
+    """
     try:
-        return (sensortypes[stype])
-    except KeyError:
-        return "unknown"
+        timestamp, meas_type, source_name = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        return datetime.strptime(timestamp, CURSOR_TIMESTAMP_FORMAT), meas_type, source_name
+    except (TypeError, UnicodeError):
+        # binascii and JSON decoding errors are already ValueErrors
+        raise ValueError('Invalid cursor')
 
 
 def res_to_json(row):
     """
     Encode the result of a power-related SQL query to JSON
     """
+    source_name, source_type = source_mapper(row[3])
     output = {
-        "source_name": row[3][:-1],    # remove the trailing \r that seems to be in the database
-        "source_type": sensortype_mapper(row[3]),
+        "source_name": source_name,
+        "source_type": source_type,
         "timestamp": row[0],           # get data in UNIX format, with GMT times, client can use JavaScript to convert timezones.
         "value_read": str(row[2]),
-        "units": units_mapper(row[1])
+        "units": UNITS.get(row[1], "")
     }
-    return(output)
\ No newline at end of file
+    return(output)
+
+
+def res_to_columns(rows, b_id=None, delta=False):
+    """
+    Encode the result of a power-related SQL query as one entry per sensor, holding the sensor's metadata once and its
+    readings as parallel 'timestamps' (UNIX epoch seconds) and 'values' arrays
+
+    With delta=True each timestamp after the first is stored as the difference to the previous one.
+    """
+    sensors = {}
+    for row in rows:
+        sensor = sensors.get((row[3], row[1]))
+        if sensor is None:
+            source_name, source_type = source_mapper(row[3])
+            sensor = sensors[row[3], row[1]] = {
+                "source_name": source_name,
+                "source_type": source_type,
+                "units": UNITS.get(row[1], ""),
+                "timestamps": [],
+                "values": []
+            }
+            if b_id is not None:
+                sensor["b_id"] = b_id
+        sensor["timestamps"].append(calendar.timegm(row[0].timetuple()))
+        sensor["values"].append(float(row[2]))
+
+    columns = sorted(sensors.values(), key=lambda sensor: (sensor["source_name"], sensor["units"]))
+    if delta:
+        for sensor in columns:
+            timestamps = sensor["timestamps"]
+            sensor["timestamps"] = timestamps[:1] + [later - earlier for earlier, later in zip(timestamps, timestamps[1:])]
+    return columns
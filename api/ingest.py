@@ -0,0 +1,235 @@
+"""
+Bulk loading of meter readings exported by GT Facilities.
+
+Readings are read from CSV or JSON lines files with timestamp, type, value_read and source_name fields, cleaned
+(the trailing '\r' of sensor names is stripped and the building ID derived) and inserted one batch per executemany.
+PyMySQL turns each executemany into multi-row INSERTs, so a batch costs one round trip. Rows whose
+(timestamp, type, source_name) key is already in the table are skipped by the database itself
+(INSERT IGNORE / INSERT OR IGNORE / ON CONFLICT DO NOTHING), which makes re-running an ingest safe. Readings stored
+before names were cleaned keep their '\r', so rows whose key exists in that legacy form are skipped first. Every batch
+also bumps the version of the months it wrote to, in the same transaction, which invalidates the results cached for
+those months, see api/cache.py.
+"""
+import csv
+import gzip
+import json
+import math
+import os
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam
+from sqlalchemy.dialects import postgresql
+
+from api.extensions import db
+from api.helpers import building_id_mapper, parse_timestamp
+from api.models import Power, ReadingsVersion
+from api.partitions import month_start
+from api.queries import MEASUREMENT_TYPES
+
+INGEST_BATCH_SIZE = 10000
+
+EXPORT_FORMATS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.json': 'jsonl'
+}
+
+
+class IngestStats(object):
+    """
+    Counts of an ingest run
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.read = 0
+        self.inserted = 0
+        self.malformed = 0
+
+    @property
+    def duplicates(self):
+        return self.read - self.malformed - self.inserted
+
+    @property
+    def rows_per_second(self):
+        return self.read / max(time.time() - self.started, 1e-9)
+
+
+def export_format(path):
+    """
+    'csv' or 'jsonl' from the extension of an export file, which may be gzip-compressed. Raises ValueError if unknown.
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lower()
+    if extension not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format: ' + path)
+    return EXPORT_FORMATS[extension]
+
+
+def open_export(path):
+    """
+    Open an export file as text, decompressing it on the fly if its name ends with .gz
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def read_records(lines, export_format):
+    """
+    Generate (line number, dict) records from the lines of a CSV (with a header row) or JSON lines export
+    """
+    if export_format == 'csv':
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_num, line in enumerate(lines, 1):
+            if line.strip():
+                try:
+                    yield line_num, json.loads(line)
+                except ValueError:
+                    yield line_num, None
+
+
+def latest_timestamp():
+    """
+    Newest reading timestamp accepted, INGEST_MAX_FUTURE seconds ahead of the server clock
+
+    A reading dated in the future by a meter with a wrong clock would become the newest of the table, which the latest
+    readings, the cache and the live feed all measure time from.
+    """
+    return datetime.now() + timedelta(seconds=current_app.config['INGEST_MAX_FUTURE'])
+
+
+def parse_reading(record, latest=None):
+    """
+    Validate and clean one exported reading into a row of the power table. Raises ValueError if malformed.
+
+    :param latest: newest timestamp accepted, see latest_timestamp
+    """
+    try:
+        timestamp = record['timestamp']
+        meas_type = record['type']
+        source_name = record['source_name'].rstrip('\r')
+        if isinstance(record['value_read'], bool):
+            raise ValueError('value_read must be a number')
+        value_read = float(record['value_read'])
+    except (KeyError, TypeError, AttributeError):
+        raise ValueError('Expected timestamp, type, value_read and source_name fields')
+    if not meas_type or not source_name:
+        raise ValueError('type and source_name cannot be empty')
+    if meas_type not in MEASUREMENT_TYPES:
+        raise ValueError('type must be one of: ' + ', '.join(MEASUREMENT_TYPES))
+    if not math.isfinite(value_read):
+        raise ValueError('value_read must be a finite number')
+    timestamp = parse_timestamp(str(timestamp).replace('T', ' '))
+    if latest is not None and timestamp > latest:
+        raise ValueError('timestamp cannot be in the future')
+    return dict(
+        timestamp=timestamp,
+        type=meas_type,
+        value_read=value_read,
+        source_name=source_name,
+        building_id=building_id_mapper(source_name)
+    )
+
+
+def insert_ignore_statement(table=Power.__table__):
+    """
+    INSERT into a table, the power table by default, skipping rows whose primary key already exists, for the current
+    database
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'mysql':
+        return table.insert().prefix_with('IGNORE')
+    if dialect == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    raise ValueError('Bulk ingestion does not support the {0} dialect'.format(dialect))
+
+
+def insert_readings(rows):
+    """
+    Insert a batch of power table rows in one executemany, returning the number of rows actually inserted
+
+    Duplicates within the batch are dropped first, keeping the first reading of each key like the database does, and
+    so are the readings already stored under the legacy form of their sensor name.
+    """
+    unique = {}
+    for row in rows:
+        unique.setdefault((row['timestamp'], row['type'], row['source_name']), row)
+    for timestamp, meas_type, source_name in legacy_keys(unique):
+        del unique[timestamp, meas_type, source_name.rstrip('\r')]
+    if not unique:
+        return 0
+    result = db.session.execute(insert_ignore_statement(), list(unique.values()))
+    inserted = max(result.rowcount, 0)
+    if inserted:
+        bump_versions(set(month_start(key[0]) for key in unique))
+    db.session.commit()
+    return inserted
+
+
+def legacy_keys(keys):
+    """
+    The (timestamp, type, source_name) keys stored with a trailing '\r' on the sensor name of one of `keys`, in one
+    timestamp range query
+    """
+    if not keys:
+        return set()
+    timestamps = [key[0] for key in keys]
+    return set(tuple(row) for row in db.session.query(Power.timestamp, Power.type, Power.source_name).filter(
+        Power.timestamp >= min(timestamps),
+        Power.timestamp <= max(timestamps),
+        Power.source_name.in_(set(key[2] + '\r' for key in keys))
+    ) if (row[0], row[1], row[2].rstrip('\r')) in keys)
+
+
+def bump_versions(months):
+    """
+    Increment the version of the given months of the power table, in the current transaction
+    """
+    months = [dict(month_=month) for month in sorted(months)]
+    versions = ReadingsVersion.__table__
+    db.session.execute(insert_ignore_statement(versions).values(month=bindparam('month_'), version=0), months)
+    db.session.execute(versions.update().where(versions.c.month == bindparam('month_'))
+                       .values(version=versions.c.version + 1), months)
+
+
+def ingest_readings(records, batch_size=INGEST_BATCH_SIZE, stats=None, on_batch=None, on_error=None):
+    """
+    Load (line number, record) pairs into the power table in batches of `batch_size`
+
+    :param on_batch: called with the stats after every batch, e.g. to report progress
+    :param on_error: called with the line number and error of every malformed record, which is skipped
+    :return: IngestStats, updated in place if given
+    """
+    stats = stats if stats is not None else IngestStats()
+    latest = latest_timestamp()
+    batch = []
+    for line_num, record in records:
+        stats.read += 1
+        try:
+            if record is None:
+                raise ValueError('Not valid JSON')
+            batch.append(parse_reading(record, latest))
+        except ValueError as error:
+            stats.malformed += 1
+            if on_error is not None:
+                on_error(line_num, error)
+            continue
+        if len(batch) >= batch_size:
+            stats.inserted += insert_readings(batch)
+            batch = []
+            if on_batch is not None:
+                on_batch(stats)
+    if batch:
+        stats.inserted += insert_readings(batch)
+        if on_batch is not None:
+            on_batch(stats)
+    return stats
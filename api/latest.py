@@ -0,0 +1,178 @@
+"""
+The latest reading of every sensor, kept in memory to answer "what is building X drawing right now".
+
+Each worker holds the newest reading per (sensor, measurement type) and answers the /latest endpoints from it
+without querying the power table. The table is loaded on first use from the readings of the last LATEST_MAX_AGE
+seconds. It is then kept up to date by readings pushed to this worker (see api/push.py), and by a background thread
+fetching the newest reading per sensor of the last LATEST_LATE_READINGS seconds every LATEST_REFRESH_INTERVAL
+seconds. Readings older than that, e.g. from a nightly `flask ingest`, are picked up by a full reload every
+LATEST_RELOAD_INTERVAL seconds, which replaces the table and so drops sensors that stopped reporting. In between,
+readings older than LATEST_MAX_AGE seconds before the newest one are left out of the answers. Ages are measured from
+the newest reading rather than the clock, as readings may be loaded days late, but never from later than the server
+clock: a reading dated in the future must not make every other sensor look stale.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from api.helpers import building_id_mapper
+
+logger = logging.getLogger(__name__)
+
+
+def index_rows(rows, readings, buildings, watermark=None):
+    """
+    Add the rows newer than (or as new as) the latest reading of their sensor to the `readings` and `buildings`
+    tables of LatestReadings, returning the newest timestamp of `watermark` and the rows
+    """
+    for row in rows:
+        timestamp, meas_type, _, source_name = row
+        key = (source_name.rstrip('\r'), meas_type)
+        current = readings.get(key)
+        if current is not None and current[0] > timestamp:
+            continue
+        row = tuple(row)
+        readings[key] = row
+        b_id = building_id_mapper(key[0])
+        if b_id is not None:
+            buildings.setdefault(b_id, {})[key] = row
+        if watermark is None or timestamp > watermark:
+            watermark = timestamp
+    return watermark
+
+
+class LatestReadings(object):
+    """
+    Flask extension holding the latest reading of every sensor, as (timestamp, type, value_read, source_name) rows
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.lock = threading.Lock()
+        # (sensor name, type) -> row, and building ID -> the same for the sensors of that building
+        self.readings = {}
+        self.buildings = {}
+        self.watermark = None
+        self.loaded = None
+        self.refresher_pid = None
+        self.listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LATEST_MAX_AGE', 24 * 60 * 60)
+        app.config.setdefault('LATEST_LATE_READINGS', 15 * 60)
+        app.config.setdefault('LATEST_REFRESH_INTERVAL', 5.0)
+        app.config.setdefault('LATEST_RELOAD_INTERVAL', 60 * 60)
+        self.app = app
+        if not self.listening:
+            # imported here, like the database in api/push.py: the queue is one of the extensions
+            from api.extensions import push_queue
+            push_queue.listeners.append(self.record_pushed)
+            self.listening = True
+
+    def record(self, rows):
+        """
+        Keep the rows newer than (or as new as) the latest reading of their sensor
+        """
+        with self.lock:
+            self.watermark = index_rows(rows, self.readings, self.buildings, self.watermark)
+
+    def record_pushed(self, rows):
+        if self.loaded is not None:
+            self.record((row['timestamp'], row['type'], row['value_read'], row['source_name']) for row in rows)
+
+    def load(self):
+        """
+        (Re)load the latest readings from the power table
+        """
+        # imported here, api.queries depends on the extensions this is one of
+        from api.extensions import db
+        from api.models import Power
+        from api.queries import last_readings
+
+        with self.app.app_context():
+            newest = db.session.query(func.max(Power.timestamp)).scalar()
+            rows = [] if newest is None else \
+                last_readings(min(newest, datetime.now()) - timedelta(seconds=self.app.config['LATEST_MAX_AGE'])).all()
+        readings, buildings = {}, {}
+        watermark = index_rows(rows, readings, buildings)
+        with self.lock:
+            self.readings, self.buildings, self.watermark = readings, buildings, watermark
+        self.loaded = time.time()
+
+    def refresh(self):
+        """
+        Record the readings stored since the last refresh, or reload them all every LATEST_RELOAD_INTERVAL
+        """
+        from api.queries import last_readings
+
+        if (self.loaded is None or self.watermark is None
+                or time.time() - self.loaded >= self.app.config['LATEST_RELOAD_INTERVAL']):
+            self.load()
+            return
+        with self.app.app_context():
+            rows = last_readings(self.reference() - timedelta(seconds=self.app.config['LATEST_LATE_READINGS'])).all()
+        self.record(rows)
+
+    def ensure_loaded(self):
+        if self.loaded is None:
+            self.load()
+        if self.app.config['LATEST_REFRESH_INTERVAL'] is not None:
+            self.start_refresher()
+
+    def building(self, b_id, meas_type):
+        """
+        Latest readings of one measurement type of every sensor in a building, ordered by sensor name
+        """
+        self.ensure_loaded()
+        with self.lock:
+            readings = list(self.buildings.get(b_id, {}).items())
+        oldest = self.oldest()
+        return [row for key, row in sorted(readings) if key[1] == meas_type and row[0] >= oldest]
+
+    def campus(self):
+        """
+        Latest readings of every sensor, ordered by sensor name and type
+        """
+        self.ensure_loaded()
+        with self.lock:
+            readings = list(self.readings.items())
+        oldest = self.oldest()
+        return [row for _, row in sorted(readings) if row[0] >= oldest]
+
+    def oldest(self):
+        """
+        Timestamp of the oldest reading still reported, LATEST_MAX_AGE seconds before the newest
+        """
+        if self.watermark is None:
+            return datetime.min
+        return self.reference() - timedelta(seconds=self.app.config['LATEST_MAX_AGE'])
+
+    def reference(self):
+        """
+        The newest reading timestamp, capped at the server clock
+        """
+        return min(self.watermark, datetime.now())
+
+    def start_refresher(self):
+        # started lazily: threads do not survive the fork of gunicorn workers
+        if self.refresher_pid == os.getpid():
+            return
+        with self.lock:
+            if self.refresher_pid == os.getpid():
+                return
+            self.refresher_pid = os.getpid()
+            threading.Thread(target=self.refresh_forever, name='gtpower-latest-refresher', daemon=True).start()
+
+    def refresh_forever(self):
+        while True:
+            time.sleep(self.app.config['LATEST_REFRESH_INTERVAL'])
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Could not refresh the latest readings")
@@ -0,0 +1,218 @@
+"""
+Live readings for dashboards, sent as Server-Sent Events.
+
+Rather than every dashboard polling the readings endpoints with overlapping windows, clients subscribe to a building
+or sensor at one of the /live endpoints and receive only the readings stored after they subscribed. Each worker runs a
+single poller thread which, every LIVE_POLL_INTERVAL seconds, fetches the new readings of everything subscribed to in
+that worker with one query and fans them out to the subscribers. The poller reads the table, so readings written by
+any worker, `flask ingest` or the push endpoint are all picked up.
+
+Readings are recognized as new by their (timestamp, type, source_name) key. Keys from the last LIVE_LATE_READINGS
+seconds before the newest timestamp are remembered, so readings stored up to that late are still sent once. Readings
+dated more than INGEST_MAX_FUTURE seconds ahead of the server clock are never sent.
+
+Streams are closed after LIVE_MAX_DURATION seconds, or when a client falls LIVE_CLIENT_BUFFER polls behind, and
+EventSource clients reconnect by themselves. An open stream occupies whatever serves its request for that long, so
+streams are only accepted by gevent workers (see gunicorn_config.py), where it is a greenlet; a sync worker would
+be blocked for every other request. Set LIVE_ALLOW_BLOCKING_STREAMS to accept them from threaded servers anyway, e.g.
+the development server. Each worker holds at most LIVE_MAX_STREAMS streams, further requests are answered with 503.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import json
+from sqlalchemy import func
+
+from api.helpers import building_id_mapper
+from api.streaming import dump
+
+logger = logging.getLogger(__name__)
+
+
+class StreamLimitError(Exception):
+    pass
+
+
+def cooperative_worker():
+    """
+    True if the process runs under gevent, whose blocking calls yield to the other requests of the worker
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+class Subscription(object):
+    """
+    Readings pending for one connected client, a queue of lists of rows
+    """
+
+    def __init__(self, key, max_pending):
+        self.key = key
+        self.pending = queue.Queue(max_pending)
+        self.dropped = False
+
+    def send(self, rows):
+        try:
+            self.pending.put_nowait(rows)
+        except queue.Full:
+            # the client is not keeping up, its stream is closed instead of buffering without bound
+            self.dropped = True
+
+
+class LiveFeed(object):
+    """
+    Flask extension polling the database for new readings on behalf of all live subscriptions of a worker
+
+    Subscriptions are keyed ('building', b_id, type) or ('sensor', sensor_id).
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+        self.poller_pid = None
+        # newest timestamp seen, and the keys of readings seen within LIVE_LATE_READINGS of it
+        self.watermark = None
+        self.seen = {}
+        # subscription keys polled before, new ones are only sent readings from their second poll on
+        self.primed = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LIVE_POLL_INTERVAL', 5.0)
+        app.config.setdefault('LIVE_LATE_READINGS', 15 * 60)
+        app.config.setdefault('LIVE_MAX_DURATION', 5 * 60)
+        app.config.setdefault('LIVE_HEARTBEAT', 15.0)
+        app.config.setdefault('LIVE_CLIENT_BUFFER', 100)
+        app.config.setdefault('LIVE_MAX_STREAMS', 100)
+        app.config.setdefault('LIVE_ALLOW_BLOCKING_STREAMS', False)
+        self.app = app
+
+    @property
+    def streams(self):
+        with self.lock:
+            return sum(len(subscribers) for subscribers in self.subscriptions.values())
+
+    def admit(self):
+        """
+        Check that this worker can hold one more stream, raising StreamLimitError with the reason if not
+        """
+        config = self.app.config
+        if not config['LIVE_ALLOW_BLOCKING_STREAMS'] and not cooperative_worker():
+            raise StreamLimitError("live streams require gevent workers")
+        if self.streams >= config['LIVE_MAX_STREAMS']:
+            raise StreamLimitError("too many live streams are open, retry shortly")
+
+    def subscribe(self, key):
+        subscription = Subscription(key, self.app.config['LIVE_CLIENT_BUFFER'])
+        with self.lock:
+            self.subscriptions.setdefault(key, set()).add(subscription)
+        if self.app.config['LIVE_POLL_INTERVAL'] is not None:
+            self.start_poller()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscriptions.get(subscription.key, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self.subscriptions.pop(subscription.key, None)
+
+    def poll(self):
+        """
+        Fetch the readings stored since the last poll and send them to their subscribers, returning how many were new
+        """
+        # imported here, api.queries depends on the extensions this is one of
+        from api.extensions import db
+        from api.models import Power
+        from api.queries import live_readings, source_names
+
+        with self.lock:
+            keys = list(self.subscriptions)
+        if not keys:
+            self.primed = set()
+            return 0
+        b_ids = sorted(set(key[1] for key in keys if key[0] == 'building'))
+        sensor_names = [name for key in keys if key[0] == 'sensor' for name in source_names(key[1])]
+        late = timedelta(seconds=self.app.config['LIVE_LATE_READINGS'])
+
+        # readings dated further ahead of the clock than pushes accept, see api/ingest.py, are ignored: the newest
+        # reading is the poll cursor, which one of them would move past every real reading
+        horizon = datetime.now() + timedelta(seconds=self.app.config['INGEST_MAX_FUTURE'])
+        with self.app.app_context():
+            if self.watermark is None:
+                newest = db.session.query(func.max(Power.timestamp)).filter(Power.timestamp <= horizon).scalar()
+                self.watermark = newest or datetime.min + late
+            rows = live_readings(b_ids, sensor_names, self.watermark - late, horizon).all()
+
+        batches = {}
+        for row in rows:
+            timestamp, meas_type, _, source_name = row
+            if (timestamp, meas_type, source_name) in self.seen:
+                continue
+            self.seen[(timestamp, meas_type, source_name)] = timestamp
+            for key in (('building', building_id_mapper(source_name), meas_type), ('sensor', source_name.rstrip('\r'))):
+                if key in self.primed:
+                    batches.setdefault(key, []).append(tuple(row))
+        if rows:
+            self.watermark = max(self.watermark, rows[-1][0])
+            self.seen = dict(item for item in self.seen.items() if item[1] >= self.watermark - late)
+        self.primed = set(keys)
+
+        with self.lock:
+            for key, batch in batches.items():
+                for subscription in self.subscriptions.get(key, ()):
+                    subscription.send(batch)
+        return sum(len(batch) for batch in batches.values())
+
+    def start_poller(self):
+        # started lazily: threads do not survive the fork of gunicorn workers
+        if self.poller_pid == os.getpid():
+            return
+        with self.lock:
+            if self.poller_pid == os.getpid():
+                return
+            self.poller_pid = os.getpid()
+            threading.Thread(target=self.poll_forever, name='gtpower-live-poller', daemon=True).start()
+
+    def poll_forever(self):
+        while True:
+            time.sleep(self.app.config['LIVE_POLL_INTERVAL'])
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Could not poll for live readings")
+
+    def stream(self, key, encode, schema):
+        """
+        Subscribe to `key` and generate its Server-Sent Events: one 'readings' event with a JSON array per poll finding
+        new readings, and comments as heartbeats in between so proxies keep the connection open
+
+        The subscription is made once the body is first read, a generator closed before it started would never
+        unsubscribe.
+
+        :param encode: function encoding a row for `schema`, e.g. routes.reading_to_json
+        """
+        config = self.app.config
+        closes = time.time() + config['LIVE_MAX_DURATION']
+        subscription = self.subscribe(key)
+        try:
+            # EventSource clients reconnect after this many milliseconds once the stream closes
+            yield 'retry: 1000\n\n'
+            while not subscription.dropped and time.time() < closes:
+                try:
+                    rows = subscription.pending.get(timeout=max(0, min(config['LIVE_HEARTBEAT'], closes - time.time())))
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield 'event: readings\ndata: {0}\n\n'.format(json.dumps(dump(schema, [encode(row) for row in rows])))
+        finally:
+            self.unsubscribe(subscription)
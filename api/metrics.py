@@ -0,0 +1,121 @@
+"""
+Prometheus metrics of the API, served at /metrics.
+
+Recorded per endpoint: request latency (including streaming the body), time spent executing database statements,
+readings rows fetched, serialization time and response bytes, plus the waits for pooled database connections.
+The per-request measurements are taken by api/timing.py. Requires the optional 'prometheus_client' package.
+
+Under gunicorn, point PROMETHEUS_MULTIPROC_DIR at an empty directory shared by all workers, so /metrics reports
+the totals of every worker instead of only the one answering; see gunicorn_config.py.
+"""
+import logging
+import os
+import time
+
+from flask import Response, request
+
+from api.pool import pool_stats
+from api.timing import ENVIRON_KEY
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+BYTE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+if prometheus_client is not None:
+    REQUEST_LATENCY = prometheus_client.Histogram(
+        'gtpower_request_duration_seconds', 'Time to serve a request, including streaming its body',
+        ['endpoint', 'method', 'status'])
+    DB_QUERY_TIME = prometheus_client.Histogram(
+        'gtpower_db_query_duration_seconds', 'Time spent executing database statements per request', ['endpoint'])
+    ROWS_FETCHED = prometheus_client.Histogram(
+        'gtpower_rows_fetched', 'Readings rows fetched per request', ['endpoint'], buckets=ROW_BUCKETS)
+    SERIALIZATION_TIME = prometheus_client.Histogram(
+        'gtpower_serialization_duration_seconds', 'Time spent encoding buffered responses', ['endpoint'])
+    RESPONSE_BYTES = prometheus_client.Histogram(
+        'gtpower_response_bytes', 'Size of the response body as sent, after compression', ['endpoint'],
+        buckets=BYTE_BUCKETS)
+    POOL_WAIT = prometheus_client.Histogram(
+        'gtpower_db_pool_wait_seconds', 'Time waited for a pooled database connection', buckets=POOL_WAIT_BUCKETS)
+    POOL_TIMEOUTS = prometheus_client.Counter(
+        'gtpower_db_pool_timeouts_total', 'Requests for a pooled database connection that timed out')
+
+
+def observe_pool_wait(wait, timed_out):
+    POOL_WAIT.observe(wait)
+    if timed_out:
+        POOL_TIMEOUTS.inc()
+
+
+class Metrics(object):
+    """
+    Flask extension recording request metrics and serving them at /metrics
+    """
+
+    def __init__(self, app=None):
+        self.listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        if not app.config['METRICS_ENABLED']:
+            return
+        if prometheus_client is None:
+            logger.warning("METRICS_ENABLED is set but the 'prometheus_client' package is not installed, "
+                           "metrics are disabled")
+            return
+
+        if not self.listening:
+            # pool_stats is process-wide, listen to it once
+            pool_stats.listeners.append(observe_pool_wait)
+            self.listening = True
+        app.after_request(self.after_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def after_request(self, response):
+        # measured by api/timing.py
+        timing = request.environ.get(ENVIRON_KEY)
+        if timing is None:
+            return response
+        labels = (request.endpoint or 'none', request.method, str(response.status_code))
+        if response.is_streamed:
+            # the body is produced after this returns, observe once it has been sent
+            response.response = self.observed_stream(response.response, timing, labels)
+        else:
+            self.observe(timing, labels, response.calculate_content_length() or 0)
+        return response
+
+    def observed_stream(self, chunks, timing, labels):
+        sent = 0
+        try:
+            for chunk in chunks:
+                sent += len(chunk)
+                yield chunk
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            self.observe(timing, labels, sent)
+
+    def observe(self, timing, labels, sent):
+        endpoint = labels[0]
+        REQUEST_LATENCY.labels(*labels).observe(time.time() - timing.started)
+        DB_QUERY_TIME.labels(endpoint).observe(timing.db_seconds)
+        ROWS_FETCHED.labels(endpoint).observe(timing.rows)
+        SERIALIZATION_TIME.labels(endpoint).observe(timing.serialization_seconds)
+        RESPONSE_BYTES.labels(endpoint).observe(sent)
+
+    def metrics_view(self):
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir'):
+            registry = prometheus_client.CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = prometheus_client.REGISTRY
+        return Response(prometheus_client.generate_latest(registry), content_type=prometheus_client.CONTENT_TYPE_LATEST)
@@ -5,9 +5,17 @@ See SQL Alchemy documentation:
 http://flask-sqlalchemy.pocoo.org/2.3/
 http://docs.sqlalchemy.org/en/latest/
 """
-from sqlalchemy import String, Text, Float, Integer, DateTime, text
+from sqlalchemy import String, Text, Float, Integer, DateTime, Index, text
+from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.orm import synonym
 
 from api.extensions import db
+from api.helpers import building_id_mapper
+
+
+def _building_id_default(context):
+    """Derive power.building_id from the source_name being inserted, so ORM and Core inserts keep it in sync"""
+    return building_id_mapper(context.get_current_parameters()['source_name'])
 
 
 class Power(db.Model):
@@ -15,11 +23,87 @@ class Power(db.Model):
     DB model representing a building
     """
     __tablename__ = 'power'
+    __table_args__ = (
+        # building queries filter on (building_id, type) and a timestamp range, and page in (timestamp, source_name)
+        # order, see api/queries.py. Replaces ix_power_building_type_timestamp, which lacked source_name; run
+        # `flask backfill-building-ids` to migrate existing databases
+        Index('ix_power_building_type_timestamp_source', 'building_id', 'type', 'timestamp', 'source_name'),
+    )
 
-    timestamp = db.Column(DateTime, primary_key=True, nullable=False, index=True, server_default=text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"))
+    # on MySQL the table may be partitioned by month on timestamp, which must then stay part of every unique key,
+    # see api/partitions.py
+    timestamp = db.Column(DateTime, primary_key=True, nullable=False, index=True, server_default=text("CURRENT_TIMESTAMP"))
     type = db.Column(String(100), primary_key=True, nullable=False)
     value_read = db.Column(Float(asdecimal=True), nullable=False)
     source_name = db.Column(String(100), primary_key=True, nullable=False)
+    # 3-digit building ID parsed out of source_name (e.g. '026'), indexed instead of LIKE '%B026%' scans
+    building_id = db.Column(String(3), nullable=True, default=_building_id_default)
+
+
+class PowerRollupMixin(object):
+    """
+    Columns shared by the precomputed power rollups, one row per (bucket, type, source_name)
+
+    Maintained by `flask rollup-refresh`, see api/rollups.py
+    """
+    # start of the bucket
+    timestamp = db.Column(DateTime, primary_key=True, nullable=False)
+    type = db.Column(String(100), primary_key=True, nullable=False)
+    source_name = db.Column(String(100), primary_key=True, nullable=False)
+    building_id = db.Column(String(3), nullable=True)
+    value_count = db.Column(Integer, nullable=False)
+    value_min = db.Column(Float(asdecimal=True), nullable=False)
+    value_max = db.Column(Float(asdecimal=True), nullable=False)
+    value_mean = db.Column(Float(asdecimal=True), nullable=False)
+    value_first = db.Column(Float(asdecimal=True), nullable=False)
+    value_last = db.Column(Float(asdecimal=True), nullable=False)
+
+    # lets the queries in api/queries.py read a rollup like the power table
+    @declared_attr
+    def value_read(cls):
+        return synonym('value_mean')
+
+    @declared_attr
+    def __table_args__(cls):
+        return (Index('ix_{0}_building_type_timestamp'.format(cls.__tablename__), 'building_id', 'type', 'timestamp',
+                      'source_name'),)
+
+
+class PowerHourly(PowerRollupMixin, db.Model):
+    """
+    DB model representing hourly rollups of the power table
+    """
+    __tablename__ = 'power_hourly'
+    bucket_seconds = 60 * 60
+
+
+class PowerDaily(PowerRollupMixin, db.Model):
+    """
+    DB model representing daily rollups of the power table
+    """
+    __tablename__ = 'power_daily'
+    bucket_seconds = 24 * 60 * 60
+
+
+class RollupWatermark(db.Model):
+    """
+    DB model representing the latest power.timestamp folded into a rollup table
+    """
+    __tablename__ = 'rollup_watermarks'
+
+    table_name = db.Column(String(50), primary_key=True)
+    watermark = db.Column(DateTime, nullable=False)
+
+
+class ReadingsVersion(db.Model):
+    """
+    DB model counting the writes of readings into each month of the power table, which invalidate cached results
+    """
+    __tablename__ = 'readings_versions'
+
+    # first day of the month
+    month = db.Column(DateTime, primary_key=True)
+    version = db.Column(Integer, nullable=False)
 
 
 class Users(db.Model):
@@ -0,0 +1,140 @@
+"""
+Monthly partitions of the power table, on MySQL.
+
+The table is partitioned BY RANGE COLUMNS(timestamp): one partition per calendar month, named pYYYYMM and holding the
+readings before the first of the following month, plus pmax for anything later. timestamp leads the primary key, as
+MySQL requires of the partitioning column. Every readings query filters on a timestamp range, from which MySQL prunes
+the partitions outside it, so a query only reads the months it covers; partitions_for() applies the same rule.
+
+Partitions are created ahead of time and retired with `flask partitions`, see api/commands.py. Retiring a month drops
+its partition, which takes about as long as dropping a table rather than deleting rows. The partition can first be
+exchanged into a power_archive_YYYYMM table of its own, a metadata-only swap, to be dumped or moved elsewhere.
+
+SQLite, used for development and tests, has no partitioning: the table stays a single heap there.
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import text
+
+from api.extensions import db
+from api.helpers import TIMESTAMP_FORMAT, parse_timestamp
+from api.models import Power
+
+MAXVALUE_PARTITION = 'pmax'
+
+# `lower` and `upper` bound the timestamps of the partition, None where it is unbounded
+Partition = namedtuple('Partition', ['name', 'lower', 'upper', 'rows'])
+
+
+def month_start(timestamp):
+    return datetime(timestamp.year, timestamp.month, 1)
+
+
+def add_months(month, count):
+    months = month.year * 12 + month.month - 1 + count
+    return datetime(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(month):
+    return 'p{0:%Y%m}'.format(month)
+
+
+def archive_table_name(month):
+    return '{0}_archive_{1:%Y%m}'.format(Power.__tablename__, month)
+
+
+def partitioning_supported():
+    return db.session.get_bind().dialect.name == 'mysql'
+
+
+def table_partitions():
+    """
+    Partitions of the power table in order, or an empty list if it is not partitioned
+    """
+    rows = db.session.execute(text(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION"), dict(table=Power.__tablename__)).fetchall()
+    partitions = []
+    lower = None
+    for name, description, table_rows in rows:
+        # e.g. "'2016-10-01 00:00:00'", or MAXVALUE for the last partition
+        upper = None if description == 'MAXVALUE' else parse_timestamp(description.strip("'"))
+        partitions.append(Partition(name, lower, upper, table_rows))
+        lower = upper
+    return partitions
+
+
+def partitions_for(partitions, start, stop):
+    """
+    The partitions holding readings between `start` and `stop` inclusive
+    """
+    return [partition for partition in partitions
+            if (partition.lower is None or partition.lower <= stop)
+            and (partition.upper is None or partition.upper > start)]
+
+
+def month_definitions(first, last):
+    """
+    Partition definitions for the months from `first` to `last` inclusive
+    """
+    definitions = []
+    month = first
+    while month <= last:
+        definitions.append("PARTITION {0} VALUES LESS THAN ('{1}')".format(
+            partition_name(month), add_months(month, 1).strftime(TIMESTAMP_FORMAT)))
+        month = add_months(month, 1)
+    return definitions
+
+
+def partition_table_statement(first, last):
+    """
+    ALTER TABLE partitioning an unpartitioned power table by month, from `first` (which also receives any earlier
+    readings) to `last`. This rebuilds the table.
+    """
+    definitions = month_definitions(first, last) + \
+        ['PARTITION {0} VALUES LESS THAN (MAXVALUE)'.format(MAXVALUE_PARTITION)]
+    return 'ALTER TABLE {0} PARTITION BY RANGE COLUMNS(timestamp) ({1})'.format(
+        Power.__tablename__, ', '.join(definitions))
+
+
+def add_partitions_statement(partitions, last):
+    """
+    ALTER TABLE adding the monthly partitions missing up to `last` to a partitioned power table, or None if there are
+    none to add
+
+    New months are split off pmax, which only moves rows if some were already stored past the last month.
+    """
+    bounded = [partition for partition in partitions if partition.upper is not None]
+    if not bounded or bounded[-1].upper > last:
+        return None
+    definitions = month_definitions(bounded[-1].upper, last)
+    if partitions[-1].upper is not None:
+        return 'ALTER TABLE {0} ADD PARTITION ({1})'.format(Power.__tablename__, ', '.join(definitions))
+    definitions.append('PARTITION {0} VALUES LESS THAN (MAXVALUE)'.format(MAXVALUE_PARTITION))
+    return 'ALTER TABLE {0} REORGANIZE PARTITION {1} INTO ({2})'.format(
+        Power.__tablename__, partitions[-1].name, ', '.join(definitions))
+
+
+def retirable_partitions(partitions, before):
+    """
+    The monthly partitions holding only readings before `before`
+    """
+    return [partition for partition in partitions if partition.upper is not None and partition.upper <= before]
+
+
+def retire_statements(partition, archive):
+    """
+    Statements dropping a partition, after moving its rows to their own archive table if `archive` is set
+    """
+    statements = []
+    if archive:
+        table = archive_table_name(add_months(partition.upper, -1))
+        statements += [
+            'CREATE TABLE {0} LIKE {1}'.format(table, Power.__tablename__),
+            'ALTER TABLE {0} REMOVE PARTITIONING'.format(table),
+            'ALTER TABLE {0} EXCHANGE PARTITION {1} WITH TABLE {2}'.format(Power.__tablename__, partition.name, table)
+        ]
+    statements.append('ALTER TABLE {0} DROP PARTITION {1}'.format(Power.__tablename__, partition.name))
+    return statements
@@ -0,0 +1,91 @@
+"""
+Database connection pool settings and checkout wait metrics.
+
+Every connection checkout from the pool is timed. Waits are accumulated in `pool_stats` and waits longer than
+SQLALCHEMY_POOL_WAIT_WARNING seconds are logged, so queueing for connections under bursts of traffic shows up
+before requests start timing out.
+
+Configure with SQLALCHEMY_POOL_* settings, see api/config.py
+"""
+import logging
+import threading
+import time
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats(object):
+    """
+    Thread-safe counters of the connection checkouts of this process
+    """
+
+    def __init__(self, warn_after=None):
+        self.warn_after = warn_after
+        # functions of (wait, timed_out) called on every checkout, e.g. to export the waits, see api/metrics.py
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def observe(self, wait, timed_out=False):
+        with self.lock:
+            self.checkouts += 1
+            self.timeouts += int(timed_out)
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+        for listener in self.listeners:
+            listener(wait, timed_out)
+        if timed_out:
+            logger.warning("Timed out after waiting %.3fs for a database connection", wait)
+        elif self.warn_after is not None and wait > self.warn_after:
+            logger.warning("Waited %.3fs for a database connection", wait)
+
+    def to_dict(self):
+        with self.lock:
+            return dict(checkouts=self.checkouts, timeouts=self.timeouts,
+                        wait_seconds_total=self.wait_seconds_total, wait_seconds_max=self.wait_seconds_max)
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool recording how long each checkout waited for a connection in `pool_stats`
+    """
+
+    def _do_get(self):
+        started = time.time()
+        try:
+            connection = super(TimedQueuePool, self)._do_get()
+        except TimeoutError:
+            pool_stats.observe(time.time() - started, timed_out=True)
+            raise
+        pool_stats.observe(time.time() - started)
+        return connection
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy extension creating its engine with a TimedQueuePool and SQLALCHEMY_POOL_PRE_PING
+
+    SQLite keeps the pool Flask-SQLAlchemy picks for it.
+    """
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_POOL_PRE_PING', True)
+        app.config.setdefault('SQLALCHEMY_POOL_WAIT_WARNING', None)
+        pool_stats.warn_after = app.config['SQLALCHEMY_POOL_WAIT_WARNING']
+        super(PooledSQLAlchemy, self).init_app(app)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        if not sa_url.drivername.startswith('sqlite'):
+            options.setdefault('poolclass', TimedQueuePool)
+        options.setdefault('pool_pre_ping', app.config['SQLALCHEMY_POOL_PRE_PING'])
+        return super(PooledSQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
@@ -0,0 +1,172 @@
+"""
+Buffered writes of readings pushed by meters to the ingest endpoint.
+
+Pushed readings are validated by the request, appended to a bounded in-process queue and written to the power table
+by a background thread, in grouped transactions of up to INGEST_FLUSH_ROWS rows once that many are waiting or the
+oldest has waited INGEST_FLUSH_INTERVAL seconds. Requests are answered as soon as their readings are queued; when
+the queue holds INGEST_QUEUE_MAX_ROWS rows, e.g. because the database is down, further pushes are refused with 429
+until the writer catches up. Rows are inserted with api/ingest.py, so readings pushed twice are stored once.
+
+Only batches failing for reasons a retry can fix - the database being unreachable, timing out or failing the
+transaction - are queued again. A batch the database rejects is written again one row at a time, and the rows it
+still rejects are logged and dropped rather than blocking the queue.
+
+Each gunicorn worker has its own queue and writer. Readings still queued when a worker exits normally are flushed
+before it does; readings queued by a worker that is killed are lost and have to be pushed again.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import exc
+
+logger = logging.getLogger(__name__)
+
+
+# errors after which writing the same rows again may succeed
+RETRYABLE_ERRORS = (exc.OperationalError, exc.InterfaceError, exc.TimeoutError, exc.DisconnectionError)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class PushQueue(object):
+    """
+    Flask extension buffering pushed readings and writing them to the database in batches
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.rows = []
+        self.oldest = None
+        self.condition = threading.Condition()
+        self.writer_pid = None
+        # functions called with every batch of rows written, e.g. to update the latest readings, see api/latest.py
+        self.listeners = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('INGEST_QUEUE_MAX_ROWS', 100000)
+        app.config.setdefault('INGEST_FLUSH_ROWS', 5000)
+        app.config.setdefault('INGEST_FLUSH_INTERVAL', 1.0)
+        app.config.setdefault('INGEST_MAX_FUTURE', 5 * 60)
+        self.app = app
+
+    @property
+    def pending(self):
+        return len(self.rows)
+
+    def put(self, rows):
+        """
+        Queue rows of the power table for writing, raising QueueFullError if they do not fit
+        """
+        config = self.app.config
+        with self.condition:
+            if len(self.rows) + len(rows) > config['INGEST_QUEUE_MAX_ROWS']:
+                raise QueueFullError()
+            was_empty = not self.rows
+            if was_empty:
+                self.oldest = time.time()
+            self.rows.extend(rows)
+            full = len(self.rows) >= config['INGEST_FLUSH_ROWS']
+            if full or was_empty:
+                # wake the writer to flush now or to time the new oldest row
+                self.condition.notify()
+        if config['INGEST_FLUSH_INTERVAL'] is None:
+            # no writer thread, the request filling the batch writes it
+            if full:
+                self.flush()
+        else:
+            self.start_writer()
+
+    def take(self):
+        with self.condition:
+            rows, self.rows, self.oldest = self.rows, [], None
+            return rows
+
+    def flush(self):
+        """
+        Write all queued rows, returning the number inserted, or None if the database failed and the rows that could
+        not be written were queued again
+        """
+        rows = self.take()
+        batch_size = self.app.config['INGEST_FLUSH_ROWS']
+        inserted = 0
+        with self.app.app_context():
+            for offset in range(0, len(rows), batch_size):
+                batch = rows[offset:offset + batch_size]
+                try:
+                    count, batch = self.write(batch)
+                except RETRYABLE_ERRORS:
+                    logger.exception("Could not write %d pushed readings, retrying", len(rows) - offset)
+                    with self.condition:
+                        # the statement ignores rows already stored, so retrying the whole batch is safe
+                        self.rows[:0] = rows[offset:]
+                        self.oldest = time.time()
+                    return None
+                inserted += count
+                for listener in self.listeners:
+                    listener(batch)
+        return inserted
+
+    def write(self, batch):
+        """
+        Insert a batch of rows, falling back to one row at a time to drop the rows the database rejects if it
+        rejects the batch. Returns the number of rows inserted and the rows kept, or raises one of RETRYABLE_ERRORS if
+        the rows should be written again later.
+        """
+        # imported here, api.ingest depends on the extensions this is one of
+        from api.extensions import db
+        from api.ingest import insert_readings
+
+        try:
+            return insert_readings(batch), batch
+        except RETRYABLE_ERRORS:
+            db.session.rollback()
+            raise
+        except Exception:
+            db.session.rollback()
+            logger.exception("Could not write %d pushed readings, writing them one at a time", len(batch))
+        inserted = 0
+        kept = []
+        for row in batch:
+            try:
+                inserted += insert_readings([row])
+            except RETRYABLE_ERRORS:
+                db.session.rollback()
+                raise
+            except Exception:
+                db.session.rollback()
+                logger.exception("Dropping a pushed reading the database rejected: %r", row)
+            else:
+                kept.append(row)
+        return inserted, kept
+
+    def start_writer(self):
+        # started lazily: threads do not survive the fork of gunicorn workers
+        if self.writer_pid == os.getpid():
+            return
+        with self.condition:
+            if self.writer_pid == os.getpid():
+                return
+            self.writer_pid = os.getpid()
+            threading.Thread(target=self.write_forever, name='gtpower-push-writer', daemon=True).start()
+            atexit.register(self.flush)
+
+    def write_forever(self):
+        config = self.app.config
+        while True:
+            with self.condition:
+                while True:
+                    waited = time.time() - self.oldest if self.oldest is not None else 0
+                    if len(self.rows) >= config['INGEST_FLUSH_ROWS'] or (self.rows and
+                                                                         waited >= config['INGEST_FLUSH_INTERVAL']):
+                        break
+                    self.condition.wait(config['INGEST_FLUSH_INTERVAL'] - waited if self.rows else None)
+            if self.flush() is None:
+                # the database is failing, back off before retrying
+                time.sleep(config['INGEST_FLUSH_INTERVAL'])
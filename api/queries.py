@@ -0,0 +1,368 @@
+"""
+Queries against the 'power' table shared by the API routes.
+
+Each function returns an un-executed SQLAlchemy query whose rows are laid out
+(timestamp, type, value_read, source_name), the layout expected by helpers.res_to_json.
+Readings are sorted by the (timestamp, type, source_name) primary key, so they can be paged with keyset_page.
+"""
+import calendar
+from datetime import datetime
+
+from sqlalchemy import DateTime, Integer, and_, case, cast, distinct, func, null, or_, type_coerce
+
+from api.extensions import db
+from api.models import Power
+
+ENERGY_TYPE = 'Active Energy Delivered'
+POWER_TYPE = 'Active Power'
+MEASUREMENT_TYPES = (ENERGY_TYPE, POWER_TYPE)
+
+# bucket widths, in seconds, accepted by the 'resolution' query parameter
+RESOLUTIONS = {
+    '15min': 15 * 60,
+    'hour': 60 * 60,
+    'day': 24 * 60 * 60
+}
+
+# aggregates accepted by the 'agg' query parameter that map to a SQL aggregate function
+SQL_AGGREGATES = {
+    'mean': func.avg,
+    'min': func.min,
+    'max': func.max,
+    'sum': func.sum
+}
+# 'last' has no portable SQL aggregate and is always computed by aggregate_rows
+AGGREGATES = tuple(SQL_AGGREGATES) + ('last',)
+
+# how each value of the 'agg' parameter is computed from the (count, total, min, max, last) of a bucket
+BUCKET_REDUCERS = {
+    'mean': lambda count, total, minimum, maximum, last: total / count,
+    'min': lambda count, total, minimum, maximum, last: minimum,
+    'max': lambda count, total, minimum, maximum, last: maximum,
+    'sum': lambda count, total, minimum, maximum, last: total,
+    'last': lambda count, total, minimum, maximum, last: last
+}
+
+# column order expected by helpers.res_to_json
+READING_COLUMNS = (Power.timestamp, Power.type, Power.value_read, Power.source_name)
+
+
+def building_readings(b_id, meas_type, start, stop, model=Power):
+    """
+    Readings of one measurement type for every sensor in a building, served by
+    ix_power_building_type_timestamp_source
+
+    `model` may also be one of the rollups in api/models.py, which share the power table's columns.
+    """
+    return db.session.query(model.timestamp, model.type, model.value_read, model.source_name).filter(
+        model.building_id == b_id.zfill(3),
+        model.type == meas_type,
+        model.timestamp >= start,
+        model.timestamp <= stop
+    ).order_by(model.timestamp.asc(), model.type.asc(), model.source_name.asc())
+
+
+def buildings_readings(b_ids, meas_type, start, stop, model=Power):
+    """
+    Readings of one measurement type for every sensor in several buildings, in one query, see building_readings
+    """
+    return db.session.query(model.timestamp, model.type, model.value_read, model.source_name).filter(
+        model.building_id.in_([b_id.zfill(3) for b_id in b_ids]),
+        model.type == meas_type,
+        model.timestamp >= start,
+        model.timestamp <= stop
+    ).order_by(model.timestamp.asc(), model.type.asc(), model.source_name.asc())
+
+
+def campus_readings(meas_type, start, stop):
+    """
+    Readings of one measurement type for every sensor on campus
+    """
+    return db.session.query(*READING_COLUMNS).filter(
+        Power.type == meas_type,
+        Power.timestamp >= start,
+        Power.timestamp <= stop
+    ).order_by(Power.timestamp.asc(), Power.type.asc(), Power.source_name.asc())
+
+
+def campus_sources(meas_type, start, stop):
+    """
+    Names of the sensors with readings of one measurement type in a time range
+    """
+    return [source_name for source_name, in campus_readings(meas_type, start, stop)
+            .with_entities(Power.source_name).distinct().order_by(None)]
+
+
+def building_export(b_id, start, stop):
+    """
+    Readings of every measurement type for every sensor in a building, for bulk exports
+
+    Sorted by (type, timestamp, source_name) so the rows come straight off ix_power_building_type_timestamp_source.
+    """
+    return db.session.query(*READING_COLUMNS).filter(
+        Power.building_id == b_id.zfill(3),
+        Power.type.in_(MEASUREMENT_TYPES),
+        Power.timestamp >= start,
+        Power.timestamp <= stop
+    ).order_by(Power.type.asc(), Power.timestamp.asc(), Power.source_name.asc())
+
+
+def source_names(sensor_id):
+    """
+    Values of power.source_name a sensor's readings may be stored under: readings loaded before `flask ingest`
+    carry a trailing '\r', ingested ones do not
+    """
+    return sensor_id, sensor_id + '\r'
+
+
+def sensor_readings(sensor_id, start, stop, model=Power):
+    """
+    All readings of a single sensor
+    """
+    return db.session.query(model.timestamp, model.type, model.value_read, model.source_name).filter(
+        model.source_name.in_(source_names(sensor_id)),
+        model.timestamp >= start,
+        model.timestamp <= stop
+    ).order_by(model.timestamp.asc(), model.type.asc(), model.source_name.asc())
+
+
+def sensors_readings(sensor_ids, start, stop, model=Power):
+    """
+    All readings of several sensors, in one query
+    """
+    return db.session.query(model.timestamp, model.type, model.value_read, model.source_name).filter(
+        model.source_name.in_([source_name for sensor_id in sensor_ids for source_name in source_names(sensor_id)]),
+        model.timestamp >= start,
+        model.timestamp <= stop
+    ).order_by(model.timestamp.asc(), model.type.asc(), model.source_name.asc())
+
+
+def live_readings(b_ids, sensor_names, since, until):
+    """
+    Readings of any of the buildings `b_ids` or with a source_name in `sensor_names`, from `since` to `until`
+
+    One query serves every live subscription of a worker, see api/live.py
+    """
+    conditions = []
+    if b_ids:
+        conditions.append(Power.building_id.in_(b_ids))
+    if sensor_names:
+        conditions.append(Power.source_name.in_(sensor_names))
+    return db.session.query(Power.timestamp, Power.type, Power.value_read, Power.source_name).filter(
+        or_(*conditions),
+        Power.timestamp >= since,
+        Power.timestamp <= until
+    ).order_by(Power.timestamp.asc(), Power.type.asc(), Power.source_name.asc())
+
+
+def last_readings(since):
+    """
+    The newest reading of every sensor and measurement type that has one from `since` onwards
+    """
+    newest = db.session.query(Power.type, Power.source_name, func.max(Power.timestamp).label('timestamp')).filter(
+        Power.timestamp >= since
+    ).group_by(Power.type, Power.source_name).subquery()
+    return db.session.query(Power.timestamp, Power.type, Power.value_read, Power.source_name).join(newest, and_(
+        Power.timestamp == newest.c.timestamp,
+        Power.type == newest.c.type,
+        Power.source_name == newest.c.source_name
+    ))
+
+
+def keyset_page(query, cursor, limit, model=Power):
+    """
+    Limit a readings query to the `limit` rows following `cursor`, the (timestamp, type, source_name) key of the
+    last row of the previous page
+
+    Unlike OFFSET, the predicate seeks straight to the cursor through the index, so every page costs the same.
+    """
+    if cursor is not None:
+        timestamp, meas_type, source_name = cursor
+        query = query.filter(or_(
+            model.timestamp > timestamp,
+            and_(model.timestamp == timestamp, or_(
+                model.type > meas_type,
+                and_(model.type == meas_type, model.source_name > source_name)
+            ))
+        ))
+    return query.limit(limit)
+
+
+def floor_timestamp(timestamp, seconds):
+    """
+    Start of the `seconds` wide bucket containing a (naive, UTC) datetime
+    """
+    epoch = calendar.timegm(timestamp.timetuple())
+    return datetime.utcfromtimestamp(epoch - epoch % seconds)
+
+
+def epoch_expression(column=Power.timestamp):
+    """
+    SQL expression converting a timestamp column to UNIX epoch seconds, or None if the dialect is not supported
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'mysql':
+        return func.unix_timestamp(column)
+    if dialect == 'sqlite':
+        return cast(func.strftime('%s', column), Integer)
+    return None
+
+
+def bucket_expression(seconds, column=Power.timestamp):
+    """
+    SQL expression flooring a timestamp column to a multiple of `seconds`, or None if the dialect is not supported
+    """
+    epoch = epoch_expression(column)
+    if epoch is None:
+        return None
+    if db.session.get_bind().dialect.name == 'mysql':
+        return func.from_unixtime(func.floor(epoch / seconds) * seconds)
+    return type_coerce(func.datetime(epoch / seconds * seconds, 'unixepoch'), DateTime)
+
+
+def window_functions_supported():
+    """
+    True if the database supports window functions such as LAG (SQLite 3.25+, MySQL 8.0+, MariaDB 10.2+)
+    """
+    dialect = db.session.get_bind().dialect
+    if dialect.name == 'sqlite':
+        return dialect.dbapi.sqlite_version_info >= (3, 25)
+    if dialect.name == 'mysql':
+        version = dialect.server_version_info or ()
+        return version >= ((10, 2) if getattr(dialect, '_is_mariadb', False) else (8, 0))
+    return False
+
+
+def aggregate_readings(query, resolution, agg):
+    """
+    Resample a readings query into `resolution` buckets per sensor, reducing each bucket with `agg`
+
+    The bucketing is pushed into a SQL GROUP BY where possible, otherwise the rows are reduced by aggregate_rows.
+    """
+    seconds = RESOLUTIONS[resolution]
+    bucket = bucket_expression(seconds)
+    if bucket is None or agg not in SQL_AGGREGATES:
+        return aggregate_rows(query, seconds, agg)
+
+    bucket = bucket.label('timestamp')
+    return query.with_entities(bucket, Power.type, SQL_AGGREGATES[agg](Power.value_read), Power.source_name) \
+        .group_by(bucket, Power.type, Power.source_name) \
+        .order_by(None).order_by(bucket, Power.source_name)
+
+
+def aggregate_rows(rows, seconds, agg):
+    """
+    Single pass fallback of aggregate_readings over timestamp-ordered (timestamp, type, value_read, source_name) rows
+    """
+    buckets = {}
+    for timestamp, meas_type, value_read, source_name in rows:
+        key = (floor_timestamp(timestamp, seconds), source_name, meas_type)
+        count, total, minimum, maximum, _ = buckets.get(key, (0, 0, value_read, value_read, None))
+        buckets[key] = (count + 1, total + value_read, min(minimum, value_read), max(maximum, value_read), value_read)
+    return reduce_buckets(buckets, agg)
+
+
+def reduce_buckets(buckets, agg):
+    """
+    (timestamp, type, value, source_name) rows from a dict of (bucket, source_name, type) -> (count, total, min, max,
+    last), ordered like the SQL aggregations
+    """
+    return [(bucket, meas_type, BUCKET_REDUCERS[agg](*buckets[bucket, source_name, meas_type]), source_name)
+            for bucket, source_name, meas_type in sorted(buckets)]
+
+
+def campus_totals(query, resolution, codes=None):
+    """
+    Total of a readings query across its sensors per `resolution` bucket, as (timestamp, type, total, code) rows
+
+    Readings are summed per timestamp and those sums averaged over the timestamps of the bucket, so the hourly total
+    of 15 minute power readings is the mean load over that hour rather than four times it. The work is pushed into a
+    SQL GROUP BY where possible, otherwise the rows are reduced by total_rows.
+
+    :param codes: mapping of source_name -> sensor type code to total each code separately, or None for one total
+    """
+    seconds = RESOLUTIONS[resolution]
+    bucket = bucket_expression(seconds)
+    if bucket is None:
+        return total_rows(query, seconds, codes)
+
+    bucket = bucket.label('timestamp')
+    code = (case(codes, value=Power.source_name) if codes else null()).label('sensor_type')
+    total = func.sum(Power.value_read) / func.count(distinct(Power.timestamp))
+    return query.with_entities(bucket, Power.type, total, code) \
+        .group_by(bucket, Power.type, code) \
+        .order_by(None).order_by(bucket, code)
+
+
+def total_rows(rows, seconds, codes=None):
+    """
+    Single pass fallback of campus_totals over (timestamp, type, value_read, source_name) rows
+    """
+    totals = {}
+    timestamps = {}
+    for timestamp, meas_type, value_read, source_name in rows:
+        key = (floor_timestamp(timestamp, seconds), meas_type, codes.get(source_name) if codes else None)
+        totals[key] = totals.get(key, 0) + value_read
+        timestamps.setdefault(key, set()).add(timestamp)
+    return [(bucket, meas_type, totals[bucket, meas_type, code] / len(timestamps[bucket, meas_type, code]), code)
+            for bucket, meas_type, code in sorted(totals, key=lambda key: (key[0], key[2] or ''))]
+
+
+def consumption_readings(query, start, max_gap, resolution=None):
+    """
+    Consumption between consecutive readings of cumulative counters, as (timestamp, type, delta, source_name) rows
+
+    Each reading from `start` on yields the difference to the previous reading of its sensor. A reading lower than
+    its predecessor means the counter was reset, and the reading itself is the consumption since. Readings more than
+    `max_gap` seconds after their predecessor yield nothing, as the consumption cannot be placed in time. With a
+    `resolution` the deltas are summed per bucket and sensor.
+
+    Deltas are computed with LAG where the database has window functions, otherwise by consumption_rows.
+
+    :param query: readings query from `start` minus `max_gap`, so the first readings in range have a predecessor
+    """
+    epoch = epoch_expression()
+    if epoch is None or not window_functions_supported():
+        return consumption_rows(query, start, max_gap, resolution)
+
+    window = dict(partition_by=(Power.source_name, Power.type), order_by=Power.timestamp)
+    readings = query.with_entities(
+        Power.timestamp.label('timestamp'),
+        Power.type.label('type'),
+        Power.value_read.label('value_read'),
+        Power.source_name.label('source_name'),
+        epoch.label('epoch'),
+        func.lag(Power.value_read).over(**window).label('previous_value'),
+        func.lag(epoch).over(**window).label('previous_epoch')
+    ).order_by(None).subquery()
+    delta = case([(readings.c.value_read < readings.c.previous_value, readings.c.value_read)],
+                 else_=readings.c.value_read - readings.c.previous_value)
+    consumption = db.session.query(readings.c.timestamp, readings.c.type, delta, readings.c.source_name).filter(
+        readings.c.timestamp >= start,
+        readings.c.previous_value.isnot(None),
+        readings.c.epoch - readings.c.previous_epoch <= max_gap
+    )
+    if resolution is None:
+        return consumption.order_by(readings.c.timestamp, readings.c.type, readings.c.source_name)
+
+    bucket = bucket_expression(RESOLUTIONS[resolution], readings.c.timestamp).label('timestamp')
+    return consumption.with_entities(bucket, readings.c.type, func.sum(delta), readings.c.source_name) \
+        .group_by(bucket, readings.c.type, readings.c.source_name) \
+        .order_by(bucket, readings.c.source_name)
+
+
+def consumption_rows(rows, start, max_gap, resolution=None):
+    """
+    Single pass fallback of consumption_readings over timestamp-ordered (timestamp, type, value_read, source_name) rows
+    """
+    previous = {}
+    deltas = []
+    for timestamp, meas_type, value_read, source_name in rows:
+        last = previous.get((source_name, meas_type))
+        previous[source_name, meas_type] = (timestamp, value_read)
+        if last is None or timestamp < start or (timestamp - last[0]).total_seconds() > max_gap:
+            continue
+        deltas.append((timestamp, meas_type, value_read if value_read < last[1] else value_read - last[1], source_name))
+    if resolution is None:
+        return deltas
+    return aggregate_rows(deltas, RESOLUTIONS[resolution], 'sum')
@@ -0,0 +1,171 @@
+"""
+Precomputed hourly and daily rollups of the 'power' table.
+
+Each rollup table stores count/min/max/mean/first/last per (bucket, type, source_name), so long range
+aggregate queries never touch raw readings. Tables are refreshed incrementally by `flask rollup-refresh`:
+only the buckets at or after the recorded watermark are recomputed.
+"""
+from datetime import timedelta
+
+from sqlalchemy import func
+
+from api.extensions import db
+from api.ingest import bump_versions
+from api.models import Power, PowerDaily, PowerHourly, RollupWatermark
+from api.partitions import month_start
+from api.queries import READING_COLUMNS, RESOLUTIONS, bucket_expression, floor_timestamp, reduce_buckets
+
+# coarsest first, so the cheapest table satisfying a resolution is picked
+ROLLUPS = (PowerDaily, PowerHourly)
+
+# how each value of the 'agg' parameter is read from a rollup row
+ROLLUP_AGGREGATES = {
+    'mean': lambda model: model.value_mean,
+    'min': lambda model: model.value_min,
+    'max': lambda model: model.value_max,
+    'sum': lambda model: model.value_mean * model.value_count,
+    'last': lambda model: model.value_last
+}
+
+# how each value of the 'agg' parameter combines several rollup rows into a coarser bucket. 'last' has no portable
+# SQL aggregate and is computed by reaggregate_rows
+ROLLUP_REAGGREGATES = {
+    'mean': lambda model: func.sum(model.value_mean * model.value_count) / func.sum(model.value_count),
+    'min': lambda model: func.min(model.value_min),
+    'max': lambda model: func.max(model.value_max),
+    'sum': lambda model: func.sum(model.value_mean * model.value_count)
+}
+
+INSERT_BATCH_SIZE = 1000
+
+ONE_SECOND = timedelta(seconds=1)
+
+
+def rollup_for(resolution, start, stop):
+    """
+    The coarsest rollup table that can answer a `resolution` query from `start` to `stop`, or None to use raw readings
+
+    A rollup qualifies when its bucket width divides `resolution` (days can be combined from hourly buckets), the
+    range covers whole `resolution` buckets (e.g. 00:00:00 to 23:59:59) and the table has been refreshed past `stop`.
+    """
+    seconds = RESOLUTIONS[resolution]
+    if floor_timestamp(start, seconds) != start or floor_timestamp(stop + ONE_SECOND, seconds) != stop + ONE_SECOND:
+        return None
+    for model in ROLLUPS:
+        if seconds % model.bucket_seconds:
+            continue
+        mark = RollupWatermark.query.get(model.__tablename__)
+        if mark is not None and mark.watermark >= stop:
+            return model
+    return None
+
+
+def rollup_readings(query, model, resolution, agg):
+    """
+    Select the `agg` value of each `resolution` bucket of a readings query built on a rollup table
+
+    Rollup buckets narrower than `resolution` are combined in a SQL GROUP BY where possible, otherwise by
+    reaggregate_rows.
+    """
+    seconds = RESOLUTIONS[resolution]
+    if model.bucket_seconds == seconds:
+        return query.with_entities(model.timestamp, model.type, ROLLUP_AGGREGATES[agg](model), model.source_name)
+    bucket = bucket_expression(seconds, model.timestamp)
+    if bucket is None or agg not in ROLLUP_REAGGREGATES:
+        return reaggregate_rows(query.with_entities(
+            model.timestamp, model.type, model.value_count, model.value_min, model.value_max, model.value_mean,
+            model.value_last, model.source_name), seconds, agg)
+    bucket = bucket.label('timestamp')
+    return query.with_entities(bucket, model.type, ROLLUP_REAGGREGATES[agg](model), model.source_name) \
+        .group_by(bucket, model.type, model.source_name) \
+        .order_by(None).order_by(bucket, model.source_name)
+
+
+def reaggregate_rows(rows, seconds, agg):
+    """
+    Combine timestamp-ordered rollup rows into `seconds` wide buckets, like queries.aggregate_rows does raw readings
+    """
+    buckets = {}
+    for timestamp, meas_type, count, minimum, maximum, mean, last, source_name in rows:
+        key = (floor_timestamp(timestamp, seconds), source_name, meas_type)
+        total_count, total, lowest, highest, _ = buckets.get(key, (0, 0, minimum, maximum, None))
+        buckets[key] = (total_count + count, total + mean * count, min(lowest, minimum), max(highest, maximum), last)
+    return reduce_buckets(buckets, agg)
+
+
+def refresh_rollup(model, full=False):
+    """
+    Recompute the buckets of a rollup table at or after its watermark, returning the number of buckets written
+
+    Raw rows older than the watermark that arrive late are only picked up with `full=True`, which rebuilds the table
+    from the oldest raw reading on. Buckets before it are kept: their raw readings may have been retired from the
+    power table, see api/partitions.py. The months rewritten get a new version, which invalidates the results cached
+    for them, see api/cache.py.
+    """
+    seconds = model.bucket_seconds
+    mark = RollupWatermark.query.get(model.__tablename__)
+    if full:
+        oldest = db.session.query(func.min(Power.timestamp)).scalar()
+        if oldest is None:
+            # nothing to rebuild from, e.g. every month was retired
+            return 0
+        since = floor_timestamp(oldest, seconds)
+    elif mark is not None:
+        # the bucket holding the watermark may have been partially filled at the last refresh
+        since = floor_timestamp(mark.watermark, seconds)
+    else:
+        since = None
+
+    stale = db.session.query(model)
+    raw = db.session.query(*(READING_COLUMNS + (Power.building_id,)))
+    if since is not None:
+        stale = stale.filter(model.timestamp >= since)
+        raw = raw.filter(Power.timestamp >= since)
+    stale.delete(synchronize_session=False)
+
+    # readings arrive in timestamp order, so every bucket before the current one is complete and can be flushed
+    buckets = {}
+    pending = []
+    written = 0
+    watermark = None
+    current = None
+    months = set() if since is None else {month_start(since)}
+    for timestamp, meas_type, value_read, source_name, building_id in raw.order_by(Power.timestamp.asc()).yield_per(10000):
+        bucket = floor_timestamp(timestamp, seconds)
+        if bucket != current:
+            pending.extend(buckets.values())
+            buckets = {}
+            current = bucket
+            months.add(month_start(bucket))
+            if len(pending) >= INSERT_BATCH_SIZE:
+                db.session.execute(model.__table__.insert(), pending)
+                written += len(pending)
+                pending = []
+        rollup = buckets.get((source_name, meas_type))
+        if rollup is None:
+            buckets[source_name, meas_type] = dict(
+                timestamp=bucket, type=meas_type, source_name=source_name, building_id=building_id,
+                value_count=1, value_min=value_read, value_max=value_read, value_mean=value_read,
+                value_first=value_read, value_last=value_read)
+        else:
+            rollup['value_count'] += 1
+            rollup['value_min'] = min(rollup['value_min'], value_read)
+            rollup['value_max'] = max(rollup['value_max'], value_read)
+            rollup['value_last'] = value_read
+            rollup['value_mean'] += (value_read - rollup['value_mean']) / rollup['value_count']
+        watermark = timestamp
+    pending.extend(buckets.values())
+    if pending:
+        db.session.execute(model.__table__.insert(), pending)
+        written += len(pending)
+
+    if watermark is not None:
+        if mark is None:
+            mark = RollupWatermark(table_name=model.__tablename__, watermark=watermark)
+            db.session.add(mark)
+        else:
+            mark.watermark = watermark
+    if months:
+        bump_versions(months)
+    db.session.commit()
+    return written
@@ -4,20 +4,499 @@ Places API route / endpoint implementations
 Uses Flask Blueprints as explained here:
 http://flask.pocoo.org/docs/0.12/blueprints/#blueprints
 """
+import hashlib
+import hmac
+from datetime import timedelta
+from functools import partial
 from http import HTTPStatus
 
 import flask
-from flask import request, Blueprint
+from flask import request, Blueprint, Response, current_app, stream_with_context, url_for
 from flask_cas import login_required
+from sqlalchemy import func
 
-from api.errors import NotFoundException, BadRequestException
-from api.extensions import cas, db
+from api.errors import NotFoundException, BadRequestException, UnauthorizedException, ForbiddenException, \
+    TooManyRequestsException, ServiceUnavailableException
+from api.cache import cache_key
+from api.compression import COMPRESSORS
+from api.extensions import cas, db, cache, push_queue, live_feed, latest
+from api.ingest import latest_timestamp, parse_reading
+from api.live import StreamLimitError
+from api.push import QueueFullError
+from api.timing import serialization_timer
 from api.models import Power, Users, Sensors
-from api.schema import power_energy_schema, sensor_schema, sensor_metadata_schema
-from api.helpers import res_to_json, sensortype_mapper, units_mapper
+from api.schema import power_energy_schema, sensor_schema, sensor_metadata_schema, columnar_schema, campus_schema
+from api.helpers import res_to_json, res_to_columns, sensortype_mapper, units_mapper, parse_timestamp, encode_cursor, \
+    decode_cursor, building_id_mapper, source_mapper, sensortype_code_mapper, SENSOR_TYPES
+from api.queries import building_readings, buildings_readings, building_export, sensor_readings, sensors_readings, \
+    campus_readings, campus_sources, campus_totals, aggregate_readings, consumption_readings, keyset_page, ENERGY_TYPE, \
+    POWER_TYPE, RESOLUTIONS, AGGREGATES
+from api.rollups import rollup_for, rollup_readings
+from api.streaming import dump, iterate_rows, stream_json_array
+from api.export import ARROW_STREAM_MIMETYPE, PARQUET_MIMETYPE, import_pyarrow, stream_arrow, stream_parquet, stream_csv
 
 api = Blueprint('gtpower', __name__)
 
+# values of the 'format' query parameter of the readings endpoints
+RESPONSE_FORMATS = ('json', 'columnar', 'arrow', 'parquet')
+RESPONSE_MIMETYPES = {
+    'json': 'application/json',
+    'columnar': 'application/json',
+    'arrow': ARROW_STREAM_MIMETYPE,
+    'parquet': PARQUET_MIMETYPE
+}
+# query parameters changing the rows returned by a readings endpoint, in addition to its IDs and time range
+CACHED_PARAMS = ('resolution', 'agg', 'limit', 'cursor', 'consumption')
+
+
+def get_time_range(params=None):
+    """
+    Read and validate the mandatory start/stop query parameters of the readings endpoints
+
+    :param params: mapping holding start and stop, defaults to the query string
+    """
+    params = request.args if params is None else params
+    start = params.get('start')
+    stop = params.get('stop')
+    if not start or not stop:
+        raise BadRequestException(message="start and stop parameters required, you cannot query the whole database")
+    try:
+        return parse_timestamp(start), parse_timestamp(stop)
+    except ValueError:
+        raise BadRequestException(message="start and stop must be formatted as 'YYYY-MM-DD HH:MM:SS'")
+
+
+def get_page():
+    """
+    Read and validate the optional limit/cursor keyset pagination parameters of the readings endpoints
+    """
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    if limit is None:
+        if cursor is not None:
+            raise BadRequestException(message="cursor requires a limit")
+        return None, None
+    max_limit = current_app.config["READINGS_MAX_PAGE_SIZE"]
+    try:
+        limit = int(limit)
+        if cursor is not None:
+            cursor = decode_cursor(cursor)
+    except ValueError:
+        raise BadRequestException(message="limit must be an integer and cursor a value returned in a 'next' link")
+    if not 0 < limit <= max_limit:
+        raise BadRequestException(message="limit must be between 1 and {0}".format(max_limit))
+    return limit, cursor
+
+
+def next_page_link(rows):
+    """
+    URL of the page following `rows`, or None if this is the last page or the request is not paged
+    """
+    limit = request.args.get('limit')
+    if limit is None or len(rows) < int(limit):
+        return None
+    timestamp, meas_type, _, source_name = rows[-1]
+    args = request.args.to_dict()
+    args.update(request.view_args)
+    args['cursor'] = encode_cursor(timestamp, meas_type, source_name)
+    return url_for(request.endpoint, _external=True, **args)
+
+
+def get_readings(readings, start, stop):
+    """
+    Run a readings query through the result cache, see query_readings
+
+    Streamed requests bypass the cache, their results are not held in memory.
+    """
+    params = tuple(request.args.get(name) for name in CACHED_PARAMS)
+    key = cache_key(readings.func.__name__, *(readings.args + (start, stop) + params))
+    rows = cache.get(key, stop)
+    if rows is not None:
+        return rows
+    rows = query_readings(readings, start, stop)
+    if stream_requested():
+        return rows
+    rows = [tuple(row) for row in rows]
+    cache.set(key, rows, stop)
+    return rows
+
+
+def query_readings(readings, start, stop):
+    """
+    Build a readings query, applying the optional resolution/agg query parameters of the readings endpoints
+
+    :param readings: function of (start, stop, model) building the query, e.g. a partial of queries.building_readings
+    """
+    resolution = request.args.get('resolution')
+    agg = request.args.get('agg', 'mean')
+    limit, cursor = get_page()
+    if consumption_requested():
+        if limit is not None or 'agg' in request.args:
+            raise BadRequestException(message="consumption cannot be combined with agg, limit or cursor")
+        if resolution is not None and resolution not in RESOLUTIONS:
+            raise BadRequestException(message="resolution must be one of: " + ", ".join(RESOLUTIONS))
+        max_gap = current_app.config["CONSUMPTION_MAX_GAP"]
+        query = readings(start - timedelta(seconds=max_gap), stop).filter(Power.type == ENERGY_TYPE)
+        return consumption_readings(query, start, max_gap, resolution)
+    if resolution is None:
+        if 'agg' in request.args:
+            raise BadRequestException(message="agg requires a resolution")
+        if limit is not None:
+            return keyset_page(readings(start, stop), cursor, limit).all()
+        return readings(start, stop)
+    if limit is not None:
+        raise BadRequestException(message="limit and cursor cannot be combined with resolution")
+    return resample_readings(readings, start, stop, resolution, agg)
+
+
+def resample_readings(readings, start, stop, resolution, agg):
+    """
+    Build a readings query resampled into `resolution` buckets reduced with `agg`, from a rollup table if one qualifies
+    """
+    if resolution not in RESOLUTIONS:
+        raise BadRequestException(message="resolution must be one of: " + ", ".join(RESOLUTIONS))
+    if agg not in AGGREGATES:
+        raise BadRequestException(message="agg must be one of: " + ", ".join(AGGREGATES))
+
+    model = rollup_for(resolution, start, stop)
+    if model is not None:
+        return rollup_readings(readings(start, stop, model=model), model, resolution, agg)
+    return aggregate_readings(readings(start, stop), resolution, agg)
+
+
+def readings_to_json(rows, b_id=None):
+    """
+    Encode power query rows with res_to_json, tagging each reading with the requested building ID if given
+    """
+    return [reading_to_json(row, b_id) for row in iterate_rows(rows)]
+
+
+def reading_to_json(row, b_id=None):
+    """
+    Encode a single power query row, see readings_to_json
+    """
+    reading = res_to_json(row)
+    if b_id is not None:
+        reading["b_id"] = b_id
+    return reading
+
+
+def consumption_requested():
+    """
+    True if the request asks for consumption per interval (?consumption=true) rather than meter readings
+    """
+    return request.args.get('consumption', '').lower() in ('1', 'true')
+
+
+def stream_requested():
+    """
+    True if the response will be streamed (?stream=true, Arrow or Parquet), rather than built in memory
+    """
+    return request.args.get('stream', '').lower() in ('1', 'true') or get_response_format() in ('arrow', 'parquet')
+
+
+def get_response_format():
+    """
+    Read the optional 'format' query parameter of the readings endpoints, falling back to the Accept header
+    """
+    response_format = request.args.get('format')
+    if response_format is None:
+        best = request.accept_mimetypes.best_match(['application/json', ARROW_STREAM_MIMETYPE])
+        response_format = 'arrow' if best == ARROW_STREAM_MIMETYPE else 'json'
+    if response_format not in RESPONSE_FORMATS:
+        raise BadRequestException(message="format must be one of: " + ", ".join(RESPONSE_FORMATS))
+    return response_format
+
+
+def readings_etag(readings, start, stop):
+    """
+    Strong ETag and latest reading timestamp of a readings request
+
+    Derived from the row count and latest timestamp of the rows the request reads - one cheap indexed query, cached
+    like the readings themselves - and from everything else in the request that shapes the response. Consumption
+    requests also read the CONSUMPTION_MAX_GAP seconds before `start`, which are fingerprinted with the range.
+    When a rollup table answers the request, its rows and the readings they count are fingerprinted instead of the
+    raw readings, which a refresh has yet to fold in.
+    """
+    model = rollup_requested(start, stop)
+    first = start
+    if consumption_requested():
+        # the first consumption of the window is computed from the readings before it, see query_readings
+        first = start - timedelta(seconds=current_app.config["CONSUMPTION_MAX_GAP"])
+    key = cache_key('fingerprint', readings.func.__name__, model.__tablename__ if model is not None else None,
+                    *(readings.args + (first, stop)))
+    fingerprint = cache.get(key, stop)
+    if fingerprint is None:
+        if model is None:
+            query = readings(first, stop).with_entities(func.count(), func.max(Power.timestamp))
+        else:
+            query = readings(start, stop, model=model).with_entities(
+                func.count(), func.sum(model.value_count), func.max(model.timestamp))
+        fingerprint = tuple(query.order_by(None).one())
+        if fingerprint[0]:
+            # like empty results, the fingerprint of an empty range is not cached
+            cache.set(key, fingerprint, stop)
+    latest = fingerprint[-1]
+    representation = (request.path, sorted(request.args.items(multi=True)), get_response_format(), fingerprint)
+    return hashlib.sha1(repr(representation).encode('utf-8')).hexdigest(), latest
+
+
+def rollup_requested(start, stop):
+    """
+    The rollup table query_readings reads for the current request, or None if it reads raw readings
+    """
+    resolution = request.args.get('resolution')
+    if resolution not in RESOLUTIONS or consumption_requested():
+        return None
+    return rollup_for(resolution, start, stop)
+
+
+def readings_response(readings, start, stop, schema, not_found, b_id=None):
+    """
+    Build the response of a readings endpoint
+
+    With ?stream=true the JSON array is written out incrementally from a server-side cursor instead of being
+    built in memory first, which keeps memory use flat for large time ranges. With ?format=columnar the readings
+    are grouped per sensor into parallel timestamp/value arrays instead, and format=arrow|parquet streams them as
+    Arrow record batches. Paged requests get a 'next' Link header.
+
+    Responses carry an ETag; requests whose If-None-Match matches it are answered with 304 Not Modified before
+    the readings are queried. Windows ending well before the newest stored reading are marked immutable, see api/cache.py.
+
+    :param readings: function of (start, stop, model) building the query, e.g. a partial of queries.building_readings
+    """
+    etag, latest = readings_etag(readings, start, stop)
+    ttl = cache.ttl(stop)
+    cache_control = 'public, max-age=31536000, immutable' if ttl is None else 'public, max-age={0}'.format(ttl)
+    # the compression extension appends the content coding to the ETag of compressed responses, the 304 confirms
+    # the variant the client holds
+    candidates = [etag] + [etag + '-' + encoding for encoding, _, _ in COMPRESSORS]
+    matched = next((candidate for candidate in candidates if request.if_none_match.contains(candidate)), None)
+    if matched is not None:
+        response = Response(status=HTTPStatus.NOT_MODIFIED)
+        response.set_etag(matched)
+        response.headers['Cache-Control'] = cache_control
+        vary_on_format(response)
+        if RESPONSE_MIMETYPES[get_response_format()] in current_app.config['COMPRESS_MIMETYPES']:
+            # as the compression extension does for the full response
+            response.vary.add('Accept-Encoding')
+        return response
+
+    rows = get_readings(readings, start, stop)
+    response_format = get_response_format()
+    next_link = next_page_link(rows) if isinstance(rows, list) else None
+
+    if response_format == 'columnar':
+        delta = request.args.get('delta', '').lower() in ('1', 'true')
+        with serialization_timer():
+            columns = res_to_columns(iterate_rows(rows), b_id, delta)
+            response = columnar_schema.jsonify(columns)
+        if not columns:
+            raise NotFoundException(message=not_found)
+    elif stream_requested():
+        pa = import_pyarrow() if response_format != 'json' else None
+        rows = iterate_rows(rows)
+        first = next(rows, None)
+        if first is None:
+            raise NotFoundException(message=not_found)
+        if response_format == 'arrow':
+            body, mimetype = stream_arrow(pa, first, rows, b_id), ARROW_STREAM_MIMETYPE
+        elif response_format == 'parquet':
+            body, mimetype = stream_parquet(pa, first, rows, b_id), PARQUET_MIMETYPE
+        else:
+            body, mimetype = stream_json_array(first, rows, partial(reading_to_json, b_id=b_id), schema), 'application/json'
+        response = Response(stream_with_context(body), mimetype=mimetype)
+    else:
+        with serialization_timer():
+            readings = readings_to_json(rows, b_id)
+            response = schema.jsonify(readings)
+        if not readings:
+            raise NotFoundException(message=not_found)
+
+    if next_link is not None:
+        response.headers['Link'] = '<{0}>; rel="next"'.format(next_link)
+    response.set_etag(etag)
+    response.last_modified = latest
+    response.headers['Cache-Control'] = cache_control
+    vary_on_format(response)
+    return response
+
+
+def vary_on_format(response):
+    """
+    Tell caches that a readings response depends on the Accept header, unless its format was set with ?format=
+    """
+    if 'format' not in request.args:
+        response.vary.add('Accept')
+
+
+def get_batch(normalize=None):
+    """
+    Read and validate the JSON body of the batch readings endpoints, returning (ids, start, stop, resolution, agg)
+
+    :param normalize: function mapping a requested ID to its canonical form, two IDs of the same form are rejected
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise BadRequestException(message="request body must be a JSON object")
+    ids = body.get('ids')
+    max_ids = current_app.config["BATCH_MAX_IDS"]
+    if not isinstance(ids, list) or not ids or not all(isinstance(id_, str) and id_ for id_ in ids):
+        raise BadRequestException(message="ids must be a non-empty list of IDs")
+    if len(ids) > max_ids:
+        raise BadRequestException(message="at most {0} ids can be requested at once".format(max_ids))
+    if len(set(normalize(id_) if normalize is not None else id_ for id_ in ids)) != len(ids):
+        raise BadRequestException(message="ids must not repeat an ID, e.g. as '26' and '026'")
+    for name in ('start', 'stop', 'resolution', 'agg'):
+        if body.get(name) is not None and not isinstance(body[name], str):
+            raise BadRequestException(message="{0} must be a string".format(name))
+    start, stop = get_time_range(body)
+    resolution = body.get('resolution')
+    agg = body.get('agg', 'mean')
+    if resolution is None and 'agg' in body:
+        raise BadRequestException(message="agg requires a resolution")
+    return ids, start, stop, resolution, agg
+
+
+def normalize_b_id(b_id):
+    """
+    The 3-digit form of a requested building ID, e.g. '26' -> '026'
+    """
+    return b_id.zfill(3)
+
+
+def batch_response(readings, ids, start, stop, resolution, agg, schema, id_of, normalize=None, tag_b_id=False):
+    """
+    Run one query over all requested IDs and respond with their readings grouped by ID
+
+    Every requested ID is present in the response, with an empty list if it has no readings in the range.
+
+    :param readings: function of (start, stop, model) building the query over all IDs
+    :param id_of: function mapping the source_name of a row to the ID it belongs to
+    :param normalize: function mapping a requested ID to the form returned by `id_of`, e.g. '26' -> '026'
+    """
+    rows = readings(start, stop) if resolution is None else resample_readings(readings, start, stop, resolution, agg)
+    groups = dict((id_, []) for id_ in ids)
+    requested = dict((normalize(id_) if normalize is not None else id_, id_) for id_ in ids)
+    with serialization_timer():
+        for row in iterate_rows(rows):
+            id_ = requested.get(id_of(row[3]))
+            if id_ is not None:
+                groups[id_].append(reading_to_json(row, id_ if tag_b_id else None))
+        return flask.jsonify(dict((id_, dump(schema, group)) for id_, group in groups.items()))
+
+
+def live_response(key, schema, b_id=None):
+    """
+    Subscribe to the new readings of a building or sensor and stream them as Server-Sent Events, see api/live.py
+    """
+    try:
+        live_feed.admit()
+    except StreamLimitError as error:
+        raise ServiceUnavailableException(message=str(error))
+    encode = partial(reading_to_json, b_id=b_id)
+    response = Response(live_feed.stream(key, encode, schema), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # stops nginx from buffering the events
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def require_ingest_token():
+    """
+    Check the bearer token of a meter pushing readings against INGEST_TOKENS
+    """
+    tokens = current_app.config['INGEST_TOKENS']
+    if not tokens:
+        raise ForbiddenException(message="push ingestion is not enabled")
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    # compare every token in constant time, so response times do not reveal how much of a token matched
+    if scheme.lower() != 'bearer' or not any([hmac.compare_digest(token.encode('utf-8'), valid.encode('utf-8'))
+                                              for valid in tokens]):
+        raise UnauthorizedException(message="a valid 'Authorization: Bearer <token>' header is required")
+
+
+def get_pushed_readings():
+    """
+    Read and validate the JSON body of the ingest endpoint, returning rows of the power table
+    """
+    body = request.get_json(silent=True)
+    readings = body.get('readings') if isinstance(body, dict) else None
+    max_readings = current_app.config['INGEST_MAX_READINGS']
+    if not isinstance(readings, list) or not readings:
+        raise BadRequestException(message="request body must be an object with a non-empty list of readings")
+    if len(readings) > max_readings:
+        raise BadRequestException(message="at most {0} readings can be pushed at once".format(max_readings))
+    rows = []
+    latest = latest_timestamp()
+    for index, reading in enumerate(readings):
+        try:
+            if not isinstance(reading, dict):
+                raise ValueError('Expected an object')
+            rows.append(parse_reading(reading, latest))
+        except ValueError as error:
+            raise BadRequestException(message="readings[{0}]: {1}".format(index, error))
+    return rows
+
+
+def campus_response(meas_type):
+    """
+    Respond with the campus-wide totals of one measurement type, see queries.campus_totals
+
+    Sensor type codes are derived from the sensor names in Python, once per time range, and handed to the database
+    as a CASE expression so the grouping itself still happens in SQL.
+    """
+    start, stop = get_time_range()
+    resolution = request.args.get('resolution', '15min')
+    group_by = request.args.get('group_by')
+    sensor_types = request.args.get('sensor_type')
+    sensor_types = sensor_types.split(',') if sensor_types else []
+    if resolution not in RESOLUTIONS:
+        raise BadRequestException(message="resolution must be one of: " + ", ".join(RESOLUTIONS))
+    if group_by not in (None, 'sensor_type'):
+        raise BadRequestException(message="group_by must be sensor_type")
+    if not all(code in SENSOR_TYPES for code in sensor_types):
+        raise BadRequestException(message="sensor_type must be a comma separated list of: " + ", ".join(SENSOR_TYPES))
+
+    key = cache_key('campus_sources', meas_type, start, stop)
+    sources = cache.get(key, stop)
+    if sources is None:
+        sources = campus_sources(meas_type, start, stop)
+        cache.set(key, sources, stop)
+    codes = dict((source_name, sensortype_code_mapper(source_name)) for source_name in sources)
+
+    query = campus_readings(meas_type, start, stop)
+    if sensor_types:
+        query = query.filter(Power.source_name.in_([source_name for source_name, code in codes.items()
+                                                    if code in sensor_types]))
+    totals = []
+    for timestamp, row_type, total, code in campus_totals(query, resolution, codes if group_by else None):
+        reading = {"timestamp": timestamp, "units": units_mapper(row_type), "value_read": str(total)}
+        if group_by:
+            reading["sensor_type"] = code
+        totals.append(reading)
+    if not totals:
+        raise NotFoundException(message="No readings found in the requested range")
+    return campus_schema.jsonify(totals)
+
+
+def csv_response(rows, filename, not_found, b_id=None):
+    """
+    Stream readings as a CSV attachment, gzip-compressed on the fly for clients that accept it
+    """
+    rows = iterate_rows(rows)
+    first = next(rows, None)
+    if first is None:
+        raise NotFoundException(message=not_found)
+    compress = 'gzip' in request.accept_encodings
+    response = Response(stream_with_context(stream_csv(first, rows, b_id, compress)), mimetype='text/csv')
+    response.headers['Content-Disposition'] = 'attachment; filename={0}'.format(filename)
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
 # @api.route("/checkuser",methods=['GET'])
 # @login_required
 # def index():
@@ -65,6 +544,8 @@ def getEnergyData(b_id):
         - electricity
     produces:
         - application/json
+        - application/vnd.apache.arrow.stream
+        - application/vnd.apache.parquet
     parameters:
         - name: b_id
           in: path
@@ -84,6 +565,46 @@ def getEnergyData(b_id):
           required: true
           default: "2016-09-03 23:59:59"
           type: string
+        - name: resolution
+          in: query
+          description: "optional bucket width to resample the readings to: 15min, hour or day"
+          required: false
+          type: string
+        - name: agg
+          in: query
+          description: "how each bucket is reduced when resolution is given: mean (default), min, max, sum or last"
+          required: false
+          type: string
+        - name: stream
+          in: query
+          description: "set to true to stream the response incrementally, recommended for long time ranges"
+          required: false
+          type: boolean
+        - name: limit
+          in: query
+          description: "optional page size; the next page is linked from the response's Link header (rel=next)"
+          required: false
+          type: integer
+        - name: cursor
+          in: query
+          description: opaque position of the next page, taken from the Link header of the previous page
+          required: false
+          type: string
+        - name: format
+          in: query
+          description: "json (default), columnar for one entry per sensor with parallel 'timestamps' (UNIX epoch seconds) and 'values' arrays, arrow for an Arrow IPC stream (also chosen by Accept: application/vnd.apache.arrow.stream) or parquet"
+          required: false
+          type: string
+        - name: delta
+          in: query
+          description: with format=columnar, set to true to send each timestamp after the first as the difference to the previous one
+          required: false
+          type: boolean
+        - name: consumption
+          in: query
+          description: set to true to return the energy consumed between consecutive readings instead of the cumulative meter values, summed per bucket with resolution. Counter resets are handled, gaps longer than CONSUMPTION_MAX_GAP are skipped
+          required: false
+          type: boolean
     responses:
         200:
             description: An array of building information
@@ -112,18 +633,14 @@ def getEnergyData(b_id):
                       value_read:
                         type: string
                         description: Value that the sensor reported
+        304:
+            description: Readings unchanged since the response whose ETag was sent in If-None-Match
         400:
             description: Building ID not valid, or date range not present in the database
     """
-    start = request.form['start']
-    stop = request.form['stop']
-    if not start or not stop:
-        raise BadRequestException(message="start and stop parameters required, you cannot query the whole database")
-    power = Power.query.filter(Power.source_name.like('%B' + b_id.zfill(3) + '%'), Power.timestamp >= start, Power.timestamp <= stop).filter_by(type='Active Energy Delivered').order_by(Power.timestamp.desc())
-    if power:
-        power_energy_schema.jsonify(power)
-    else:
-        raise NotFoundException()
+    start, stop = get_time_range()
+    energy = partial(building_readings, b_id.zfill(3), ENERGY_TYPE)
+    return readings_response(energy, start, stop, power_energy_schema, "Building ID not found in the database", b_id)
 
 @api.route("/facilities/power/<b_id>/", methods=['GET'])
 def getPowerData(b_id):
@@ -135,6 +652,8 @@ def getPowerData(b_id):
                 - electricity
             produces:
                 - application/json
+                - application/vnd.apache.arrow.stream
+                - application/vnd.apache.parquet
             parameters:
                 - name: b_id
                   in: path
@@ -154,6 +673,41 @@ def getPowerData(b_id):
                   required: true
                   default: "2016-09-03 23:59:59"
                   type: string
+                - name: resolution
+                  in: query
+                  description: "optional bucket width to resample the readings to: 15min, hour or day"
+                  required: false
+                  type: string
+                - name: agg
+                  in: query
+                  description: "how each bucket is reduced when resolution is given: mean (default), min, max, sum or last"
+                  required: false
+                  type: string
+                - name: stream
+                  in: query
+                  description: "set to true to stream the response incrementally, recommended for long time ranges"
+                  required: false
+                  type: boolean
+                - name: limit
+                  in: query
+                  description: "optional page size; the next page is linked from the response's Link header (rel=next)"
+                  required: false
+                  type: integer
+                - name: cursor
+                  in: query
+                  description: opaque position of the next page, taken from the Link header of the previous page
+                  required: false
+                  type: string
+                - name: format
+                  in: query
+                  description: "json (default), columnar for one entry per sensor with parallel 'timestamps' (UNIX epoch seconds) and 'values' arrays, arrow for an Arrow IPC stream (also chosen by Accept: application/vnd.apache.arrow.stream) or parquet"
+                  required: false
+                  type: string
+                - name: delta
+                  in: query
+                  description: with format=columnar, set to true to send each timestamp after the first as the difference to the previous one
+                  required: false
+                  type: boolean
             responses:
                 200:
                     description: An array of building information
@@ -182,20 +736,19 @@ def getPowerData(b_id):
                               value_read:
                                 type: string
                                 description: Value that the sensor reported
+                304:
+                    description: Readings unchanged since the response whose ETag was sent in If-None-Match
                 400:
-                    description: Start and stop parameters required
+                    description: Start and stop parameters required, or consumption requested
                 404:
                     description: Building ID not found
             """
-    start = request.form['start']
-    stop = request.form['stop']
-    if not start or not stop:
-        raise BadRequestException(message="start and stop parameters required, you cannot query the whole database")
-    power = Power.query.filter(Power.source_name.like('%B' + b_id.zfill(3) + '%'), Power.timestamp >= start, Power.timestamp <= stop).filter_by(type='Active Power').order_by(Power.timestamp.desc())
-    if power:
-        power_energy_schema.jsonify(power)
-    else:
-        raise NotFoundException()
+    if consumption_requested():
+        raise BadRequestException(message="consumption only applies to energy and sensor readings, "
+                                          "see /facilities/energy/<b_id>/")
+    start, stop = get_time_range()
+    power = partial(building_readings, b_id.zfill(3), POWER_TYPE)
+    return readings_response(power, start, stop, power_energy_schema, "Building ID not found in the database", b_id)
 
 @api.route("/facilities/sensor/<sensor_id>/", methods=['GET'])
 def getSensorData(sensor_id):
@@ -207,6 +760,8 @@ def getSensorData(sensor_id):
             - raw sensor
         produces:
             - application/json
+            - application/vnd.apache.arrow.stream
+            - application/vnd.apache.parquet
         parameters:
             - name: sensor_id
               in: path
@@ -226,6 +781,46 @@ def getSensorData(sensor_id):
               required: true
               default: "2016-09-03 23:59:59"
               type: string
+            - name: resolution
+              in: query
+              description: "optional bucket width to resample the readings to: 15min, hour or day"
+              required: false
+              type: string
+            - name: agg
+              in: query
+              description: "how each bucket is reduced when resolution is given: mean (default), min, max, sum or last"
+              required: false
+              type: string
+            - name: stream
+              in: query
+              description: "set to true to stream the response incrementally, recommended for long time ranges"
+              required: false
+              type: boolean
+            - name: limit
+              in: query
+              description: "optional page size; the next page is linked from the response's Link header (rel=next)"
+              required: false
+              type: integer
+            - name: cursor
+              in: query
+              description: opaque position of the next page, taken from the Link header of the previous page
+              required: false
+              type: string
+            - name: format
+              in: query
+              description: "json (default), columnar for one entry per sensor with parallel 'timestamps' (UNIX epoch seconds) and 'values' arrays, arrow for an Arrow IPC stream (also chosen by Accept: application/vnd.apache.arrow.stream) or parquet"
+              required: false
+              type: string
+            - name: delta
+              in: query
+              description: with format=columnar, set to true to send each timestamp after the first as the difference to the previous one
+              required: false
+              type: boolean
+            - name: consumption
+              in: query
+              description: set to true to return the energy consumed between consecutive readings instead of the cumulative meter values, summed per bucket with resolution. Counter resets are handled, gaps longer than CONSUMPTION_MAX_GAP are skipped
+              required: false
+              type: boolean
         responses:
             200:
                 description: An array of building information
@@ -250,70 +845,648 @@ def getSensorData(sensor_id):
                           value_read:
                             type: string
                             description: Value that the sensor reported
+            304:
+                description: Readings unchanged since the response whose ETag was sent in If-None-Match
             400:
                 description: Start and stop parameters required
             404:
                 description: Sensor ID not found
         """
-    start = request.form['start']
-    stop = request.form['stop']
-    if not start or not stop:
-        raise BadRequestException(message="start and stop parameters required, you cannot query the whole database")
-    sensor = Power.query.filter(Power.timestamp >= start, Power.timestamp <= stop).filter_by(source_name=(sensor_id + '\r')).order_by(Power.timestamp.asc())
-    if sensor:
-        sensor_schema.jsonify(sensor)
-    else:
-        raise NotFoundException()
+    start, stop = get_time_range()
+    sensor = partial(sensor_readings, sensor_id)
+    return readings_response(sensor, start, stop, sensor_schema, "Sensor ID not found in the database")
 
-    # @login_required
-    @api.route("/facilities/sensor_metadata/<sensor_id>/", methods=['GET'])
-    def getSensorMetadata(sensor_id):
-        """
-            Returns list of all sensor readings, given a particular sensor name
-            With specified start and stop dates, retrieve list of readings of the specified sensor, with meter name, meter type, timestamp and value units.
-            ---
-            tags:
-                - metadata
-            produces:
-                - application/json
-            parameters:
-                - name: sensor_id
-                  in: path
-                  description: building ID you need data from
-                  required: true
-                  default: "B003E_MH1"
-                  type: string
-            responses:
-                200:
-                    description: An array of building information
-                    schema:
-                        type: array
-                        items:
-                            type: object
-                            properties:
-                              sensor_id:
-                                type: string
-                                description: ID of the sensor
-                                required: true
-                              sensor_type:
-                                type: string
-                                description: Type of sensor
-                              site:
-                                type: string
-                                description: Location of the sensor
-                              protocol:
+
+@api.route("/facilities/energy/<b_id>/live", methods=['GET'])
+def getEnergyDataLive(b_id):
+    """
+    Streams new energy readings of a building as they are stored
+    Server-Sent Events stream of the energy readings of a building stored after subscribing, as 'readings' events whose data is a JSON array of readings. Use instead of polling the readings endpoint: the stream is closed after LIVE_MAX_DURATION seconds and EventSource clients reconnect by themselves.
+    ---
+    tags:
+        - electricity
+    produces:
+        - text/event-stream
+    parameters:
+        - name: b_id
+          in: path
+          type: string
+          required: true
+          description: ID of the building
+          example: "026"
+    responses:
+        200:
+            description: Stream of 'readings' events, with keepalive comments every LIVE_HEARTBEAT seconds
+        503:
+            description: The worker cannot hold another stream, LIVE_MAX_STREAMS are open or it is not a gevent worker
+    """
+    return live_response(('building', b_id.zfill(3), ENERGY_TYPE), power_energy_schema, b_id=b_id)
+
+
+@api.route("/facilities/power/<b_id>/live", methods=['GET'])
+def getPowerDataLive(b_id):
+    """
+    Streams new power readings of a building as they are stored
+    Server-Sent Events stream of the power readings of a building stored after subscribing, as 'readings' events whose data is a JSON array of readings. Use instead of polling the readings endpoint: the stream is closed after LIVE_MAX_DURATION seconds and EventSource clients reconnect by themselves.
+    ---
+    tags:
+        - electricity
+    produces:
+        - text/event-stream
+    parameters:
+        - name: b_id
+          in: path
+          type: string
+          required: true
+          description: ID of the building
+          example: "026"
+    responses:
+        200:
+            description: Stream of 'readings' events, with keepalive comments every LIVE_HEARTBEAT seconds
+        503:
+            description: The worker cannot hold another stream, LIVE_MAX_STREAMS are open or it is not a gevent worker
+    """
+    return live_response(('building', b_id.zfill(3), POWER_TYPE), power_energy_schema, b_id=b_id)
+
+
+@api.route("/facilities/sensor/<sensor_id>/live", methods=['GET'])
+def getSensorDataLive(sensor_id):
+    """
+    Streams new readings of a sensor as they are stored
+    Server-Sent Events stream of the readings of a sensor stored after subscribing, as 'readings' events whose data is a JSON array of readings. Use instead of polling the readings endpoint: the stream is closed after LIVE_MAX_DURATION seconds and EventSource clients reconnect by themselves.
+    ---
+    tags:
+        - raw sensor
+    produces:
+        - text/event-stream
+    parameters:
+        - name: sensor_id
+          in: path
+          type: string
+          required: true
+          description: ID of the sensor
+          example: "GTECH.B026E_MS2"
+    responses:
+        200:
+            description: Stream of 'readings' events, with keepalive comments every LIVE_HEARTBEAT seconds
+        503:
+            description: The worker cannot hold another stream, LIVE_MAX_STREAMS are open or it is not a gevent worker
+    """
+    return live_response(('sensor', sensor_id), sensor_schema)
+
+
+@api.route("/facilities/power/<b_id>/latest", methods=['GET'])
+def getPowerDataLatest(b_id):
+    """
+    Returns the latest power reading of every sensor in a building
+    What the building is drawing right now: no time range is needed, the readings are served from memory without querying the database.
+    ---
+    tags:
+        - electricity
+    produces:
+        - application/json
+    parameters:
+        - name: b_id
+          in: path
+          type: string
+          required: true
+          description: ID of the building
+          example: "026"
+    responses:
+        200:
+            description: The latest power reading of every sensor in the building, ordered by sensor name
+        404:
+            description: No recent power readings for this building
+    """
+    rows = latest.building(b_id.zfill(3), POWER_TYPE)
+    if not rows:
+        raise NotFoundException(message="No recent power readings for this building")
+    with serialization_timer():
+        return flask.jsonify(dump(power_energy_schema, [reading_to_json(row, b_id) for row in rows]))
+
+
+@api.route("/facilities/latest", methods=['GET'])
+def getCampusDataLatest():
+    """
+    Returns the latest reading of every sensor on campus
+    Served from memory without querying the database. Sensors without a reading in the last LATEST_MAX_AGE seconds are left out.
+    ---
+    tags:
+        - electricity
+    produces:
+        - application/json
+    responses:
+        200:
+            description: The latest reading of every sensor and measurement type, tagged with their building ID and ordered by sensor name
+    """
+    with serialization_timer():
+        return flask.jsonify(dump(power_energy_schema, [reading_to_json(row, building_id_mapper(row[3]))
+                                                        for row in latest.campus()]))
+
+
+@api.route("/facilities/energy/batch", methods=['POST'])
+def getEnergyDataBatch():
+    """
+    Returns energy readings for several buildings at once
+    With one start and stop date for all buildings, retrieve the energy readings of every requested building in a single query, grouped by building ID.
+    ---
+    tags:
+        - electricity
+    consumes:
+        - application/json
+    produces:
+        - application/json
+    parameters:
+        - name: body
+          in: body
+          required: true
+          schema:
+            type: object
+            required:
+                - ids
+                - start
+                - stop
+            properties:
+                ids:
+                    type: array
+                    items:
+                        type: string
+                    description: building IDs you need data from, at most BATCH_MAX_IDS
+                    example: ["026", "027"]
+                start:
+                    type: string
+                    description: start date and time, formatted as 'YYYY-MM-DD HH:MM:SS'
+                    example: "2016-09-01 00:00:00"
+                stop:
+                    type: string
+                    description: end date and time, formatted as 'YYYY-MM-DD HH:MM:SS'
+                    example: "2016-09-02 00:00:00"
+                resolution:
+                    type: string
+                    enum: ["15min", "hour", "day"]
+                    description: optional bucket width to resample the readings to, per sensor
+                agg:
+                    type: string
+                    enum: ["mean", "min", "max", "sum", "last"]
+                    description: how readings in a bucket are combined, requires resolution (defaults to mean)
+    responses:
+        200:
+            description: Object mapping every requested building ID to its list of readings, empty if there are none
+        400:
+            description: Malformed request body, too many IDs, or invalid parameters
+    """
+    b_ids, start, stop, resolution, agg = get_batch(normalize_b_id)
+    energy = partial(buildings_readings, tuple(b_ids), ENERGY_TYPE)
+    return batch_response(energy, b_ids, start, stop, resolution, agg, power_energy_schema,
+                          building_id_mapper, normalize=normalize_b_id, tag_b_id=True)
+
+
+@api.route("/facilities/power/batch", methods=['POST'])
+def getPowerDataBatch():
+    """
+    Returns power readings for several buildings at once
+    With one start and stop date for all buildings, retrieve the power readings of every requested building in a single query, grouped by building ID.
+    ---
+    tags:
+        - electricity
+    consumes:
+        - application/json
+    produces:
+        - application/json
+    parameters:
+        - name: body
+          in: body
+          required: true
+          schema:
+            type: object
+            required:
+                - ids
+                - start
+                - stop
+            properties:
+                ids:
+                    type: array
+                    items:
+                        type: string
+                    description: building IDs you need data from, at most BATCH_MAX_IDS
+                    example: ["026", "027"]
+                start:
+                    type: string
+                    description: start date and time, formatted as 'YYYY-MM-DD HH:MM:SS'
+                    example: "2016-09-01 00:00:00"
+                stop:
+                    type: string
+                    description: end date and time, formatted as 'YYYY-MM-DD HH:MM:SS'
+                    example: "2016-09-02 00:00:00"
+                resolution:
+                    type: string
+                    enum: ["15min", "hour", "day"]
+                    description: optional bucket width to resample the readings to, per sensor
+                agg:
+                    type: string
+                    enum: ["mean", "min", "max", "sum", "last"]
+                    description: how readings in a bucket are combined, requires resolution (defaults to mean)
+    responses:
+        200:
+            description: Object mapping every requested building ID to its list of readings, empty if there are none
+        400:
+            description: Malformed request body, too many IDs, or invalid parameters
+    """
+    b_ids, start, stop, resolution, agg = get_batch(normalize_b_id)
+    power = partial(buildings_readings, tuple(b_ids), POWER_TYPE)
+    return batch_response(power, b_ids, start, stop, resolution, agg, power_energy_schema,
+                          building_id_mapper, normalize=normalize_b_id, tag_b_id=True)
+
+
+@api.route("/facilities/sensor/batch", methods=['POST'])
+def getSensorDataBatch():
+    """
+    Returns readings for several sensors at once
+    With one start and stop date for all sensors, retrieve the readings of every requested sensor in a single query, grouped by sensor ID.
+    ---
+    tags:
+        - raw sensor
+    consumes:
+        - application/json
+    produces:
+        - application/json
+    parameters:
+        - name: body
+          in: body
+          required: true
+          schema:
+            type: object
+            required:
+                - ids
+                - start
+                - stop
+            properties:
+                ids:
+                    type: array
+                    items:
+                        type: string
+                    description: sensor IDs you need data from, at most BATCH_MAX_IDS
+                    example: ["GTECH.B026E_MS2", "GTECH.B026E_MH1"]
+                start:
+                    type: string
+                    description: start date and time, formatted as 'YYYY-MM-DD HH:MM:SS'
+                    example: "2016-09-01 00:00:00"
+                stop:
+                    type: string
+                    description: end date and time, formatted as 'YYYY-MM-DD HH:MM:SS'
+                    example: "2016-09-02 00:00:00"
+                resolution:
+                    type: string
+                    enum: ["15min", "hour", "day"]
+                    description: optional bucket width to resample the readings to
+                agg:
+                    type: string
+                    enum: ["mean", "min", "max", "sum", "last"]
+                    description: how readings in a bucket are combined, requires resolution (defaults to mean)
+    responses:
+        200:
+            description: Object mapping every requested sensor ID to its list of readings, empty if there are none
+        400:
+            description: Malformed request body, too many IDs, or invalid parameters
+    """
+    sensor_ids, start, stop, resolution, agg = get_batch()
+    sensors = partial(sensors_readings, tuple(sensor_ids))
+    return batch_response(sensors, sensor_ids, start, stop, resolution, agg, sensor_schema,
+                          lambda source_name: source_mapper(source_name)[0])
+
+
+@api.route("/facilities/campus/energy/", methods=['GET'])
+def getCampusEnergyData():
+    """
+    Returns the total energy across campus per time bucket
+    With specified start and stop dates, retrieve the sum of all energy sensor readings on campus, optionally restricted to or grouped by sensor type. Readings are summed per timestamp and averaged within each bucket.
+    ---
+    tags:
+        - electricity
+    produces:
+        - application/json
+    parameters:
+        - name: start
+          in: query
+          description: start date and time, formatted as 'YYYY-MM-DD HH:MM:SS'
+          required: true
+          default: "2016-09-01 00:00:00"
+        - name: stop
+          in: query
+          description: end date and time, formatted as 'YYYY-MM-DD HH:MM:SS'
+          required: true
+          default: "2016-09-02 00:00:00"
+        - name: resolution
+          in: query
+          description: bucket width to total the readings over
+          required: false
+          default: "15min"
+          enum: ["15min", "hour", "day"]
+        - name: sensor_type
+          in: query
+          description: comma separated sensor type codes to include, e.g. EMS to count mains transformers only and avoid double counting sub-meters
+          required: false
+        - name: group_by
+          in: query
+          description: set to sensor_type to return one total per sensor type code and bucket
+          required: false
+          enum: ["sensor_type"]
+    responses:
+        200:
+            description: Campus-wide total per bucket
+            schema:
+                type: array
+                items:
+                    type: object
+                    properties:
+                      timestamp:
+                        type: string
+                        description: Start of the bucket
+                      sensor_type:
+                        type: string
+                        description: Sensor type code (EMS, EMH, EML, EUH or EUL), only present with group_by=sensor_type
+                      units:
+                        type: string
+                        description: Units of the total
+                      value_read:
+                        type: string
+                        description: Total of the readings
+        400:
+            description: Start and stop parameters required, or invalid parameters
+        404:
+            description: No readings in the requested range
+    """
+    return campus_response(ENERGY_TYPE)
+
+
+@api.route("/facilities/campus/power/", methods=['GET'])
+def getCampusPowerData():
+    """
+    Returns the total power across campus per time bucket
+    With specified start and stop dates, retrieve the sum of all power sensor readings on campus, optionally restricted to or grouped by sensor type. Readings are summed per timestamp and averaged within each bucket.
+    ---
+    tags:
+        - electricity
+    produces:
+        - application/json
+    parameters:
+        - name: start
+          in: query
+          description: start date and time, formatted as 'YYYY-MM-DD HH:MM:SS'
+          required: true
+          default: "2016-09-01 00:00:00"
+        - name: stop
+          in: query
+          description: end date and time, formatted as 'YYYY-MM-DD HH:MM:SS'
+          required: true
+          default: "2016-09-02 00:00:00"
+        - name: resolution
+          in: query
+          description: bucket width to total the readings over
+          required: false
+          default: "15min"
+          enum: ["15min", "hour", "day"]
+        - name: sensor_type
+          in: query
+          description: comma separated sensor type codes to include, e.g. EMS to count mains transformers only and avoid double counting sub-meters
+          required: false
+        - name: group_by
+          in: query
+          description: set to sensor_type to return one total per sensor type code and bucket
+          required: false
+          enum: ["sensor_type"]
+    responses:
+        200:
+            description: Campus-wide total per bucket
+            schema:
+                type: array
+                items:
+                    type: object
+                    properties:
+                      timestamp:
+                        type: string
+                        description: Start of the bucket
+                      sensor_type:
+                        type: string
+                        description: Sensor type code (EMS, EMH, EML, EUH or EUL), only present with group_by=sensor_type
+                      units:
+                        type: string
+                        description: Units of the total
+                      value_read:
+                        type: string
+                        description: Total of the readings
+        400:
+            description: Start and stop parameters required, or invalid parameters
+        404:
+            description: No readings in the requested range
+    """
+    return campus_response(POWER_TYPE)
+
+
+@api.route("/facilities/readings", methods=['POST'])
+def pushReadings():
+    """
+    Push new readings
+    Meters post the readings they have just taken, which are queued and written to the database in batches within INGEST_FLUSH_INTERVAL seconds. Requires a bearer token from INGEST_TOKENS. Readings already stored are ignored, so a push can safely be retried.
+    ---
+    tags:
+        - ingest
+    consumes:
+        - application/json
+    produces:
+        - application/json
+    parameters:
+        - name: Authorization
+          in: header
+          type: string
+          required: true
+          description: "'Bearer <token>'"
+        - name: body
+          in: body
+          required: true
+          schema:
+            type: object
+            required:
+                - readings
+            properties:
+                readings:
+                    type: array
+                    description: at most INGEST_MAX_READINGS readings
+                    items:
+                        type: object
+                        required:
+                            - timestamp
+                            - type
+                            - value_read
+                            - source_name
+                        properties:
+                            timestamp:
                                 type: string
-                                description: Protocol that the sensor is using
-                              description:
+                                example: "2016-09-01 00:15:00"
+                            type:
                                 type: string
-                                description: Any additional description of the sensor
-                              cluster:
+                                example: "Active Power"
+                            value_read:
+                                type: number
+                                example: 101.5
+                            source_name:
                                 type: string
-                                description: Cluster that the sensor belongs to, if any
-                404:
-                    description: Sensor ID not found
-            """
-        metadata = Sensors.query.filter_by(sensor_id=sensor_id).first()
-        if not metadata:
-            raise NotFoundException()
-        return sensor_metadata_schema.jsonify(metadata)
+                                example: "GTECH.B026E_MS2"
+    responses:
+        202:
+            description: The readings were queued for writing
+        400:
+            description: Malformed request body or reading, e.g. of an unknown type or dated more than INGEST_MAX_FUTURE seconds ahead; none of the readings were queued
+        401:
+            description: Missing or invalid token
+        403:
+            description: Push ingestion is not enabled
+        429:
+            description: The write queue is full, retry after the number of seconds in the Retry-After header
+    """
+    require_ingest_token()
+    rows = get_pushed_readings()
+    try:
+        push_queue.put(rows)
+    except QueueFullError:
+        raise TooManyRequestsException(message="too many readings are waiting to be written, retry shortly",
+                                       retry_after=max(1, int(current_app.config['INGEST_FLUSH_INTERVAL'] or 1)))
+    return flask.jsonify(dict(accepted=len(rows), queued=push_queue.pending)), HTTPStatus.ACCEPTED
+
+
+@api.route("/facilities/export/<b_id>.csv", methods=['GET'])
+def exportBuildingData(b_id):
+    """
+    Exports all readings of a building as CSV
+    With specified start and stop dates, stream all energy and power sensor readings at that building as a CSV file, gzip-compressed if the client accepts it.
+    ---
+    tags:
+        - export
+    produces:
+        - text/csv
+    parameters:
+        - name: b_id
+          in: path
+          description: building ID you need data from
+          required: true
+          default: 26
+          type: string
+        - name: start
+          in: query
+          description: start timestamp of the readings
+          required: true
+          default: "2016-09-01 00:00:00"
+          type: string
+        - name: stop
+          in: query
+          description: end timestamp of the readings
+          required: true
+          default: "2016-09-03 23:59:59"
+          type: string
+    responses:
+        200:
+            description: "CSV file with columns b_id, source_name, source_type, timestamp, units, value_read"
+        400:
+            description: Start and stop parameters required
+        404:
+            description: Building ID not found
+    """
+    start, stop = get_time_range()
+    readings = building_export(b_id, start, stop)
+    return csv_response(readings, "B{0}.csv".format(b_id.zfill(3)), "Building ID not found in the database", b_id)
+
+
+@api.route("/facilities/export/sensor/<sensor_id>.csv", methods=['GET'])
+def exportSensorData(sensor_id):
+    """
+    Exports all readings of a sensor as CSV
+    With specified start and stop dates, stream all readings of the specified sensor as a CSV file, gzip-compressed if the client accepts it.
+    ---
+    tags:
+        - export
+    produces:
+        - text/csv
+    parameters:
+        - name: sensor_id
+          in: path
+          description: sensor ID you need data from
+          required: true
+          default: "GTECH.B026E_MH1"
+          type: string
+        - name: start
+          in: query
+          description: start timestamp of the readings
+          required: true
+          default: "2016-09-01 00:00:00"
+          type: string
+        - name: stop
+          in: query
+          description: end timestamp of the readings
+          required: true
+          default: "2016-09-03 23:59:59"
+          type: string
+    responses:
+        200:
+            description: "CSV file with columns source_name, source_type, timestamp, units, value_read"
+        400:
+            description: Start and stop parameters required
+        404:
+            description: Sensor ID not found
+    """
+    start, stop = get_time_range()
+    readings = sensor_readings(sensor_id, start, stop)
+    return csv_response(readings, "{0}.csv".format(sensor_id), "Sensor ID not found in the database")
+
+
+# @login_required
+@api.route("/facilities/sensor_metadata/<sensor_id>/", methods=['GET'])
+def getSensorMetadata(sensor_id):
+    """
+        Returns list of all sensor readings, given a particular sensor name
+        With specified start and stop dates, retrieve list of readings of the specified sensor, with meter name, meter type, timestamp and value units.
+        ---
+        tags:
+            - metadata
+        produces:
+            - application/json
+        parameters:
+            - name: sensor_id
+              in: path
+              description: building ID you need data from
+              required: true
+              default: "B003E_MH1"
+              type: string
+        responses:
+            200:
+                description: An array of building information
+                schema:
+                    type: array
+                    items:
+                        type: object
+                        properties:
+                          sensor_id:
+                            type: string
+                            description: ID of the sensor
+                            required: true
+                          sensor_type:
+                            type: string
+                            description: Type of sensor
+                          site:
+                            type: string
+                            description: Location of the sensor
+                          protocol:
+                            type: string
+                            description: Protocol that the sensor is using
+                          description:
+                            type: string
+                            description: Any additional description of the sensor
+                          cluster:
+                            type: string
+                            description: Cluster that the sensor belongs to, if any
+            404:
+                description: Sensor ID not found
+        """
+    metadata = Sensors.query.filter_by(sensor_id=sensor_id).first()
+    if not metadata:
+        raise NotFoundException()
+    return sensor_metadata_schema.jsonify(metadata)
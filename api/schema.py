@@ -26,6 +26,24 @@ class SensorReadingSchema(ma.Schema):
         fields = ('source_name', 'source_type', 'timestamp', 'units', 'value_read')
 
 
+class ReadingColumnsSchema(ma.Schema):
+    """
+    JSON schema for the readings of one sensor in the columnar format
+    """
+    class Meta:
+        # JSON fields - type will be inferred
+        fields = ('b_id', 'source_name', 'source_type', 'units', 'timestamps', 'values')
+
+
+class CampusTotalSchema(ma.Schema):
+    """
+    JSON schema for the campus-wide total of one time bucket, optionally of one sensor type
+    """
+    class Meta:
+        # JSON fields - type will be inferred
+        fields = ('timestamp', 'sensor_type', 'units', 'value_read')
+
+
 class SensorMetadataSchema(ma.Schema):
     """
     JSON schema for a building
@@ -37,4 +55,6 @@ class SensorMetadataSchema(ma.Schema):
 
 power_energy_schema = PowerOrAndEnergySchema(many=True)
 sensor_schema = SensorReadingSchema(many=True)
+columnar_schema = ReadingColumnsSchema(many=True)
+campus_schema = CampusTotalSchema(many=True)
 sensor_metadata_schema = SensorMetadataSchema()
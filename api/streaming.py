@@ -0,0 +1,51 @@
+"""
+Incremental JSON encoding of large readings responses.
+
+Rows are pulled from the database through a server-side cursor and written out in batches,
+so memory use per request is bounded by the batch size rather than the requested time range.
+"""
+from flask import json
+from sqlalchemy.orm import Query
+
+from api.timing import count_rows
+
+STREAM_BATCH_SIZE = 1000
+
+
+def iterate_rows(rows, batch_size=STREAM_BATCH_SIZE):
+    """
+    Iterate a readings query through a server-side cursor; lists (e.g. from queries.aggregate_rows) pass through
+
+    Rows are counted in the request timing, see api/timing.py
+    """
+    if isinstance(rows, Query):
+        rows = rows.execution_options(stream_results=True).yield_per(batch_size)
+    return count_rows(rows)
+
+
+def dump(schema, items):
+    """
+    Serialize `items` with a marshmallow schema, across marshmallow 2 (which returns a MarshalResult) and 3
+    """
+    result = schema.dump(items)
+    return getattr(result, 'data', result)
+
+
+def stream_json_array(first, rows, encode, schema, batch_size=STREAM_BATCH_SIZE):
+    """
+    Generate a JSON array of encode(row), serialized with `schema`, one batch of rows at a time
+
+    :param first: the first row, already read from `rows` by the caller to check the result is not empty
+    """
+    yield '['
+    separator = ''
+    batch = [encode(first)]
+    for row in rows:
+        batch.append(encode(row))
+        if len(batch) >= batch_size:
+            yield separator + json.dumps(dump(schema, batch))[1:-1]
+            separator = ','
+            batch = []
+    if batch:
+        yield separator + json.dumps(dump(schema, batch))[1:-1]
+    yield ']'
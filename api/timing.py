@@ -0,0 +1,159 @@
+"""
+Per-request timing of database statements and serialization, and a slow query log.
+
+Every request gets a RequestTiming accumulating the time spent executing database statements (measured by
+before/after_cursor_execute events) and encoding the response, and the rows it fetched. The breakdown is sent in a
+Server-Timing header and exported by api/metrics.py. Statements slower than SLOW_QUERY_THRESHOLD seconds are logged
+with their parameters and query plan.
+
+Configure with SERVER_TIMING_ENABLED and SLOW_QUERY_* settings, see api/config.py
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# key of the RequestTiming in the WSGI environ, which unlike flask.g is shared with streamed response bodies
+ENVIRON_KEY = 'gtpower.timing'
+
+# statement prefix returning the query plan, per dialect
+EXPLAIN_PREFIXES = {
+    'mysql': 'EXPLAIN ',
+    'sqlite': 'EXPLAIN QUERY PLAN '
+}
+
+
+class RequestTiming(object):
+    """
+    Measurements of the request being served
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.serialization_seconds = 0.0
+
+
+def current_timing():
+    """
+    RequestTiming of the current request, or None outside of a request
+    """
+    if not has_request_context():
+        return None
+    return request.environ.get(ENVIRON_KEY)
+
+
+def count_rows(rows):
+    """
+    Iterate `rows`, counting them as fetched by the current request
+    """
+    timing = current_timing()
+    if timing is None:
+        return iter(rows)
+    return counted_rows(rows, timing)
+
+
+def counted_rows(rows, timing):
+    for row in rows:
+        timing.rows += 1
+        yield row
+
+
+@contextmanager
+def serialization_timer():
+    """
+    Count the time spent in the block as serialization time of the current request, minus any database time
+    """
+    timing = current_timing()
+    started = time.time()
+    db_seconds = timing.db_seconds if timing is not None else 0.0
+    yield
+    if timing is not None:
+        timing.serialization_seconds += time.time() - started - (timing.db_seconds - db_seconds)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('timing_started', []).append(time.time())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.time() - conn.info['timing_started'].pop()
+    timing = current_timing()
+    if timing is not None:
+        timing.db_seconds += elapsed
+    if has_app_context():
+        threshold = current_app.config['SLOW_QUERY_THRESHOLD']
+        if threshold is not None and elapsed > threshold:
+            log_slow_query(conn, statement, parameters, elapsed, executemany)
+
+
+def log_slow_query(conn, statement, parameters, elapsed, executemany):
+    """
+    Log a slow statement with its parameters and, for single SELECTs, the query plan
+    """
+    plan = None
+    prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+    if (current_app.config['SLOW_QUERY_EXPLAIN'] and prefix is not None and not executemany
+            and statement.lstrip().upper().startswith('SELECT')):
+        plan = explain(conn, prefix + statement, parameters)
+    logger.warning("Slow query (%.3fs): %s\nParameters: %r\nPlan: %s", elapsed, statement, parameters, plan)
+
+
+def explain(conn, statement, parameters):
+    """
+    Run an EXPLAIN statement on a separate pooled connection, as `conn` may still be streaming results
+
+    Goes through the DBAPI directly, so it does not trigger the cursor events again.
+    """
+    try:
+        raw = conn.engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            cursor.execute(statement, parameters)
+            return cursor.fetchall()
+        finally:
+            raw.close()
+    except Exception:
+        logger.exception("Could not explain slow query")
+        return None
+
+
+class Timing(object):
+    """
+    Flask extension timing requests and adding their Server-Timing header
+    """
+
+    def __init__(self, app=None):
+        self.events_registered = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SERVER_TIMING_ENABLED', True)
+        app.config.setdefault('SLOW_QUERY_THRESHOLD', None)
+        app.config.setdefault('SLOW_QUERY_EXPLAIN', True)
+        if not self.events_registered:
+            # engine events are process-wide, register them once
+            event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+            self.events_registered = True
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def before_request(self):
+        request.environ[ENVIRON_KEY] = RequestTiming()
+
+    def after_request(self, response):
+        timing = request.environ.get(ENVIRON_KEY)
+        if timing is None or not current_app.config['SERVER_TIMING_ENABLED']:
+            return response
+        # streamed bodies are produced after this, so only the work done before the first byte is included
+        response.headers['Server-Timing'] = 'db;dur={0:.1f}, serialize;dur={1:.1f}, total;dur={2:.1f}'.format(
+            timing.db_seconds * 1000, timing.serialization_seconds * 1000, (time.time() - timing.started) * 1000)
+        return response
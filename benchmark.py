@@ -0,0 +1,285 @@
+"""
+Benchmarks of the readings endpoints against a local SQLite copy of sample.db
+
+    python benchmark.py seed --scale 400     # sample.db repeated 400 times along the time axis, ~10M rows
+    python benchmark.py run                  # Flask test client, then a concurrent HTTP load generator
+    python benchmark.py compare old.json new.json
+
+Each scenario reports p50/p95/p99 latency and throughput, and the run its peak RSS. Results are written as JSON to
+benchmark_results/<commit>.json for comparison between commits. The database is set by BENCHMARK_DB, see
+BenchmarkConfig in api/config.py.
+"""
+import http.client
+import json
+import logging
+import math
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import func
+from werkzeug.serving import make_server
+
+from api import create_app
+from api.config import BenchmarkConfig
+from api.extensions import db
+from api.helpers import TIMESTAMP_FORMAT, building_id_mapper, parse_timestamp
+from api.models import Power
+from api.rollups import ROLLUPS, refresh_rollup
+
+SAMPLE_DB_PATH = os.path.join(BenchmarkConfig.PROJECT_ROOT, 'sample.db')
+RESULTS_DIR = os.path.join(BenchmarkConfig.PROJECT_ROOT, 'benchmark_results')
+
+# sample.db holds 3 days of readings, scaled copies are shifted by this much each
+SAMPLE_SPAN = timedelta(days=3)
+INSERT_BATCH_SIZE = 10000
+
+
+def scenarios(start, stop, b_ids):
+    """
+    (name, method, path, query string, JSON body) of each benchmarked request, over the seeded [start, stop] range
+    """
+    day = dict(start=start.strftime(TIMESTAMP_FORMAT), stop=(start + timedelta(days=1, seconds=-1)).strftime(TIMESTAMP_FORMAT))
+    sample = dict(start=start.strftime(TIMESTAMP_FORMAT),
+                  stop=min(start + SAMPLE_SPAN - timedelta(seconds=1), stop).strftime(TIMESTAMP_FORMAT))
+    # whole days, so the daily rollup can answer
+    last_day = datetime(stop.year, stop.month, stop.day) + timedelta(days=1, seconds=-1)
+    everything = dict(start=start.strftime(TIMESTAMP_FORMAT), stop=last_day.strftime(TIMESTAMP_FORMAT))
+    return [
+        ('energy_day', 'GET', '/facilities/energy/026/', day, None),
+        ('power_3days', 'GET', '/facilities/power/026/', sample, None),
+        ('power_3days_hourly', 'GET', '/facilities/power/026/', dict(sample, resolution='hour'), None),
+        ('power_3days_columnar', 'GET', '/facilities/power/026/', dict(sample, format='columnar'), None),
+        ('power_3days_stream', 'GET', '/facilities/power/026/', dict(sample, stream='true'), None),
+        ('sensor_3days', 'GET', '/facilities/sensor/GTECH.B026E_MS2/', sample, None),
+        ('energy_consumption_daily', 'GET', '/facilities/energy/026/', dict(sample, consumption='true', resolution='day'), None),
+        ('campus_power_hourly', 'GET', '/facilities/campus/power/', dict(day, resolution='hour'), None),
+        ('power_batch_all_buildings', 'POST', '/facilities/power/batch', None, dict(day, ids=b_ids)),
+        ('power_full_range_daily', 'GET', '/facilities/power/026/', dict(everything, resolution='day'), None),
+    ]
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile of a non-empty list of values
+    """
+    ordered = sorted(values)
+    return ordered[max(0, int(math.ceil(q / 100.0 * len(ordered))) - 1)]
+
+
+def summarize(latencies, elapsed, errors):
+    """
+    Latency percentiles in milliseconds and throughput of one scenario
+    """
+    if not latencies:
+        return dict(requests=0, errors=errors)
+    return dict(
+        requests=len(latencies),
+        errors=errors,
+        p50_ms=round(percentile(latencies, 50) * 1000, 2),
+        p95_ms=round(percentile(latencies, 95) * 1000, 2),
+        p99_ms=round(percentile(latencies, 99) * 1000, 2),
+        mean_ms=round(sum(latencies) / len(latencies) * 1000, 2),
+        throughput_rps=round(len(latencies) / elapsed, 2)
+    )
+
+
+def run_test_client(app, scenario, requests):
+    """
+    Run a scenario sequentially through the Flask test client, without any network or server overhead
+    """
+    _, method, path, query, body = scenario
+    client = app.test_client()
+    latencies = []
+    errors = 0
+    started = time.time()
+    for _ in range(requests):
+        request_started = time.time()
+        response = client.open(path, method=method, query_string=query, json=body)
+        response.get_data()
+        latencies.append(time.time() - request_started)
+        errors += response.status_code != 200
+    return summarize(latencies, time.time() - started, errors)
+
+
+def run_http(base_url, scenario, requests, concurrency):
+    """
+    Run a scenario from `concurrency` client threads against an HTTP server
+    """
+    _, method, path, query, body = scenario
+    url = base_url + path + ('?' + urllib.parse.urlencode(query) if query else '')
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+
+    def fetch(_):
+        request = urllib.request.Request(url, data=data, method=method, headers={'Content-Type': 'application/json'})
+        request_started = time.time()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+            return time.time() - request_started, False
+        except (OSError, http.client.HTTPException):
+            # HTTP errors, refused or reset connections and truncated responses are all counted as errors
+            return time.time() - request_started, True
+
+    started = time.time()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(fetch, range(requests)))
+    return summarize([latency for latency, _ in results], time.time() - started, sum(error for _, error in results))
+
+
+def serve(app):
+    """
+    Serve the app from a background thread on a free local port, returning the server and its base URL
+    """
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no access log line per request
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{0}'.format(server.server_port)
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BenchmarkConfig.PROJECT_ROOT,
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0), 1)
+
+
+@click.group()
+def cli():
+    """
+    Benchmarks of the readings endpoints
+    """
+
+
+@cli.command()
+@click.option('--scale', default=1, help='Number of copies of sample.db to load, each shifted 3 days later.')
+@click.option('--rollups/--no-rollups', default=True, help='Refresh the hourly and daily rollups after loading.')
+def seed(scale, rollups):
+    """
+    (Re)create the benchmark database from sample.db
+    """
+    sample = sqlite3.connect(SAMPLE_DB_PATH)
+    readings = [(parse_timestamp(timestamp), meas_type, value_read, source_name)
+                for timestamp, meas_type, value_read, source_name
+                in sample.execute('SELECT timestamp, type, value_read, source_name FROM power')]
+    sample.close()
+
+    app = create_app('benchmark')
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        started = time.time()
+        for copy in range(scale):
+            shift = SAMPLE_SPAN * copy
+            batch = []
+            for timestamp, meas_type, value_read, source_name in readings:
+                batch.append(dict(timestamp=timestamp + shift, type=meas_type, value_read=value_read,
+                                  source_name=source_name, building_id=building_id_mapper(source_name)))
+                if len(batch) >= INSERT_BATCH_SIZE:
+                    db.session.execute(Power.__table__.insert(), batch)
+                    batch = []
+            if batch:
+                db.session.execute(Power.__table__.insert(), batch)
+            db.session.commit()
+        elapsed = time.time() - started
+        click.echo('Loaded {0} rows in {1:.1f}s ({2:.0f} rows/s) into {3}'.format(
+            len(readings) * scale, elapsed, len(readings) * scale / elapsed, BenchmarkConfig.SQLALCHEMY_DATABASE_PATH))
+        if rollups:
+            for model in ROLLUPS:
+                click.echo('Refreshed {0}: {1} buckets'.format(model.__tablename__, refresh_rollup(model, full=True)))
+
+
+@cli.command()
+@click.option('--requests', default=20, help='Requests per scenario and client.')
+@click.option('--concurrency', default=8, help='Concurrent connections of the HTTP load generator.')
+@click.option('--http/--no-http', default=True, help='Also run the HTTP load generator.')
+@click.option('--url', default=None, help='Base URL of a running server (e.g. gunicorn) to load instead of a local one.')
+@click.option('--scenario', 'names', multiple=True, help='Only run these scenarios.')
+@click.option('--output', default=None, help='Results file, defaults to benchmark_results/<commit>.json.')
+def run(requests, concurrency, http, url, names, output):
+    """
+    Benchmark the readings endpoints and store the results as JSON
+    """
+    app = create_app('benchmark')
+    with app.app_context():
+        rows, start, stop = db.session.query(func.count(), func.min(Power.timestamp), func.max(Power.timestamp)).one()
+        if not rows:
+            raise click.ClickException('The benchmark database is empty, run "python benchmark.py seed" first')
+        b_ids = [b_id for b_id, in db.session.query(Power.building_id).distinct().order_by(Power.building_id)]
+
+    server = None
+    if http and url is None:
+        server, url = serve(app)
+
+    results = {}
+    try:
+        for scenario in scenarios(start, stop, b_ids):
+            if names and scenario[0] not in names:
+                continue
+            # one untimed request warms up the connection and SQLite's page cache
+            app.test_client().open(scenario[2], method=scenario[1], query_string=scenario[3], json=scenario[4])
+            results[scenario[0]] = dict(test_client=run_test_client(app, scenario, requests))
+            if http:
+                results[scenario[0]]['http'] = run_http(url, scenario, requests, concurrency)
+            click.echo('{0:<28} {1}'.format(scenario[0], json.dumps(results[scenario[0]])))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    commit = current_commit()
+    report = dict(
+        commit=commit,
+        created=datetime.utcnow().strftime(TIMESTAMP_FORMAT),
+        python=sys.version.split()[0],
+        database=dict(rows=rows, start=start.strftime(TIMESTAMP_FORMAT), stop=stop.strftime(TIMESTAMP_FORMAT)),
+        concurrency=concurrency,
+        peak_rss_mb=peak_rss_mb(),
+        scenarios=results
+    )
+    if output is None:
+        output = os.path.join(RESULTS_DIR, '{0}.json'.format(commit or 'results'))
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as results_file:
+        json.dump(report, results_file, indent=2, sort_keys=True)
+    click.echo('Peak RSS {0} MB, results written to {1}'.format(report['peak_rss_mb'], output))
+
+
+@cli.command()
+@click.argument('baseline', type=click.File())
+@click.argument('candidate', type=click.File())
+def compare(baseline, candidate):
+    """
+    Compare the p50/p95 latency and throughput of two result files
+    """
+    baseline, candidate = json.load(baseline), json.load(candidate)
+    click.echo('{0:<28} {1:<12} {2:>18} {3:>18} {4:>18}'.format('scenario', 'client', 'p50 ms', 'p95 ms', 'req/s'))
+    for name, modes in sorted(candidate['scenarios'].items()):
+        for mode, after in sorted(modes.items()):
+            before = baseline['scenarios'].get(name, {}).get(mode)
+            if not before or 'p50_ms' not in before or 'p50_ms' not in after:
+                continue
+            columns = ['{0:>9} {1:>+7.1%}'.format(after[key], after[key] / before[key] - 1 if before[key] else 0)
+                       for key in ('p50_ms', 'p95_ms', 'throughput_rps')]
+            click.echo('{0:<28} {1:<12} {2}'.format(name, mode, ' '.join(columns)))
+    click.echo('peak RSS: {0} MB -> {1} MB'.format(baseline['peak_rss_mb'], candidate['peak_rss_mb']))
+
+
+if __name__ == '__main__':
+    cli()
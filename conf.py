@@ -16,6 +16,10 @@ class DevConf(object):
     SQLA_ConnString = os.environ["DB_CONN"]
     SQLA_DbName = "CORE_gtfacilities"
     SQLA_Echo = True
+    SQLA_PoolSize = int(os.environ.get("DB_POOL_SIZE", 5))
+    SQLA_MaxOverflow = int(os.environ.get("DB_MAX_OVERFLOW", 2))
+    SQLA_PoolTimeout = int(os.environ.get("DB_POOL_TIMEOUT", 5))
+    SQLA_PoolRecycle = int(os.environ.get("DB_POOL_RECYCLE", 30 * 60))  # well below MySQL's wait_timeout
     FLASK_Host = "0.0.0.0"
     FLASK_Port = 5000
     FLASK_Debug = True
@@ -33,6 +37,10 @@ class ProdConf(object):
     SQLA_ConnString = os.environ["DB_CONN"]
     SQLA_DbName = "CORE_gtfacilities"
     SQLA_Echo = False
+    SQLA_PoolSize = int(os.environ.get("DB_POOL_SIZE", 5))
+    SQLA_MaxOverflow = int(os.environ.get("DB_MAX_OVERFLOW", 2))
+    SQLA_PoolTimeout = int(os.environ.get("DB_POOL_TIMEOUT", 5))
+    SQLA_PoolRecycle = int(os.environ.get("DB_POOL_RECYCLE", 30 * 60))  # well below MySQL's wait_timeout
     FLASK_Host = "0.0.0.0"
     FLASK_Port = 5000
     FLASK_Debug = False
@@ -1,6 +1,11 @@
 """
 Configuration for production gunicorn WSGI server
 Used by OpenShift Python S2I
+
+Set GUNICORN_WORKER_CLASS=gevent to serve requests asynchronously: each worker then handles up to
+GUNICORN_WORKER_CONNECTIONS concurrent requests as greenlets, and a request waiting on the database (PyMySQL is
+pure Python, so its socket I/O becomes cooperative) no longer blocks the worker. Requires the 'gevent' package.
+The /live endpoints answer 503 under sync workers, which each of their streams would block, see api/live.py.
 """
 
 import os
@@ -8,5 +13,19 @@ import os
 workers = int(os.environ.get('GUNICORN_PROCESSES', '3'))
 threads = int(os.environ.get('GUNICORN_THREADS', '1'))
 
+# 'sync' (default) or 'gevent'
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+# concurrent requests per gevent worker
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
 forwarded_allow_ips = '*'
-secure_scheme_headers = { 'X-Forwarded-Proto': 'https' }
\ No newline at end of file
+secure_scheme_headers = { 'X-Forwarded-Proto': 'https' }
+
+
+def child_exit(server, worker):
+    """
+    Drop the live metrics of a worker that exited, when metrics are shared through PROMETHEUS_MULTIPROC_DIR
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -8,6 +8,8 @@ from flasgger import Swagger
 import flask
 from flask_cas import CAS, login_required
 import flask_restful
+from api.compression import Compress
+from api.pool import TimedQueuePool
 import conf  # all configurations are stored here, change individually for development and release configurations.
 
 # Import the right configuration from conf.py, based on if it is the development environment or release environment
@@ -40,6 +42,7 @@ swagger_template = {
 app = flask.Flask(__name__)
 cas = CAS(app)
 swag = Swagger(app, template=swagger_template)
+compress = Compress(app)  # gzip/brotli/zstd responses per Accept-Encoding, see api/compression.py
 app.config['CAS_SERVER'] = config['CAS_Server']
 app.config['CAS_VALIDATE_ROUTE'] = config['CAS_ValRoute']
 app.config['SECRET_KEY'] = config['CAS_Secret']  # set a random key, otherwise the authentication will throw errors
@@ -50,7 +53,10 @@ app.config['CAS_AFTER_LOGIN'] = ''
 api = flask_restful.Api(app)
 
 # SQLAlchemy stuff
-db = create_engine(config['SQLA_ConnString'] + config['SQLA_DbName'], echo=config['SQLA_Echo'])
+db = create_engine(config['SQLA_ConnString'] + config['SQLA_DbName'], echo=config['SQLA_Echo'],
+                   poolclass=TimedQueuePool,  # checkout waits are logged, see api/pool.py
+                   pool_size=config['SQLA_PoolSize'], max_overflow=config['SQLA_MaxOverflow'],
+                   pool_timeout=config['SQLA_PoolTimeout'], pool_recycle=config['SQLA_PoolRecycle'], pool_pre_ping=True)
 Base = declarative_base()
 metadata = MetaData(bind=db)
 
@@ -59,7 +65,9 @@ power = Table('power', metadata,
               Column('timestamp', DateTime, primary_key=True, nullable=False, index=True, server_default=text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP")),
               Column('type', String(100), primary_key=True, nullable=False),
               Column('value_read', Float(asdecimal=True), nullable=False),
-              Column('source_name', String(100), primary_key=True, nullable=False)
+              Column('source_name', String(100), primary_key=True, nullable=False),
+              Column('building_id', String(3), nullable=True),  # 3-digit building ID parsed from source_name, see api/models.py
+              Index('ix_power_building_type_timestamp_source', 'building_id', 'type', 'timestamp', 'source_name')
               )
 
 sensors = Table('sensors', metadata,
@@ -87,7 +95,7 @@ def sensortype_mapper(source):
     """
     Maps the unique 3-letter code to different types of meters. Should be migrated to a database in a future version.
     """
-    stype = re.search('B\d\d\d(.*)',source).group(1)[:-1] # removing the Bxxx part, and the trailing \r that seems to be in the database
+    stype = re.search('B\d\d\d(.*)',source).group(1).rstrip('\r') # removing the Bxxx part, and the trailing \r of names stored before ingest cleaned them
     stype = ''.join(filter(str.isalpha, stype)) # keep only the characters, drop all numbers - this gives a unique 3 letter code (for now) for all different meters
     sensortypes = {
         "EMS": "Electrical mains transformer (4160V - 480V)",
@@ -107,7 +115,7 @@ def res_to_json(row):
     Encode the result of a power-related SQL query to JSON
     """
     output = {
-        "source_name": row[3][:-1],    # remove the trailing \r that seems to be in the database
+        "source_name": row[3].rstrip('\r'),    # remove the trailing \r of names stored before ingest cleaned them
         "source_type": sensortype_mapper(row[3]),
         "timestamp": row[0],           # get data in UNIX format, with GMT times, client can use JavaScript to convert timezones.
         "value_read": str(row[2]),
@@ -115,6 +123,28 @@ def res_to_json(row):
     }
     return(output)
 
+def stream_requested():
+    """
+    True if the client asked for an incrementally written response with ?stream=true
+    """
+    return flask.request.args.get('stream', '').lower() in ('1', 'true')
+
+def stream_response(results, encode, not_found):
+    """
+    Write a JSON array of encode(result) as the rows arrive from a server-side cursor, instead of building it in memory
+    """
+    results = iter(results)
+    first = next(results, None)
+    if first is None:
+        return flask.jsonify({"error": not_found}), 404
+
+    def generate():
+        yield '[' + flask.json.dumps(encode(first))
+        for result in results:
+            yield ',' + flask.json.dumps(encode(result))
+        yield ']'
+    return flask.Response(flask.stream_with_context(generate()), mimetype='application/json')
+
 class CheckUser(flask_restful.Resource):
     @app.route("/checkuser",methods=['GET'])
     @login_required
@@ -218,7 +248,13 @@ class Energy(flask_restful.Resource):
         stop = flask.request.args.get('stop')
         if start is None or stop is None:
             return flask.jsonify({"error": "start and stop parameters required, you cannot query the whole database"}), 400
-        query = select([power], and_(power.c.type == 'Active Energy Delivered', power.c.source_name.like('%B' + b_id.zfill(3) + '%'), power.c.timestamp >= start, power.c.timestamp <= stop)).order_by(asc(power.c.timestamp))
+        query = select([power], and_(power.c.type == 'Active Energy Delivered', power.c.building_id == b_id.zfill(3), power.c.timestamp >= start, power.c.timestamp <= stop)).order_by(asc(power.c.timestamp))
+        if stream_requested():
+            def encode(result):
+                energy_data = res_to_json(result)
+                energy_data["b_id"] = b_id
+                return energy_data
+            return stream_response(db.execute(query.execution_options(stream_results=True)), encode, "Building ID not found in the database")
         results = db.execute(query)
         response = []
         for result in results:
@@ -297,7 +333,13 @@ class Power(flask_restful.Resource):
         stop = flask.request.args.get('stop')
         if start is None or stop is None:
             return flask.jsonify({"error": "start and stop parameters required, you cannot query the whole database"}), 400
-        query = select([power], and_(power.c.type == 'Active Power', power.c.source_name.like('%B' + b_id.zfill(3) + '%'), power.c.timestamp >= start, power.c.timestamp <= stop)).order_by(asc(power.c.timestamp))
+        query = select([power], and_(power.c.type == 'Active Power', power.c.building_id == b_id.zfill(3), power.c.timestamp >= start, power.c.timestamp <= stop)).order_by(asc(power.c.timestamp))
+        if stream_requested():
+            def encode(result):
+                power_data = res_to_json(result)
+                power_data["b_id"] = b_id
+                return power_data
+            return stream_response(db.execute(query.execution_options(stream_results=True)), encode, "Building ID not found in the database")
         results = db.execute(query)
         response = []
         for result in results:
@@ -372,7 +414,9 @@ class Sensor(flask_restful.Resource):
         stop = flask.request.args.get('stop')
         if start is None or stop is None:
             return flask.jsonify({"error": "start and stop parameters required, you cannot query the whole database"}), 400
-        query = select([power], and_(power.c.source_name == (sensor_id + '\r'), power.c.timestamp >= start, power.c.timestamp <= stop)).order_by(asc(power.c.timestamp))
+        query = select([power], and_(power.c.source_name.in_((sensor_id, sensor_id + '\r')), power.c.timestamp >= start, power.c.timestamp <= stop)).order_by(asc(power.c.timestamp))
+        if stream_requested():
+            return stream_response(db.execute(query.execution_options(stream_results=True)), res_to_json, "Building ID not found in the database")
         results = db.execute(query)
         response = []
         for result in results:
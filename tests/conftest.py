@@ -1,9 +1,17 @@
 """
 Configuration of shared pytest fixtures
 """
+import os
+import sqlite3
+
 import pytest
 
 from api import create_app
+from api.config import TestConfig
+from api.helpers import parse_timestamp
+
+SAMPLE_DB_PATH = os.path.join(TestConfig.PROJECT_ROOT, 'sample.db')
+
 
 @pytest.yield_fixture(scope='session')
 def app():
@@ -23,6 +31,22 @@ def db(app):
     yield db_instance
 
 
+@pytest.fixture(scope='session')
+def load_test_db(db):
+    """Copy the readings in sample.db (B026 and others, 2016-09-01 to 2016-09-03) into the test database"""
+    from api.models import Power
+
+    sample = sqlite3.connect(SAMPLE_DB_PATH)
+    rows = [dict(timestamp=parse_timestamp(timestamp), type=meas_type, value_read=value_read, source_name=source_name)
+            for timestamp, meas_type, value_read, source_name
+            in sample.execute('SELECT timestamp, type, value_read, source_name FROM power')]
+    sample.close()
+
+    db.session.execute(Power.__table__.insert(), rows)
+    db.session.commit()
+    return rows
+
+
 @pytest.fixture(scope='session')
 def test_client(app):
     return app.test_client()
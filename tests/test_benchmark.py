@@ -0,0 +1,25 @@
+"""
+pytest tests for the benchmark harness
+"""
+from datetime import datetime
+
+import pytest
+
+from benchmark import percentile, run_test_client, scenarios, summarize
+
+
+class TestBenchmark:
+    def test_percentile(self):
+        latencies = [i / 1000.0 for i in range(1, 101)]
+        assert percentile(latencies, 50) == 0.05
+        assert percentile(latencies, 99) == 0.099
+        assert percentile([0.2], 95) == 0.2
+        summary = summarize(latencies, 2.0, 1)
+        assert summary['p95_ms'] == 95.0
+        assert summary['throughput_rps'] == 50.0
+        assert summary['errors'] == 1
+
+    def test_scenarios_succeed(self, app, load_test_db):
+        for scenario in scenarios(datetime(2016, 9, 1), datetime(2016, 9, 3, 23, 45), ['026', '027']):
+            summary = run_test_client(app, scenario, 1)
+            assert summary['errors'] == 0, scenario[0]
@@ -0,0 +1,114 @@
+"""
+pytest tests for the readings query result cache
+"""
+from datetime import datetime, timedelta
+from http import HTTPStatus
+
+import pytest
+
+from flask import json
+
+from sqlalchemy import func
+
+from api.cache import LRUCache
+from api.extensions import cache
+from api.ingest import insert_readings, parse_reading
+from api.models import Power
+
+RANGE = {'start': '2016-09-01 00:00:00', 'stop': '2016-09-03 23:59:59'}
+
+
+@pytest.fixture
+def cache_enabled(app):
+    app.config['CACHE_ENABLED'] = True
+    cache.clear()
+    yield cache
+    app.config['CACHE_ENABLED'] = False
+    cache.clear()
+
+
+def readings_entries():
+    """
+    Keys of cached query results, leaving out the fingerprints cached for ETags
+    """
+    return [key for key in cache.local.entries if not key.startswith('fingerprint|')]
+
+
+class TestCache:
+    def test_lru_eviction_and_expiry(self):
+        lru = LRUCache(2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        assert lru.get('a') == 1
+        lru.set('c', 3)
+        assert lru.get('b') is None
+        assert lru.get('a') == 1
+        lru.set('d', 4, ttl=-1)
+        assert lru.get('d') is None
+
+    def test_ttl(self, app, db, load_test_db, cache_enabled):
+        with app.test_request_context():
+            watermark = db.session.query(func.max(Power.timestamp)).scalar()
+            assert cache.ttl(watermark - timedelta(hours=2)) is None
+            assert cache.ttl(watermark - timedelta(minutes=5)) == app.config['CACHE_RECENT_TTL']
+            assert cache.ttl(datetime.utcnow()) == app.config['CACHE_RECENT_TTL']
+
+    def test_future_reading_does_not_settle_recent_windows(self, app, db, load_test_db, cache_enabled):
+        db.session.add(Power(timestamp=datetime(2030, 1, 1), type='Active Power', value_read=1,
+                             source_name='GTECH.B999E_MS1'))
+        db.session.commit()
+        try:
+            with app.test_request_context():
+                assert cache.ttl(datetime.now() - timedelta(minutes=5)) == app.config['CACHE_RECENT_TTL']
+                assert cache.ttl(datetime(2016, 9, 2)) is None
+        finally:
+            Power.query.filter(Power.timestamp == datetime(2030, 1, 1)).delete(synchronize_session=False)
+            db.session.commit()
+
+    def test_repeated_query_is_served_from_cache(self, db, load_test_db, test_client, cache_enabled, monkeypatch):
+        first = test_client.get('/facilities/power/026/', query_string=RANGE)
+        assert len(readings_entries()) == 1
+
+        import api.routes
+        monkeypatch.setattr(api.routes, 'query_readings', lambda *args: pytest.fail('cache miss'))
+        second = test_client.get('/facilities/power/26/', query_string=RANGE)
+        assert json.loads(second.data) == [dict(reading, b_id='26') for reading in json.loads(first.data)]
+        columnar = test_client.get('/facilities/power/026/', query_string=dict(RANGE, format='columnar'))
+        assert sum(len(sensor['values']) for sensor in json.loads(columnar.data)) == len(json.loads(first.data))
+
+    def test_parameters_are_part_of_the_key(self, load_test_db, test_client, cache_enabled):
+        raw = json.loads(test_client.get('/facilities/power/026/', query_string=RANGE).data)
+        hourly = json.loads(test_client.get('/facilities/power/026/', query_string=dict(RANGE, resolution='hour')).data)
+        energy = json.loads(test_client.get('/facilities/energy/026/', query_string=RANGE).data)
+        assert len(hourly) < len(raw)
+        assert energy[0]['units'] == 'kWh'
+        assert len(readings_entries()) == 3
+
+    def test_streamed_requests_bypass_the_cache(self, load_test_db, test_client, cache_enabled):
+        test_client.get('/facilities/power/026/', query_string=dict(RANGE, stream='true')).get_data()
+        assert len(readings_entries()) == 0
+
+    def test_etag_fingerprint_is_cached(self, load_test_db, test_client, cache_enabled):
+        test_client.get('/facilities/power/026/', query_string=RANGE)
+        assert len(cache.local.entries) - len(readings_entries()) == 1
+
+    def test_writes_invalidate_cached_windows(self, db, load_test_db, test_client, cache_enabled, monkeypatch):
+        window = {'start': '2018-03-01 00:00:00', 'stop': '2018-03-01 23:59:59'}
+        assert test_client.get('/facilities/power/026/', query_string=window).status_code == HTTPStatus.NOT_FOUND
+        assert len(cache.local.entries) == 0
+
+        settled = json.loads(test_client.get('/facilities/power/026/', query_string=RANGE).data)
+        try:
+            for minute in (0, 15):
+                insert_readings([parse_reading(dict(timestamp='2018-03-01 00:{0:02d}:00'.format(minute),
+                                                    type='Active Power', value_read=minute,
+                                                    source_name='GTECH.B026E_MS2'))])
+                readings = json.loads(test_client.get('/facilities/power/026/', query_string=window).data)
+                assert len(readings) == minute // 15 + 1
+            # windows ending before the months written to keep their cached results
+            import api.routes
+            monkeypatch.setattr(api.routes, 'query_readings', lambda *args: pytest.fail('cache miss'))
+            assert json.loads(test_client.get('/facilities/power/026/', query_string=RANGE).data) == settled
+        finally:
+            Power.query.filter(Power.timestamp >= datetime(2018, 3, 1)).delete(synchronize_session=False)
+            db.session.commit()
@@ -0,0 +1,53 @@
+"""
+pytest tests for response compression
+"""
+import gzip
+from http import HTTPStatus
+
+import pytest
+
+from flask import json
+
+RANGE = {'start': '2016-09-01 00:00:00', 'stop': '2016-09-03 23:59:59'}
+URL = '/facilities/power/026/'
+
+
+class TestCompression:
+    def test_uncompressed_without_accept_encoding(self, load_test_db, test_client):
+        response = test_client.get(URL, query_string=RANGE)
+        assert 'Content-Encoding' not in response.headers
+        assert 'Accept-Encoding' in response.headers['Vary']
+
+    def test_gzip(self, load_test_db, test_client):
+        plain = test_client.get(URL, query_string=RANGE).data
+        response = test_client.get(URL, query_string=RANGE, headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert len(response.data) < len(plain) / 5
+        assert gzip.decompress(response.data) == plain
+
+    def test_gzip_streamed(self, load_test_db, test_client):
+        plain = test_client.get(URL, query_string=dict(RANGE, stream='true')).get_data()
+        response = test_client.get(URL, query_string=dict(RANGE, stream='true'), headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Content-Length' not in response.headers
+        assert gzip.decompress(response.get_data()) == plain
+
+    def test_preferred_encoding(self, load_test_db, test_client):
+        zstandard = pytest.importorskip('zstandard')
+        plain = test_client.get(URL, query_string=RANGE).data
+        response = test_client.get(URL, query_string=RANGE, headers={'Accept-Encoding': 'gzip;q=0.5, zstd, br'})
+        assert response.headers['Content-Encoding'] == 'zstd'
+        assert zstandard.ZstdDecompressor().decompressobj().decompress(response.data) == plain
+
+    def test_brotli_streamed(self, load_test_db, test_client):
+        brotli = pytest.importorskip('brotli')
+        plain = test_client.get(URL, query_string=dict(RANGE, stream='true')).get_data()
+        response = test_client.get(URL, query_string=dict(RANGE, stream='true'), headers={'Accept-Encoding': 'br'})
+        assert response.headers['Content-Encoding'] == 'br'
+        assert brotli.decompress(response.get_data()) == plain
+
+    def test_small_responses_are_not_compressed(self, load_test_db, test_client):
+        response = test_client.get('/facilities/power/358/', query_string=RANGE, headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == HTTPStatus.NOT_FOUND
+        assert 'Content-Encoding' not in response.headers
+        assert json.loads(response.data)['status'] == HTTPStatus.NOT_FOUND
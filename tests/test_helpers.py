@@ -0,0 +1,40 @@
+"""
+pytest unit tests for the row encoding helpers
+"""
+from datetime import datetime
+
+from api.helpers import source_mapper, sensortype_mapper, sensortype_code_mapper, building_id_mapper, res_to_json, \
+    encode_cursor, decode_cursor
+
+
+class TestHelpers:
+    def test_source_mapper(self):
+        assert source_mapper('GTECH.B026E_MH1\r') == ('GTECH.B026E_MH1', "Electrical mains meter, high voltage (480V)")
+        assert source_mapper('GTECH.B026E_U10H2\r') == ('GTECH.B026E_U10H2', "Electrical sub-meter, high voltage (480V)")
+        # readings loaded without the trailing \r resolve to the same sensor
+        assert source_mapper('GTECH.B026E_MS2') == source_mapper('GTECH.B026E_MS2\r')
+        assert sensortype_mapper('GTECH.B026E_XY1\r') == "unknown"
+        assert sensortype_mapper('not a sensor') == "unknown"
+
+    def test_sensortype_code_mapper(self):
+        assert sensortype_code_mapper('GTECH.B026E_MS2\r') == 'EMS'
+        assert sensortype_code_mapper('GTECH.B026E_U10H2') == 'EUH'
+        assert sensortype_code_mapper('not a sensor') is None
+
+    def test_building_id_mapper(self):
+        assert building_id_mapper('GTECH.B026E_MH1\r') == '026'
+        assert building_id_mapper('not a sensor') is None
+
+    def test_res_to_json(self):
+        timestamp = datetime(2016, 9, 1)
+        assert res_to_json((timestamp, 'Active Power', 2196.25, 'GTECH.B026E_MS2\r')) == {
+            "source_name": 'GTECH.B026E_MS2',
+            "source_type": "Electrical mains transformer (4160V - 480V)",
+            "timestamp": timestamp,
+            "value_read": '2196.25',
+            "units": 'kW'
+        }
+
+    def test_cursor_round_trip(self):
+        key = (datetime(2016, 9, 1, 0, 15), 'Active Power', 'GTECH.B026E_MS2\r')
+        assert decode_cursor(encode_cursor(*key)) == key
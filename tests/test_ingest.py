@@ -0,0 +1,89 @@
+"""
+pytest tests for bulk ingestion of meter exports
+"""
+import gzip
+import json
+from datetime import datetime
+
+import pytest
+from flask.cli import ScriptInfo
+from click.testing import CliRunner
+
+from api.commands import ingest
+from api.ingest import export_format, ingest_readings, parse_reading, read_records
+from api.models import Power
+
+SENSOR = 'GTECH.B999E_MS1'
+RANGE = {'start': '2017-01-01 00:00:00', 'stop': '2017-01-01 23:59:59'}
+
+
+@pytest.fixture
+def clean_sensor(db):
+    yield
+    Power.query.filter(Power.source_name.in_((SENSOR, SENSOR + '\r'))).delete(synchronize_session=False)
+    db.session.commit()
+
+
+class TestIngest:
+    def test_export_format(self):
+        assert export_format('readings.csv') == 'csv'
+        assert export_format('readings.JSONL.gz') == 'jsonl'
+        with pytest.raises(ValueError):
+            export_format('readings.xlsx')
+
+    def test_ingest_cleans_and_dedupes(self, db, clean_sensor):
+        lines = ['timestamp,type,value_read,source_name\r\n',
+                 '2017-01-01 00:00:00,Active Power,10.5,{0}\r\n'.format(SENSOR),
+                 '2017-01-01 00:15:00,Active Power,11.5,"{0}\r"\r\n'.format(SENSOR),
+                 '2017-01-01 00:15:00,Active Power,99,{0}\r\n'.format(SENSOR),
+                 'yesterday,Active Power,1,{0}\r\n'.format(SENSOR),
+                 '2017-01-01 00:30:00,Active Power,nan,{0}\r\n'.format(SENSOR)]
+        errors = []
+        stats = ingest_readings(read_records(lines, 'csv'), batch_size=2, on_error=lambda *args: errors.append(args))
+        assert (stats.read, stats.inserted, stats.duplicates, stats.malformed) == (5, 2, 1, 2)
+        assert [error[0] for error in errors] == [5, 6]
+
+        readings = Power.query.filter(Power.source_name.like('%B999%')).order_by(Power.timestamp).all()
+        assert [(r.source_name, r.building_id, float(r.value_read)) for r in readings] == \
+            [(SENSOR, '999', 10.5), (SENSOR, '999', 11.5)]
+
+        # loading the same export again inserts nothing
+        assert ingest_readings(read_records(lines, 'csv')).inserted == 0
+
+    def test_parse_reading_rejects_invalid_values(self, app):
+        record = dict(timestamp='2017-01-01 00:00:00', type='Active Power', value_read=1, source_name=SENSOR)
+        assert parse_reading(record)['value_read'] == 1.0
+        for invalid in (dict(value_read=True), dict(value_read='inf'), dict(type='Reactive Power'),
+                        dict(timestamp='2030-01-01 00:00:00')):
+            with pytest.raises(ValueError):
+                parse_reading(dict(record, **invalid), latest=datetime(2020, 1, 1))
+
+    def test_ingest_rejects_future_readings(self, db, clean_sensor):
+        records = [(1, dict(timestamp='2999-01-01 00:00:00', type='Active Power', value_read=1, source_name=SENSOR))]
+        stats = ingest_readings(records)
+        assert (stats.inserted, stats.malformed) == (0, 1)
+
+    def test_ingest_skips_readings_stored_with_legacy_names(self, db, load_test_db):
+        stored = [row for row in load_test_db if row['source_name'].endswith('\r')][:3]
+        records = [dict(row, timestamp=str(row['timestamp'])) for row in stored]
+        before = Power.query.count()
+        stats = ingest_readings(enumerate(records, 1))
+        assert (stats.inserted, stats.duplicates) == (0, 3)
+        assert Power.query.count() == before
+
+    def test_ingest_command(self, app, db, test_client, tmpdir, clean_sensor):
+        path = str(tmpdir.join('readings.jsonl.gz'))
+        with gzip.open(path, 'wt') as export:
+            for minute in (0, 15, 30):
+                export.write(json.dumps(dict(timestamp='2017-01-01T00:{0:02d}:00'.format(minute), type='Active Power',
+                                             value_read=minute, source_name=SENSOR)) + '\n')
+            export.write('not json\n')
+
+        result = CliRunner().invoke(ingest, [path], obj=ScriptInfo(create_app=lambda *args: app))
+        assert result.exit_code == 0, result.output
+        assert '3 inserted' in result.output
+        assert '1 malformed' in result.output
+
+        # ingested sensor names have no trailing \r and are still found
+        readings = json.loads(test_client.get('/facilities/sensor/{0}/'.format(SENSOR), query_string=RANGE).data)
+        assert [reading['timestamp'] for reading in readings][-1] == '2017-01-01T00:30:00'
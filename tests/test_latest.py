@@ -0,0 +1,87 @@
+"""
+pytest tests for the latest readings endpoints
+"""
+import json
+from datetime import datetime, timedelta
+from http import HTTPStatus
+
+import pytest
+from sqlalchemy import func
+
+from api.extensions import latest
+from api.models import Power
+
+
+@pytest.fixture
+def fresh_latest(app, db, load_test_db):
+    latest.readings, latest.buildings, latest.watermark, latest.loaded = {}, {}, None, None
+    yield
+    Power.query.filter(Power.timestamp >= datetime(2016, 9, 4)).delete(synchronize_session=False)
+    db.session.commit()
+    latest.readings, latest.buildings, latest.watermark, latest.loaded = {}, {}, None, None
+
+
+class TestLatest:
+    def test_building_latest(self, db, test_client, fresh_latest):
+        response = test_client.get('/facilities/power/26/latest')
+        assert response.status_code == HTTPStatus.OK
+        readings = json.loads(response.data)
+
+        newest = db.session.query(Power.source_name, func.max(Power.timestamp)).filter(
+            Power.building_id == '026', Power.type == 'Active Power').group_by(Power.source_name).all()
+        assert len(readings) == len(newest)
+        assert set(reading['b_id'] for reading in readings) == {'26'}
+        assert set(reading['timestamp'] for reading in readings) == \
+            set(timestamp.isoformat() for _, timestamp in newest)
+
+    def test_unknown_building(self, test_client, fresh_latest):
+        assert test_client.get('/facilities/power/358/latest').status_code == HTTPStatus.NOT_FOUND
+
+    def test_campus_latest(self, db, test_client, fresh_latest):
+        readings = json.loads(test_client.get('/facilities/latest').data)
+        sensors = db.session.query(Power.source_name, Power.type).distinct().count()
+        assert len(readings) == sensors
+        assert all(reading['b_id'] is not None for reading in readings)
+
+    def test_served_from_memory_until_refreshed(self, db, test_client, fresh_latest):
+        test_client.get('/facilities/power/026/latest')
+        db.session.add(Power(timestamp=datetime(2016, 9, 4), type='Active Power', value_read=42,
+                             source_name='GTECH.B026E_MS2'))
+        db.session.commit()
+
+        def ms2():
+            readings = json.loads(test_client.get('/facilities/power/026/latest').data)
+            return next(reading for reading in readings if reading['source_name'].endswith('B026E_MS2'))
+
+        assert float(ms2()['value_read']) != 42
+        latest.refresh()
+        assert float(ms2()['value_read']) == 42
+
+    def test_pushed_readings_are_recorded(self, app, test_client, fresh_latest, monkeypatch):
+        monkeypatch.setitem(app.config, 'INGEST_FLUSH_ROWS', 1)
+        test_client.get('/facilities/latest')
+        response = test_client.post('/facilities/readings', headers={'Authorization': 'Bearer test-token'},
+                                    data=json.dumps(dict(readings=[dict(
+                                        timestamp='2016-09-04 00:15:00', type='Active Power', value_read=7,
+                                        source_name='GTECH.B026E_MS1')])),
+                                    content_type='application/json')
+        assert response.status_code == HTTPStatus.ACCEPTED
+        assert latest.readings[('GTECH.B026E_MS1', 'Active Power')][2] == 7
+
+    def test_stale_sensors_are_dropped(self, app, test_client, fresh_latest):
+        test_client.get('/facilities/latest')
+        stale = (datetime(2016, 1, 1), 'Active Power', 1, 'GTECH.B026E_GONE')
+        latest.record([stale])
+        # older than LATEST_MAX_AGE before the newest reading, so no longer reported...
+        assert stale not in latest.building('026', 'Active Power')
+        assert stale not in latest.campus()
+        # ...and forgotten at the next reload
+        latest.load()
+        assert ('GTECH.B026E_GONE', 'Active Power') not in latest.readings
+
+    def test_future_reading_does_not_age_out_the_others(self, test_client, fresh_latest):
+        test_client.get('/facilities/latest')
+        recent = (datetime.now().replace(microsecond=0) - timedelta(minutes=15), 'Active Power', 1, 'GTECH.B026E_MS2')
+        latest.record([recent, (datetime(2030, 1, 1), 'Active Power', 1, 'GTECH.B999E_MS1')])
+        assert recent in latest.building('026', 'Active Power')
+        assert recent in latest.campus()
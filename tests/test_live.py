@@ -0,0 +1,124 @@
+"""
+pytest tests for the live readings stream
+"""
+import json
+from datetime import datetime
+
+import pytest
+
+from api.extensions import live_feed
+from api.models import Power
+
+
+def store(db, minute, source_name='GTECH.B026E_MS2', meas_type='Active Power', value=1.0):
+    db.session.add(Power(timestamp=datetime(2016, 9, 4, 0, minute), type=meas_type, value_read=value,
+                         source_name=source_name))
+    db.session.commit()
+
+
+def subscribe(test_client, path):
+    """Open a live stream, returning the response and its body, read up to the subscription"""
+    response = test_client.get(path)
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b'retry:')
+    return response, chunks
+
+
+def events(chunks, count):
+    """Read `count` readings events from a stream, skipping heartbeats"""
+    found = []
+    for chunk in chunks:
+        chunk = chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
+        if chunk.startswith('event: readings'):
+            found.append(json.loads(chunk.split('data: ', 1)[1]))
+            if len(found) == count:
+                return found
+    return found
+
+
+@pytest.fixture
+def live(app, db, load_test_db, monkeypatch):
+    monkeypatch.setitem(app.config, 'LIVE_HEARTBEAT', 0.01)
+    monkeypatch.setitem(app.config, 'LIVE_MAX_DURATION', 0.5)
+    live_feed.watermark = None
+    live_feed.seen = {}
+    yield
+    Power.query.filter(Power.timestamp >= datetime(2016, 9, 4)).delete(synchronize_session=False)
+    db.session.commit()
+
+
+class TestLive:
+    def test_only_new_readings_are_sent(self, db, test_client, live):
+        response, chunks = subscribe(test_client, '/facilities/power/26/live')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        # the first poll of a subscription only notes what is already stored
+        assert live_feed.poll() == 0
+
+        store(db, 0, value=1.5)
+        store(db, 0, source_name='GTECH.B026E_MH1', meas_type='Energy', value=7.0)
+        store(db, 0, source_name='GTECH.B027E_MS1')
+        assert live_feed.poll() == 1
+        # nothing is sent twice
+        assert live_feed.poll() == 0
+
+        readings, = events(chunks, 1)
+        assert [(reading['b_id'], reading['source_name'], float(reading['value_read'])) for reading in readings] == \
+            [('26', 'GTECH.B026E_MS2', 1.5)]
+        response.close()
+
+    def test_one_query_fans_out_to_all_subscribers(self, db, test_client, live):
+        building, building_events = subscribe(test_client, '/facilities/power/026/live')
+        sensor, sensor_events = subscribe(test_client, '/facilities/sensor/GTECH.B026E_MS2/live')
+        other, other_events = subscribe(test_client, '/facilities/sensor/GTECH.B026E_MS1/live')
+        live_feed.poll()
+
+        store(db, 15)
+        assert live_feed.poll() == 2
+        assert len(events(building_events, 1)) == 1
+        assert len(events(sensor_events, 1)) == 1
+        assert events(other_events, 1) == []
+        for response in (building, sensor, other):
+            response.close()
+
+    def test_late_readings_are_sent(self, db, test_client, live):
+        response, _ = subscribe(test_client, '/facilities/power/026/live')
+        live_feed.poll()
+        store(db, 30)
+        store(db, 29, source_name='GTECH.B026E_MS1')
+        assert live_feed.poll() == 2
+        store(db, 20, source_name='GTECH.B026E_MS3')
+        assert live_feed.poll() == 1
+        response.close()
+
+    def test_closed_streams_unsubscribe(self, test_client, live):
+        response, chunks = subscribe(test_client, '/facilities/power/026/live')
+        assert len(live_feed.subscriptions) == 1
+        # ends after LIVE_MAX_DURATION
+        assert events(chunks, 1) == []
+        assert live_feed.subscriptions == {}
+        assert live_feed.poll() == 0
+
+    def test_streams_are_limited(self, app, test_client, live, monkeypatch):
+        response, _ = subscribe(test_client, '/facilities/power/026/live')
+        monkeypatch.setitem(app.config, 'LIVE_MAX_STREAMS', 1)
+        assert test_client.get('/facilities/power/027/live').status_code == 503
+        response.close()
+        assert test_client.get('/facilities/power/027/live').status_code == 200
+
+        # outside of gevent workers, a stream would block the thread serving it
+        monkeypatch.setitem(app.config, 'LIVE_ALLOW_BLOCKING_STREAMS', False)
+        assert test_client.get('/facilities/power/027/live').status_code == 503
+
+    def test_future_readings_are_ignored(self, db, test_client, live):
+        response, chunks = subscribe(test_client, '/facilities/power/026/live')
+        db.session.add(Power(timestamp=datetime(2030, 1, 1), type='Active Power', value_read=1,
+                             source_name='GTECH.B026E_MS1'))
+        db.session.commit()
+        live_feed.poll()
+        # the poll cursor stays at the newest real reading, so the readings stored after it still arrive
+        store(db, 0, value=2.5)
+        assert live_feed.poll() == 1
+        readings, = events(chunks, 1)
+        assert [float(reading['value_read']) for reading in readings] == [2.5]
+        response.close()
@@ -0,0 +1,48 @@
+"""
+pytest tests for the Prometheus metrics
+"""
+from http import HTTPStatus
+
+import pytest
+
+from flask import json
+
+prometheus_client = pytest.importorskip('prometheus_client')
+
+RANGE = {'start': '2016-09-01 00:00:00', 'stop': '2016-09-03 23:59:59'}
+ENDPOINT = {'endpoint': 'gtpower.getPowerData'}
+
+
+def sample(name, labels=ENDPOINT):
+    return prometheus_client.REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestMetrics:
+    def test_request_is_measured(self, load_test_db, test_client):
+        rows, sent, db_time = (sample('gtpower_rows_fetched_sum'), sample('gtpower_response_bytes_sum'),
+                               sample('gtpower_db_query_duration_seconds_sum'))
+        response = test_client.get('/facilities/power/026/', query_string=RANGE)
+        assert response.status_code == HTTPStatus.OK
+
+        assert sample('gtpower_rows_fetched_sum') - rows == len(json.loads(response.data))
+        assert sample('gtpower_response_bytes_sum') - sent == len(response.data)
+        assert sample('gtpower_db_query_duration_seconds_sum') > db_time
+        assert sample('gtpower_request_duration_seconds_count',
+                      dict(ENDPOINT, method='GET', status='200')) >= 1
+
+    def test_streamed_request_is_measured_once_sent(self, load_test_db, test_client):
+        rows, count = sample('gtpower_rows_fetched_sum'), sample('gtpower_rows_fetched_count')
+        response = test_client.get('/facilities/power/026/', query_string=dict(RANGE, stream='true'),
+                                   headers={'Accept-Encoding': 'gzip'})
+        data = response.get_data()
+        response.close()
+        assert sample('gtpower_rows_fetched_count') - count == 1
+        assert sample('gtpower_rows_fetched_sum') - rows == 4608
+        assert sample('gtpower_response_bytes_sum') >= len(data)
+
+    def test_metrics_endpoint(self, load_test_db, test_client):
+        test_client.get('/facilities/power/026/', query_string=RANGE)
+        response = test_client.get('/metrics')
+        assert response.status_code == HTTPStatus.OK
+        assert response.mimetype == 'text/plain'
+        assert b'gtpower_request_duration_seconds_bucket{endpoint="gtpower.getPowerData"' in response.data
@@ -0,0 +1,64 @@
+"""
+pytest tests for the monthly partitioning of the power table
+"""
+from datetime import datetime
+
+from click.testing import CliRunner
+from flask.cli import ScriptInfo
+
+from api.commands import partitions
+from api.partitions import Partition, add_months, add_partitions_statement, partition_table_statement, \
+    partitions_for, retirable_partitions, retire_statements
+
+PARTITIONS = [
+    Partition('p201609', None, datetime(2016, 10, 1), 25056),
+    Partition('p201610', datetime(2016, 10, 1), datetime(2016, 11, 1), 0),
+    Partition('p201611', datetime(2016, 11, 1), datetime(2016, 12, 1), 0),
+    Partition('pmax', datetime(2016, 12, 1), None, 0),
+]
+
+
+class TestPartitions:
+    def test_add_months(self):
+        assert add_months(datetime(2016, 11, 1), 2) == datetime(2017, 1, 1)
+        assert add_months(datetime(2017, 1, 1), -1) == datetime(2016, 12, 1)
+
+    def test_partitions_for_range(self):
+        def names(start, stop):
+            return [partition.name for partition in partitions_for(PARTITIONS, start, stop)]
+
+        assert names(datetime(2016, 9, 1), datetime(2016, 9, 3, 23, 45)) == ['p201609']
+        assert names(datetime(2016, 9, 15), datetime(2016, 10, 1)) == ['p201609', 'p201610']
+        assert names(datetime(2016, 10, 31, 23), datetime(2016, 11, 1, 1)) == ['p201610', 'p201611']
+        assert names(datetime(2015, 1, 1), datetime(2015, 2, 1)) == ['p201609']
+        assert names(datetime(2017, 1, 1), datetime(2017, 2, 1)) == ['pmax']
+
+    def test_partition_table_statement(self):
+        assert partition_table_statement(datetime(2016, 9, 1), datetime(2016, 10, 1)) == (
+            "ALTER TABLE power PARTITION BY RANGE COLUMNS(timestamp) ("
+            "PARTITION p201609 VALUES LESS THAN ('2016-10-01 00:00:00'), "
+            "PARTITION p201610 VALUES LESS THAN ('2016-11-01 00:00:00'), "
+            "PARTITION pmax VALUES LESS THAN (MAXVALUE))")
+
+    def test_add_partitions_statement(self):
+        assert add_partitions_statement(PARTITIONS, datetime(2016, 11, 1)) is None
+        assert add_partitions_statement(PARTITIONS, datetime(2017, 1, 1)) == (
+            "ALTER TABLE power REORGANIZE PARTITION pmax INTO ("
+            "PARTITION p201612 VALUES LESS THAN ('2017-01-01 00:00:00'), "
+            "PARTITION p201701 VALUES LESS THAN ('2017-02-01 00:00:00'), "
+            "PARTITION pmax VALUES LESS THAN (MAXVALUE))")
+
+    def test_retire(self):
+        retired = retirable_partitions(PARTITIONS, datetime(2016, 11, 1))
+        assert [partition.name for partition in retired] == ['p201609', 'p201610']
+        assert retire_statements(retired[1], archive=True) == [
+            'CREATE TABLE power_archive_201610 LIKE power',
+            'ALTER TABLE power_archive_201610 REMOVE PARTITIONING',
+            'ALTER TABLE power EXCHANGE PARTITION p201610 WITH TABLE power_archive_201610',
+            'ALTER TABLE power DROP PARTITION p201610']
+        assert retire_statements(retired[0], archive=False) == ['ALTER TABLE power DROP PARTITION p201609']
+
+    def test_commands_require_mysql(self, app):
+        result = CliRunner().invoke(partitions, ['list'], obj=ScriptInfo(create_app=lambda *args: app))
+        assert result.exit_code != 0
+        assert 'Partitioning requires MySQL' in result.output
@@ -0,0 +1,45 @@
+"""
+pytest tests for the database connection pool metrics
+"""
+from http import HTTPStatus
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError
+
+from api.pool import PoolStats, TimedQueuePool, pool_stats
+
+RANGE = {'start': '2016-09-01 00:00:00', 'stop': '2016-09-03 23:59:59'}
+
+
+class TestPool:
+    def test_checkout_waits_are_recorded(self):
+        engine = create_engine('sqlite://', poolclass=TimedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.1)
+        before = pool_stats.to_dict()
+        connection = engine.connect()
+        with pytest.raises(TimeoutError):
+            engine.connect()
+        connection.close()
+        engine.connect().close()
+
+        after = pool_stats.to_dict()
+        assert after['checkouts'] - before['checkouts'] == 3
+        assert after['timeouts'] - before['timeouts'] == 1
+        assert after['wait_seconds_max'] >= 0.1
+
+    def test_slow_checkouts_are_logged(self, caplog):
+        stats = PoolStats(warn_after=0.5)
+        stats.observe(0.1)
+        stats.observe(0.8)
+        assert len(caplog.records) == 1
+        assert stats.to_dict()['wait_seconds_total'] == pytest.approx(0.9)
+
+    def test_pool_timeout_is_service_unavailable(self, test_client, monkeypatch):
+        import api.routes
+
+        def timeout(*args):
+            raise TimeoutError()
+        monkeypatch.setattr(api.routes, 'readings_etag', timeout)
+        response = test_client.get('/facilities/power/026/', query_string=RANGE)
+        assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+        assert response.headers['Retry-After'] == '1'
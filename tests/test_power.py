@@ -1,6 +1,7 @@
 """
 pytest integration tests for power API
 """
+from datetime import datetime, timedelta, timezone
 from http import HTTPStatus
 
 import pytest
@@ -9,7 +10,377 @@ from flask import url_for, json
 
 from api.models import Power, Users, Sensors
 
+RANGE = {'start': '2016-09-01 00:00:00', 'stop': '2016-09-03 23:59:59'}
+
+
 class TestPowerApi:
-    # TODO: Write test cases
+    def test_building_id_is_derived_on_insert(self, db, load_test_db):
+        assert db.session.query(Power).filter(Power.building_id.is_(None)).count() == 0
+        sources = db.session.query(Power.source_name).filter(Power.building_id == '026').distinct().all()
+        assert sources
+        assert all('B026' in source_name for (source_name,) in sources)
+
+    def test_backfill_replaces_superseded_index(self, app, db, load_test_db):
+        from click.testing import CliRunner
+        from flask.cli import ScriptInfo
+        from sqlalchemy import inspect
+        from api.commands import backfill_building_ids
+
+        def indexes():
+            return set(index['name'] for index in inspect(db.engine).get_indexes('power'))
+
+        # a database set up when the index did not include source_name yet
+        db.engine.execute('DROP INDEX ix_power_building_type_timestamp_source')
+        db.engine.execute('CREATE INDEX ix_power_building_type_timestamp ON power (building_id, type, timestamp)')
+        result = CliRunner().invoke(backfill_building_ids, obj=ScriptInfo(create_app=lambda *args: app))
+        assert result.exit_code == 0, result.output
+        assert 'ix_power_building_type_timestamp_source' in indexes()
+        assert 'ix_power_building_type_timestamp' not in indexes()
+
     def test_get_energy_data(self, db, load_test_db, test_client):
-        response = test_client.get('/energy/026')
+        response = test_client.get('/facilities/energy/026/', query_string=RANGE)
+        assert response.status_code == HTTPStatus.OK
+        readings = json.loads(response.data)
+        assert readings
+        assert all(reading['b_id'] == '026' and reading['units'] == 'kWh' for reading in readings)
+        assert [r['timestamp'] for r in readings] == sorted(r['timestamp'] for r in readings)
+
+    def test_get_power_data(self, db, load_test_db, test_client):
+        response = test_client.get('/facilities/power/26/', query_string=RANGE)
+        assert response.status_code == HTTPStatus.OK
+        readings = json.loads(response.data)
+        expected = db.session.query(Power).filter(Power.source_name.like('%B026%'), Power.type == 'Active Power').count()
+        assert len(readings) == expected
+        assert all(reading['units'] == 'kW' for reading in readings)
+
+    def test_get_power_data_requires_range(self, load_test_db, test_client):
+        assert test_client.get('/facilities/power/026/').status_code == HTTPStatus.BAD_REQUEST
+        response = test_client.get('/facilities/power/026/', query_string={'start': 'yesterday', 'stop': 'today'})
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    def test_get_power_data_unknown_building(self, load_test_db, test_client):
+        response = test_client.get('/facilities/power/358/', query_string=RANGE)
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+    def test_get_sensor_data(self, load_test_db, test_client):
+        response = test_client.get('/facilities/sensor/GTECH.B026E_MH1/', query_string=RANGE)
+        assert response.status_code == HTTPStatus.OK
+        readings = json.loads(response.data)
+        assert readings
+        assert all(reading['source_name'] == 'GTECH.B026E_MH1' for reading in readings)
+        response = test_client.get('/facilities/sensor/B026E_MH1/', query_string=RANGE)
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+    def test_get_power_data_resampled(self, db, load_test_db, test_client):
+        raw = json.loads(test_client.get('/facilities/power/026/', query_string=RANGE).data)
+        response = test_client.get('/facilities/power/026/', query_string=dict(RANGE, resolution='hour', agg='max'))
+        assert response.status_code == HTTPStatus.OK
+        hourly = json.loads(response.data)
+        assert 0 < len(hourly) < len(raw)
+        assert all(reading['timestamp'].endswith(':00:00') for reading in hourly)
+
+        first_hour = [float(r['value_read']) for r in raw
+                      if r['source_name'] == 'GTECH.B026E_MS2' and r['timestamp'].startswith('2016-09-01T00')]
+        peak = [r for r in hourly if r['source_name'] == 'GTECH.B026E_MS2' and r['timestamp'] == '2016-09-01T00:00:00']
+        assert float(peak[0]['value_read']) == pytest.approx(max(first_hour))
+
+    @pytest.mark.parametrize('agg', ['mean', 'min', 'max', 'sum', 'last'])
+    def test_aggregate_rows_matches_sql(self, app, load_test_db, agg):
+        from api.queries import aggregate_readings, aggregate_rows, building_readings, POWER_TYPE, RESOLUTIONS
+        from api.helpers import parse_timestamp
+
+        query = building_readings('026', POWER_TYPE, parse_timestamp(RANGE['start']), parse_timestamp(RANGE['stop']))
+        fallback = aggregate_rows(query, RESOLUTIONS['day'], agg)
+        assert len(fallback) == len(query.with_entities(Power.source_name).order_by(None).distinct().all()) * 3
+        if agg != 'last':
+            sql = aggregate_readings(query, 'day', agg).all()
+            assert [row[0] for row in sql] == [row[0] for row in fallback]
+            assert [float(row[2]) for row in sql] == pytest.approx([float(row[2]) for row in fallback])
+
+    def test_get_power_data_invalid_resolution(self, load_test_db, test_client):
+        response = test_client.get('/facilities/power/026/', query_string=dict(RANGE, resolution='week'))
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        response = test_client.get('/facilities/power/026/', query_string=dict(RANGE, agg='max'))
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    def test_get_power_data_streamed(self, load_test_db, test_client):
+        # B026 has several thousand power readings, so the stream spans multiple batches
+        buffered = json.loads(test_client.get('/facilities/power/026/', query_string=RANGE).data)
+        response = test_client.get('/facilities/power/026/', query_string=dict(RANGE, stream='true'))
+        assert response.status_code == HTTPStatus.OK
+        assert response.is_streamed
+        assert json.loads(response.get_data()) == buffered
+
+        response = test_client.get('/facilities/power/026/', query_string=dict(RANGE, stream='true', resolution='15min', agg='last'))
+        assert len(json.loads(response.get_data())) == len(buffered)
+
+        response = test_client.get('/facilities/power/358/', query_string=dict(RANGE, stream='true'))
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+    def test_get_power_data_paged(self, load_test_db, test_client):
+        everything = json.loads(test_client.get('/facilities/power/026/', query_string=RANGE).data)
+        pages = []
+        response = test_client.get('/facilities/power/026/', query_string=dict(RANGE, limit=1000))
+        while True:
+            assert response.status_code == HTTPStatus.OK
+            pages.extend(json.loads(response.data))
+            if 'Link' not in response.headers:
+                break
+            next_url = response.headers['Link'].split(';')[0].strip('<>')
+            response = test_client.get(next_url)
+        assert pages == everything
+        assert len(everything) > 1000
+
+    def test_get_sensor_data_paged_invalid(self, load_test_db, test_client):
+        url = '/facilities/sensor/GTECH.B026E_MH1/'
+        assert test_client.get(url, query_string=dict(RANGE, limit=0)).status_code == HTTPStatus.BAD_REQUEST
+        assert test_client.get(url, query_string=dict(RANGE, limit=10, cursor='nonsense')).status_code == HTTPStatus.BAD_REQUEST
+        assert test_client.get(url, query_string=dict(RANGE, cursor='nonsense')).status_code == HTTPStatus.BAD_REQUEST
+        response = test_client.get(url, query_string=dict(RANGE, limit=10, resolution='hour'))
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    def test_get_power_data_columnar(self, load_test_db, test_client):
+        rows = json.loads(test_client.get('/facilities/power/026/', query_string=RANGE).data)
+        response = test_client.get('/facilities/power/026/', query_string=dict(RANGE, format='columnar'))
+        assert response.status_code == HTTPStatus.OK
+        sensors = json.loads(response.data)
+        assert len(sensors) == len(set(row['source_name'] for row in rows))
+        assert sum(len(sensor['values']) for sensor in sensors) == len(rows)
+        assert len(response.data) * 5 < len(json.dumps(rows))
+
+        sensor = [sensor for sensor in sensors if sensor['source_name'] == 'GTECH.B026E_MS2'][0]
+        assert sensor['b_id'] == '026' and sensor['units'] == 'kW'
+        assert len(sensor['timestamps']) == len(sensor['values'])
+        assert sensor['values'][0] == pytest.approx(float(rows[0]['value_read']))
+
+        delta = json.loads(test_client.get('/facilities/power/026/', query_string=dict(RANGE, format='columnar', delta='true')).data)
+        encoded = [s for s in delta if s['source_name'] == 'GTECH.B026E_MS2'][0]['timestamps']
+        assert encoded[0] == sensor['timestamps'][0]
+        assert set(encoded[1:]) == {15 * 60}
+
+    def test_get_power_data_unknown_format(self, load_test_db, test_client):
+        response = test_client.get('/facilities/power/026/', query_string=dict(RANGE, format='xml'))
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    def test_get_power_data_arrow(self, load_test_db, test_client):
+        pa = pytest.importorskip('pyarrow')
+        rows = json.loads(test_client.get('/facilities/power/026/', query_string=RANGE).data)
+        response = test_client.get('/facilities/power/026/', query_string=RANGE,
+                                   headers={'Accept': 'application/vnd.apache.arrow.stream'})
+        assert response.status_code == HTTPStatus.OK
+        assert response.mimetype == 'application/vnd.apache.arrow.stream'
+        table = pa.ipc.open_stream(response.get_data()).read_all()
+        assert table.num_rows == len(rows)
+        assert table.column('source_name').to_pylist()[0] == rows[0]['source_name']
+        assert table.column('value_read').to_pylist()[0] == pytest.approx(float(rows[0]['value_read']))
+
+    def test_get_sensor_data_parquet(self, load_test_db, test_client):
+        pytest.importorskip('pyarrow')
+        import io
+        import pyarrow.parquet as pq
+        rows = json.loads(test_client.get('/facilities/sensor/GTECH.B026E_MS2/', query_string=RANGE).data)
+        response = test_client.get('/facilities/sensor/GTECH.B026E_MS2/', query_string=dict(RANGE, format='parquet'))
+        assert response.status_code == HTTPStatus.OK
+        table = pq.read_table(io.BytesIO(response.get_data()))
+        assert table.num_rows == len(rows)
+        assert set(table.column('units').to_pylist()) == {'kW', 'kWh'}
+
+    def test_export_building_csv(self, load_test_db, test_client):
+        import csv
+        import gzip
+        response = test_client.get('/facilities/export/026.csv', query_string=RANGE, headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == HTTPStatus.OK
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'B026.csv' in response.headers['Content-Disposition']
+        rows = list(csv.reader(gzip.decompress(response.get_data()).decode('utf-8').splitlines()))
+        assert rows[0] == ['b_id', 'source_name', 'source_type', 'timestamp', 'units', 'value_read']
+        power = json.loads(test_client.get('/facilities/power/026/', query_string=RANGE).data)
+        energy = json.loads(test_client.get('/facilities/energy/026/', query_string=RANGE).data)
+        assert len(rows) - 1 == len(power) + len(energy)
+
+        assert test_client.get('/facilities/export/026.csv').status_code == HTTPStatus.BAD_REQUEST
+        assert test_client.get('/facilities/export/358.csv', query_string=RANGE).status_code == HTTPStatus.NOT_FOUND
+
+    def test_export_sensor_csv(self, load_test_db, test_client):
+        response = test_client.get('/facilities/export/sensor/GTECH.B026E_MS2.csv', query_string=RANGE)
+        assert response.status_code == HTTPStatus.OK
+        assert 'Content-Encoding' not in response.headers
+        lines = response.get_data().decode('utf-8').splitlines()
+        assert lines[0] == 'source_name,source_type,timestamp,units,value_read'
+        assert lines[1].startswith('GTECH.B026E_MS2,Electrical mains transformer (4160V - 480V),2016-09-01 00:00:00,')
+
+    def test_get_power_data_conditional(self, load_test_db, test_client):
+        response = test_client.get('/facilities/power/026/', query_string=RANGE)
+        etag, weak = response.get_etag()
+        assert etag and not weak
+        assert response.last_modified == datetime(2016, 9, 3, 23, 45, tzinfo=timezone.utc)
+        # only windows ending before the newest stored reading are immutable
+        settled = test_client.get('/facilities/power/026/', query_string=dict(RANGE, stop='2016-09-02 23:59:59'))
+        assert 'immutable' in settled.headers['Cache-Control']
+
+        not_modified = test_client.get('/facilities/power/026/', query_string=RANGE,
+                                       headers={'If-None-Match': '"{0}"'.format(etag)})
+        assert not_modified.status_code == HTTPStatus.NOT_MODIFIED
+        assert not_modified.data == b''
+        assert not_modified.get_etag() == (etag, False)
+
+        # the format is negotiated from the Accept header unless set with ?format=
+        assert 'Accept' in response.vary and 'Accept' in not_modified.vary
+        explicit = test_client.get('/facilities/power/026/', query_string=dict(RANGE, format='json'))
+        assert 'Accept' not in explicit.vary
+
+        hourly = test_client.get('/facilities/power/026/', query_string=dict(RANGE, resolution='hour'),
+                                 headers={'If-None-Match': '"{0}"'.format(etag)})
+        assert hourly.status_code == HTTPStatus.OK
+        assert hourly.get_etag()[0] != etag
+
+    def test_get_power_data_conditional_compressed(self, load_test_db, test_client):
+        response = test_client.get('/facilities/power/026/', query_string=RANGE, headers={'Accept-Encoding': 'gzip'})
+        etag, _ = response.get_etag()
+        assert etag.endswith('-gzip')
+        not_modified = test_client.get('/facilities/power/026/', query_string=RANGE,
+                                       headers={'Accept-Encoding': 'gzip', 'If-None-Match': '"{0}"'.format(etag)})
+        assert not_modified.status_code == HTTPStatus.NOT_MODIFIED
+        # the validator of the stored variant, and the Vary of the full response
+        assert not_modified.get_etag() == (etag, False)
+        assert set(not_modified.vary) == set(response.vary) == {'Accept', 'Accept-Encoding'}
+
+    def test_get_power_data_batch(self, load_test_db, test_client):
+        body = dict(RANGE, ids=['26', '027', '999'])
+        response = test_client.post('/facilities/power/batch', json=body)
+        assert response.status_code == HTTPStatus.OK
+        batch = json.loads(response.data)
+        assert sorted(batch) == ['027', '26', '999']
+        assert batch['999'] == []
+        single = json.loads(test_client.get('/facilities/power/26/', query_string=RANGE).data)
+        assert sorted(batch['26'], key=lambda r: (r['timestamp'], r['source_name'])) == \
+            sorted(single, key=lambda r: (r['timestamp'], r['source_name']))
+
+        hourly = json.loads(test_client.post('/facilities/energy/batch', json=dict(body, resolution='hour')).data)
+        assert 0 < len(hourly['26']) < len(batch['26'])
+        assert {reading['units'] for reading in hourly['26']} == {'kWh'}
+
+    def test_get_sensor_data_batch(self, load_test_db, test_client):
+        ids = ['GTECH.B026E_MS2', 'GTECH.B026E_MH1']
+        batch = json.loads(test_client.post('/facilities/sensor/batch', json=dict(RANGE, ids=ids)).data)
+        for sensor_id in ids:
+            single = json.loads(test_client.get('/facilities/sensor/{0}/'.format(sensor_id), query_string=RANGE).data)
+            assert batch[sensor_id] == single
+
+    def test_batch_invalid(self, app, load_test_db, test_client):
+        assert test_client.post('/facilities/power/batch', data='ids').status_code == HTTPStatus.BAD_REQUEST
+        assert test_client.post('/facilities/power/batch', json=RANGE).status_code == HTTPStatus.BAD_REQUEST
+        assert test_client.post('/facilities/power/batch', json={'ids': ['026']}).status_code == HTTPStatus.BAD_REQUEST
+        too_many = dict(RANGE, ids=[str(b_id) for b_id in range(app.config['BATCH_MAX_IDS'] + 1)])
+        assert test_client.post('/facilities/power/batch', json=too_many).status_code == HTTPStatus.BAD_REQUEST
+        for body in (dict(RANGE, ids=['26', '026']), dict(RANGE, ids=['026', 26]),
+                     {'ids': ['026'], 'start': 20160901, 'stop': RANGE['stop']},
+                     dict(RANGE, ids=['026'], resolution=['hour']), dict(RANGE, ids=['026'], resolution='hour', agg=1)):
+            response = test_client.post('/facilities/power/batch', json=body)
+            assert response.status_code == HTTPStatus.BAD_REQUEST, body
+        sensors = dict(RANGE, ids=['GTECH.B026E_MS2', 'GTECH.B026E_MS2'])
+        assert test_client.post('/facilities/sensor/batch', json=sensors).status_code == HTTPStatus.BAD_REQUEST
+
+    def test_get_campus_power_data(self, load_test_db, test_client):
+        response = test_client.get('/facilities/campus/power/', query_string=RANGE)
+        assert response.status_code == HTTPStatus.OK
+        totals = json.loads(response.data)
+        assert len(totals) == 3 * 24 * 4
+        assert {total['units'] for total in totals} == {'kW'}
+        assert 'sensor_type' not in totals[0]
+
+        first = json.loads(test_client.get('/facilities/campus/power/', query_string=dict(
+            start='2016-09-01 00:00:00', stop='2016-09-01 00:00:00')).data)
+        readings = Power.query.filter_by(type='Active Power', timestamp=datetime(2016, 9, 1)).all()
+        assert float(first[0]['value_read']) == pytest.approx(sum(float(r.value_read) for r in readings))
+
+        # hourly totals are the mean load over the hour, not the sum of its four readings
+        hourly = json.loads(test_client.get('/facilities/campus/power/', query_string=dict(RANGE, resolution='hour')).data)
+        quarters = [float(total['value_read']) for total in totals[:4]]
+        assert float(hourly[0]['value_read']) == pytest.approx(sum(quarters) / 4)
+
+    def test_get_campus_power_data_by_sensor_type(self, load_test_db, test_client):
+        grouped = json.loads(test_client.get('/facilities/campus/power/', query_string=dict(
+            RANGE, resolution='day', group_by='sensor_type')).data)
+        mains = json.loads(test_client.get('/facilities/campus/power/', query_string=dict(
+            RANGE, resolution='day', sensor_type='EMS')).data)
+        assert {total['sensor_type'] for total in grouped} >= {'EMS'}
+        assert [float(total['value_read']) for total in grouped if total['sensor_type'] == 'EMS'] == \
+            pytest.approx([float(total['value_read']) for total in mains])
+
+        assert test_client.get('/facilities/campus/power/', query_string=dict(RANGE, sensor_type='XYZ')).status_code == \
+            HTTPStatus.BAD_REQUEST
+        assert test_client.get('/facilities/campus/power/', query_string=dict(RANGE, group_by='building')).status_code == \
+            HTTPStatus.BAD_REQUEST
+
+    def test_total_rows_matches_sql(self, app, load_test_db):
+        from api.queries import campus_readings, campus_sources, campus_totals, total_rows, POWER_TYPE, RESOLUTIONS
+        from api.helpers import parse_timestamp, sensortype_code_mapper
+
+        start, stop = parse_timestamp(RANGE['start']), parse_timestamp(RANGE['stop'])
+        codes = dict((source, sensortype_code_mapper(source)) for source in campus_sources(POWER_TYPE, start, stop))
+        query = campus_readings(POWER_TYPE, start, stop)
+        sql = campus_totals(query, 'hour', codes).all()
+        fallback = total_rows(query, RESOLUTIONS['hour'], codes)
+        assert [(row[0], row[3]) for row in sql] == [(row[0], row[3]) for row in fallback]
+        assert [float(row[2]) for row in sql] == pytest.approx([float(row[2]) for row in fallback])
+
+    def test_get_energy_data_consumption(self, db, load_test_db, test_client):
+        raw = json.loads(test_client.get('/facilities/sensor/GTECH.B026E_MH1/', query_string=RANGE).data)
+        response = test_client.get('/facilities/sensor/GTECH.B026E_MH1/', query_string=dict(RANGE, consumption='true'))
+        assert response.status_code == HTTPStatus.OK
+        deltas = json.loads(response.data)
+        # the first reading of the sample has no predecessor
+        assert len(deltas) == len(raw) - 1
+        assert float(deltas[0]['value_read']) == pytest.approx(float(raw[1]['value_read']) - float(raw[0]['value_read']))
+
+        daily = json.loads(test_client.get('/facilities/sensor/GTECH.B026E_MH1/', query_string=dict(
+            RANGE, consumption='true', resolution='day')).data)
+        assert [reading['timestamp'] for reading in daily] == \
+            ['2016-09-01T00:00:00', '2016-09-02T00:00:00', '2016-09-03T00:00:00']
+        assert sum(float(reading['value_read']) for reading in daily) == \
+            pytest.approx(float(raw[-1]['value_read']) - float(raw[0]['value_read']))
+
+        building = json.loads(test_client.get('/facilities/energy/026/', query_string=dict(
+            RANGE, consumption='true', resolution='day')).data)
+        assert [reading for reading in building if reading['source_name'] == 'GTECH.B026E_MH1'] == \
+            [dict(reading, b_id='026') for reading in daily]
+        assert test_client.get('/facilities/energy/026/', query_string=dict(
+            RANGE, consumption='true', agg='sum')).status_code == HTTPStatus.BAD_REQUEST
+        # a late reading just before the window changes its first consumption, and so the ETag
+        consumption = dict(RANGE, consumption='true')
+        etag = test_client.get('/facilities/sensor/GTECH.B026E_MH1/', query_string=consumption).get_etag()[0]
+        db.session.add(Power(timestamp=datetime(2016, 8, 31, 23, 55), type='Active Energy Delivered',
+                             value_read=float(raw[0]['value_read']) - 1, source_name='GTECH.B026E_MH1'))
+        db.session.commit()
+        try:
+            assert test_client.get('/facilities/sensor/GTECH.B026E_MH1/', query_string=consumption).get_etag()[0] != etag
+        finally:
+            Power.query.filter(Power.timestamp == datetime(2016, 8, 31, 23, 55)).delete(synchronize_session=False)
+            db.session.commit()
+
+        power = test_client.get('/facilities/power/026/', query_string=dict(RANGE, consumption='true'))
+        assert power.status_code == HTTPStatus.BAD_REQUEST
+        assert 'energy' in json.loads(power.data)['message']
+
+    def test_consumption_rows_matches_sql(self, app, load_test_db):
+        from api.queries import building_readings, consumption_readings, consumption_rows, ENERGY_TYPE
+        from api.helpers import parse_timestamp
+
+        start, stop = parse_timestamp('2016-09-02 00:00:00'), parse_timestamp(RANGE['stop'])
+        query = building_readings('026', ENERGY_TYPE, start - timedelta(hours=6), stop)
+        for resolution in (None, 'hour'):
+            sql = consumption_readings(query, start, 6 * 60 * 60, resolution).all()
+            fallback = consumption_rows(query, start, 6 * 60 * 60, resolution)
+            assert [(row[0], row[3]) for row in sql] == [(row[0], row[3]) for row in fallback]
+            assert [float(row[2]) for row in sql] == pytest.approx([float(row[2]) for row in fallback])
+        assert sql[0][0] == start
+
+    def test_consumption_rows_resets_and_gaps(self):
+        from api.queries import consumption_rows, ENERGY_TYPE
+
+        readings = [(datetime(2016, 9, 1, 0, minute), ENERGY_TYPE, value, 'GTECH.B026E_MH1\r')
+                    for minute, value in ((0, 100), (15, 110), (30, 4), (45, 9))]
+        readings.append((datetime(2016, 9, 1, 5), ENERGY_TYPE, 20, 'GTECH.B026E_MH1\r'))
+        deltas = consumption_rows(readings, datetime(2016, 9, 1), 60 * 60)
+        assert [row[2] for row in deltas] == [10, 4, 5]
@@ -0,0 +1,141 @@
+"""
+pytest tests for the push ingestion endpoint
+"""
+import json
+from http import HTTPStatus
+
+import pytest
+from sqlalchemy import exc
+
+from api.extensions import push_queue
+from api.models import Power
+
+SENSOR = 'GTECH.B998E_MS1'
+AUTH = {'Authorization': 'Bearer test-token'}
+
+
+def reading(minute, value=1.0):
+    return dict(timestamp='2017-02-01 00:{0:02d}:00'.format(minute), type='Active Power', value_read=value,
+                source_name=SENSOR)
+
+
+def stored():
+    return [(r.timestamp.minute, float(r.value_read)) for r in Power.query.filter_by(source_name=SENSOR)
+            .order_by(Power.timestamp)]
+
+
+@pytest.fixture
+def clean_queue(app, db):
+    push_queue.take()
+    yield
+    push_queue.take()
+    Power.query.filter_by(source_name=SENSOR).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def push(test_client, readings, headers=AUTH):
+    return test_client.post('/facilities/readings', data=json.dumps(dict(readings=readings)),
+                            content_type='application/json', headers=headers)
+
+
+class TestPush:
+    def test_requires_token(self, test_client, clean_queue):
+        assert push(test_client, [reading(0)], headers={}).status_code == HTTPStatus.UNAUTHORIZED
+        response = push(test_client, [reading(0)], headers={'Authorization': 'Bearer wrong'})
+        assert response.status_code == HTTPStatus.UNAUTHORIZED
+        assert push_queue.pending == 0
+
+    def test_disabled_without_tokens(self, app, test_client, clean_queue, monkeypatch):
+        monkeypatch.setitem(app.config, 'INGEST_TOKENS', [])
+        assert push(test_client, [reading(0)]).status_code == HTTPStatus.FORBIDDEN
+
+    def test_malformed_batch_is_rejected(self, test_client, clean_queue):
+        response = push(test_client, [reading(0), dict(reading(1), value_read='high')])
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        assert 'readings[1]' in json.loads(response.data)['message']
+        for value in ('nan', 'inf', '-Infinity'):
+            response = push(test_client, [dict(reading(0), value_read=value)])
+            assert response.status_code == HTTPStatus.BAD_REQUEST
+            assert 'finite' in json.loads(response.data)['message']
+        for invalid in (dict(value_read=True), dict(type='Reactive Power'), dict(timestamp='2030-01-01 00:00:00')):
+            assert push(test_client, [dict(reading(0), **invalid)]).status_code == HTTPStatus.BAD_REQUEST
+        assert push_queue.pending == 0
+
+    def test_future_readings_are_rejected(self, app, test_client, clean_queue, monkeypatch):
+        from datetime import datetime, timedelta
+        monkeypatch.setitem(app.config, 'INGEST_MAX_FUTURE', 60)
+        soon = (datetime.now() + timedelta(seconds=30)).strftime('%Y-%m-%d %H:%M:%S')
+        later = (datetime.now() + timedelta(minutes=5)).strftime('%Y-%m-%d %H:%M:%S')
+        assert push(test_client, [dict(reading(0), timestamp=soon)]).status_code == HTTPStatus.ACCEPTED
+        response = push(test_client, [dict(reading(0), timestamp=later)])
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        assert 'future' in json.loads(response.data)['message']
+        assert push_queue.pending == 1
+
+    def test_readings_are_queued_then_written(self, db, test_client, clean_queue):
+        response = push(test_client, [reading(0, 1.5), reading(1, 2.5)])
+        assert response.status_code == HTTPStatus.ACCEPTED
+        assert json.loads(response.data) == dict(accepted=2, queued=2)
+        assert stored() == []
+
+        # a retried push is stored once
+        push(test_client, [reading(1, 2.5), reading(2, 3.5)])
+        assert push_queue.flush() == 3
+        assert stored() == [(0, 1.5), (1, 2.5), (2, 3.5)]
+        assert Power.query.filter_by(source_name=SENSOR).first().building_id == '998'
+
+    def test_full_batch_is_flushed(self, app, test_client, clean_queue, monkeypatch):
+        monkeypatch.setitem(app.config, 'INGEST_FLUSH_ROWS', 3)
+        push(test_client, [reading(0), reading(1)])
+        assert stored() == []
+        push(test_client, [reading(2)])
+        assert push_queue.pending == 0
+        assert len(stored()) == 3
+
+    def test_full_queue_returns_429(self, app, test_client, clean_queue, monkeypatch):
+        monkeypatch.setitem(app.config, 'INGEST_QUEUE_MAX_ROWS', 2)
+        assert push(test_client, [reading(0), reading(1)]).status_code == HTTPStatus.ACCEPTED
+        response = push(test_client, [reading(2)])
+        assert response.status_code == HTTPStatus.TOO_MANY_REQUESTS
+        assert response.headers['Retry-After'] == '1'
+        assert push_queue.pending == 2
+
+    def test_failed_flush_is_retried(self, test_client, clean_queue, monkeypatch):
+        push(test_client, [reading(0), reading(1)])
+
+        def fail(rows):
+            raise exc.OperationalError('INSERT', {}, Exception('database is down'))
+        monkeypatch.setattr('api.ingest.insert_readings', fail)
+        assert push_queue.flush() is None
+        assert push_queue.pending == 2
+
+        monkeypatch.undo()
+        assert push_queue.flush() == 2
+        assert push_queue.pending == 0
+
+    def test_rejected_rows_are_dropped(self, test_client, clean_queue, monkeypatch):
+        from api.ingest import insert_readings
+        push(test_client, [reading(0), reading(1, -1.0), reading(2)])
+
+        def reject_negative(rows):
+            if any(row['value_read'] < 0 for row in rows):
+                raise exc.DataError('INSERT', {}, Exception('out of range value'))
+            return insert_readings(rows)
+        monkeypatch.setattr('api.ingest.insert_readings', reject_negative)
+        assert push_queue.flush() == 2
+        assert push_queue.pending == 0
+        assert stored() == [(0, 1.0), (2, 1.0)]
+
+    def test_flushed_readings_are_served_from_the_cache(self, app, test_client, clean_queue, monkeypatch):
+        from api.extensions import cache
+        monkeypatch.setitem(app.config, 'CACHE_ENABLED', True)
+        window = {'start': '2017-02-01 00:00:00', 'stop': '2017-02-01 23:59:59'}
+        cache.clear()
+        try:
+            for minute in (0, 1):
+                push(test_client, [reading(minute)])
+                push_queue.flush()
+                readings = json.loads(test_client.get('/facilities/sensor/{0}/'.format(SENSOR), query_string=window).data)
+                assert len(readings) == minute + 1
+        finally:
+            cache.clear()
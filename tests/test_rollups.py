@@ -0,0 +1,116 @@
+"""
+pytest tests for the precomputed power rollups
+"""
+from http import HTTPStatus
+
+import pytest
+
+from flask import json
+
+from api.models import Power, PowerHourly, PowerDaily, RollupWatermark
+from api.rollups import refresh_rollup, rollup_for
+
+RANGE = {'start': '2016-09-01 00:00:00', 'stop': '2016-09-03 11:59:59'}
+
+
+@pytest.fixture(scope='module')
+def rollups(db, load_test_db):
+    for model in (PowerHourly, PowerDaily):
+        refresh_rollup(model, full=True)
+    yield
+    for model in (PowerHourly, PowerDaily):
+        db.session.query(model).delete()
+    db.session.query(RollupWatermark).delete()
+    db.session.commit()
+
+
+class TestRollups:
+    def test_refresh_covers_every_reading(self, db, rollups):
+        assert db.session.query(db.func.sum(PowerDaily.value_count)).scalar() == db.session.query(Power).count()
+        assert RollupWatermark.query.get('power_hourly').watermark == db.session.query(db.func.max(Power.timestamp)).scalar()
+
+    def test_refresh_is_incremental(self, db, rollups):
+        sensors = db.session.query(Power.source_name, Power.type).distinct().count()
+        assert refresh_rollup(PowerHourly) == sensors
+        assert refresh_rollup(PowerDaily) == sensors
+        assert db.session.query(db.func.sum(PowerHourly.value_count)).scalar() == db.session.query(Power).count()
+
+    def test_rollup_for(self, rollups):
+        from api.helpers import parse_timestamp
+        start, stop = parse_timestamp(RANGE['start']), parse_timestamp(RANGE['stop'])
+        assert rollup_for('day', start, parse_timestamp('2016-09-02 23:59:59')) is PowerDaily
+        assert rollup_for('hour', start, stop) is PowerHourly
+        assert rollup_for('15min', start, stop) is None
+        # partial buckets at either end, or buckets that may still receive readings, are served from raw rows
+        assert rollup_for('hour', parse_timestamp('2016-09-01 00:30:00'), stop) is None
+        assert rollup_for('hour', start, parse_timestamp('2016-09-03 12:00:00')) is None
+        assert rollup_for('day', start, parse_timestamp('2016-09-03 23:59:59')) is None
+
+    @pytest.mark.parametrize('agg', ['mean', 'min', 'max', 'sum', 'last'])
+    def test_rollup_matches_raw(self, app, rollups, agg):
+        from api.queries import aggregate_rows, building_readings, POWER_TYPE
+        from api.helpers import parse_timestamp
+
+        query = building_readings('026', POWER_TYPE, parse_timestamp(RANGE['start']), parse_timestamp(RANGE['stop']))
+        expected = aggregate_rows(query, PowerHourly.bucket_seconds, agg)
+        with app.test_client() as client:
+            response = client.get('/facilities/power/026/', query_string=dict(RANGE, resolution='hour', agg=agg))
+        assert response.status_code == HTTPStatus.OK
+        readings = json.loads(response.data)
+        assert len(readings) == len(expected)
+        assert [float(r['value_read']) for r in readings] == pytest.approx([float(row[2]) for row in expected])
+
+    @pytest.mark.parametrize('agg', ['mean', 'min', 'max', 'sum', 'last'])
+    def test_coarser_resolution_from_finer_rollup(self, app, rollups, monkeypatch, agg):
+        from api.queries import aggregate_rows, building_readings, POWER_TYPE
+        from api.helpers import parse_timestamp
+
+        day = dict(start='2016-09-01 00:00:00', stop='2016-09-02 23:59:59')
+        # without the daily rollup, days are combined from hourly buckets
+        monkeypatch.setattr('api.rollups.ROLLUPS', (PowerHourly,))
+        assert rollup_for('day', parse_timestamp(day['start']), parse_timestamp(day['stop'])) is PowerHourly
+
+        query = building_readings('026', POWER_TYPE, parse_timestamp(day['start']), parse_timestamp(day['stop']))
+        expected = aggregate_rows(query, PowerDaily.bucket_seconds, agg)
+        with app.test_client() as client:
+            response = client.get('/facilities/power/026/', query_string=dict(day, resolution='day', agg=agg))
+        readings = json.loads(response.data)
+        assert [(r['source_name'], r['timestamp']) for r in readings] == \
+            [(row[3].rstrip('\r'), row[0].isoformat()) for row in expected]
+        assert [float(r['value_read']) for r in readings] == pytest.approx([float(row[2]) for row in expected])
+
+    def test_etag_follows_the_rollup(self, db, app, rollups):
+        from datetime import datetime
+        query = dict(RANGE, resolution='hour')
+        with app.test_client() as client:
+            etag = client.get('/facilities/power/026/', query_string=query).get_etag()[0]
+            # a late reading changes nothing the rollup answers with until a refresh folds it in
+            db.session.add(Power(timestamp=datetime(2016, 9, 2, 0, 5), type='Active Power', value_read=42,
+                                 source_name='GTECH.B026E_MS2'))
+            db.session.commit()
+            try:
+                assert client.get('/facilities/power/026/', query_string=query).get_etag()[0] == etag
+                refresh_rollup(PowerHourly, full=True)
+                assert client.get('/facilities/power/026/', query_string=query).get_etag()[0] != etag
+            finally:
+                Power.query.filter(Power.timestamp == datetime(2016, 9, 2, 0, 5)).delete(synchronize_session=False)
+                db.session.commit()
+                refresh_rollup(PowerHourly, full=True)
+
+    def test_full_refresh_keeps_retired_months(self, db, rollups):
+        from datetime import datetime
+        retired = Power.query.filter(Power.timestamp < datetime(2016, 9, 2))
+        columns = [column.name for column in Power.__table__.columns]
+        rows = [dict(zip(columns, row)) for row in db.session.query(*Power.__table__.columns)
+                .filter(Power.timestamp < datetime(2016, 9, 2))]
+        before = db.session.query(db.func.sum(PowerHourly.value_count)).scalar()
+        retired.delete(synchronize_session=False)
+        db.session.commit()
+        try:
+            refresh_rollup(PowerHourly, full=True)
+            assert db.session.query(db.func.sum(PowerHourly.value_count)).scalar() == before
+            assert PowerHourly.query.filter(PowerHourly.timestamp < datetime(2016, 9, 2)).count() > 0
+        finally:
+            db.session.execute(Power.__table__.insert(), rows)
+            db.session.commit()
+            refresh_rollup(PowerHourly, full=True)
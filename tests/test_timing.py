@@ -0,0 +1,33 @@
+"""
+pytest tests for the request timing and slow query log
+"""
+import logging
+import re
+
+import pytest
+
+RANGE = {'start': '2016-09-01 00:00:00', 'stop': '2016-09-03 23:59:59'}
+
+
+@pytest.fixture
+def slow_query_threshold(app):
+    threshold = app.config['SLOW_QUERY_THRESHOLD']
+    app.config['SLOW_QUERY_THRESHOLD'] = 0
+    yield
+    app.config['SLOW_QUERY_THRESHOLD'] = threshold
+
+
+class TestTiming:
+    def test_server_timing_header(self, load_test_db, test_client):
+        response = test_client.get('/facilities/power/026/', query_string=RANGE)
+        match = re.match(r'db;dur=([\d.]+), serialize;dur=([\d.]+), total;dur=([\d.]+)$', response.headers['Server-Timing'])
+        db_time, serialize, total = (float(duration) for duration in match.groups())
+        assert db_time > 0 and serialize > 0
+        assert db_time + serialize <= total
+
+    def test_slow_queries_are_logged_with_their_plan(self, load_test_db, test_client, slow_query_threshold, caplog):
+        with caplog.at_level(logging.WARNING, logger='api.timing'):
+            test_client.get('/facilities/power/026/', query_string=RANGE)
+        slow = [record.getMessage() for record in caplog.records if record.name == 'api.timing']
+        assert any('FROM power' in message and 'Active Power' in message and 'ix_power_building_type_timestamp_source' in message
+                   for message in slow)